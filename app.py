@@ -1,84 +1,37 @@
-import os
-import sqlite3
 import datetime
 import hashlib
-import base64
+import os
 import time
-import json
 import streamlit as st
-from zhipuai import ZhipuAI  # 🔴 改动1：引入智谱库
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-import io
-import platform
 
-# ==========================================
-# 🤖 核心配置：使用智谱视觉模型
-# ==========================================
-# 智谱目前性价比最高且免费额度可用的是 glm-4v-flash
-MODEL_NAME = "glm-4v-flash"
-
-# ==========================================
-# 📖 1. 字典库 (保持不变)
-# ==========================================
-CLOUD_TRANSLATIONS = {
-    "积云": "Cumulus", "淡积云": "Cumulus humilis", "碎积云": "Cumulus fractus", "浓积云": "Cumulus congestus",
-    "层云": "Stratus", "雾": "Fog", "飞机尾迹": "Contrail",
-    "层积云": "Stratocumulus", "高积云": "Altocumulus", "高层云": "Altostratus",
-    "卷云": "Cirrus", "卷层云": "Cirrostratus", "卷积云": "Cirrocumulus", "密卷云": "Cirrus spissatus", "钩卷云": "Cirrus uncinus",
-    "雨层云": "Nimbostratus", "积雨云": "Cumulonimbus", "幡状云": "Virga",
-    "波状高积云": "Altocumulus undulatus", "透光高积云": "Altocumulus translucidus", "絮状高积云": "Altocumulus floccus", "堡状高积云": "Altocumulus castellanus",
-    "日晕": "Halo", "幻日": "Sun Dog", "彩虹": "Rainbow", "双彩虹": "Double Rainbow", "火彩虹": "Circumhorizontal Arc",
-    "云隙光": "Crepuscular Rays", "反云隙光": "Anticrepuscular Rays", "虹彩云": "Iridescence",
-    "乳状云": "Mammatus", "网状云": "Lacunosus", "糙面云": "Asperitas",
-    "荚状云": "Lenticularis", "夜光云": "Noctilucent", "滚轴云": "Roll Cloud", "管状云": "Tube Cloud",
-    "珠母云": "Nacreous", "马蹄云": "Horseshoe Vortex", "雨幡洞": "Fallstreak Hole",
-    "开尔文-赫姆霍兹波": "Kelvin-Helmholtz", "海啸云": "Shelf Cloud",
-    "红色精灵": "Red Sprite", "史蒂夫现象": "STEVE"
-}
-
-def get_bilingual_name(c_name):
-    en_name = CLOUD_TRANSLATIONS.get(c_name, "")
-    if en_name:
-        return f"{c_name} <span style='opacity:0.6; font-size:0.8em; font-family:serif;'>{en_name}</span>"
-    return c_name
-
-ACHIEVEMENTS = {
-    "👶 萌新入坑": {"clouds": ["积云", "层云", "飞机尾迹"], "icon": "🌱", "desc": "收集积云、层云或飞机尾迹中的任意 2 种"},
-    "☔ 暴雨将至": {"clouds": ["积雨云", "雨层云", "碎积云"], "icon": "🌧️", "desc": "收集积雨云、雨层云等预示降水的云 (任意2种)"},
-    "☁️ 云端漫步": {"clouds": ["卷云", "卷积云", "卷层云"], "icon": "🕊️", "desc": "集齐所有高云族 (卷云系列)"},
-    "🌈 光之美学": {"clouds": ["彩虹", "双彩虹", "日晕", "虹彩云", "云隙光"], "icon": "🌈", "desc": "收集 3 种以上的大气光学现象"},
-    "⛈️ 风暴领主": {"clouds": ["积雨云", "乳状云", "海啸云", "糙面云"], "icon": "⚡", "desc": "收集 2 种以上的风暴伴生云"},
-    "👽 异星来客": {"clouds": ["荚状云", "马蹄云", "开尔文-赫姆霍兹波", "滚轴云"], "icon": "🛸", "desc": "收集 1 种形状极其怪异的云"}
-}
-
-OFFICIAL_SCORES = {
-    "积云": 10, "淡积云": 10, "碎积云": 10, "层云": 10, "雾": 5, "飞机尾迹": 5,
-    "层积云": 15, "高积云": 15, "高层云": 15, "卷云": 15, "卷层云": 15, "雨层云": 20, "卷积云": 25, "积雨云": 25, "浓积云": 20, "幡状云": 25, "絮状高积云": 25,
-    "波状高积云": 30, "透光高积云": 30, "日晕": 30, "彩虹": 35, "云隙光": 30, "乳状云": 35, "网状云": 35, "堡状高积云": 35, "幻日": 35, "反云隙光": 35,
-    "双彩虹": 40, "荚状云": 40, "虹彩云": 40, "糙面云": 45, "夜光云": 45, "滚轴云": 45, "管状云": 45,
-    "珠母云": 50, "马蹄云": 50, "雨幡洞": 50, "开尔文-赫姆霍兹波": 55, "海啸云": 55, "火彩虹": 60, "红色精灵": 80, "史蒂夫现象": 80
-}
-
-MAX_POSSIBLE_SCORE = sum(OFFICIAL_SCORES.values())
-
-def get_official_score(cloud_name, ai_suggested_score):
-    if cloud_name in OFFICIAL_SCORES: return OFFICIAL_SCORES[cloud_name]
-    sorted_keys = sorted(OFFICIAL_SCORES.keys(), key=len, reverse=True)
-    for key in sorted_keys:
-        if key in cloud_name or cloud_name in key: return OFFICIAL_SCORES[key]
-    return ai_suggested_score
-
-def calculate_tier_from_score(score):
-    if score <= 10: return "N"
-    if score <= 29: return "R"
-    if score <= 39: return "SR"
-    if score <= 49: return "SSR"
-    return "UR"
+# 页面只管渲染；计分、数据库、模型调用和卡片都在 cloud_hunter 包里，PIL/numpy/zhipuai 用到时才导入
+from cloud_hunter.cards import create_share_card
+from cloud_hunter.db import (
+    DEFAULT_USER, backfill_thumbnails, delete_record, export_backup, find_near_duplicate, fix_legacy_scores_forced,
+    get_collection_stats, get_db_pool, get_image_by_hash, get_last_backup, get_record_by_hash, get_species_gallery,
+    get_species_records, get_thumbnail, get_unlocks_since, import_backup, preview_legacy_scores,
+)
+from cloud_hunter.images import (
+    MODEL_JPEG_QUALITY, MODEL_MAX_EDGE, SKY_FILTER_THRESHOLD, compute_phash, encode_thumbnail, make_preview, sky_score,
+    validate_image,
+)
+from cloud_hunter.jobs import JOB_ACTIVE, enqueue_job, get_job_previews, get_job_runner, get_jobs, get_latest_job
+from cloud_hunter.metrics import get_metrics, span
+from cloud_hunter.model import (
+    RESPONSE_CACHE_MAX_ENTRIES, evaluate_preprocessing, evaluate_sky_filter, get_api_key, get_model_client,
+    get_response_cache,
+)
+from cloud_hunter.scoring import (
+    ACHIEVEMENTS, OFFICIAL_SCORES, calculate_tier_from_score, get_achievement_engine, get_bilingual_name,
+    get_official_score, get_tier_color, get_user_rank_info, process_history_data,
+)
 
 # ==========================================
 # 🎨 2. UI 样式配置 (保持完美 V5.7)
 # ==========================================
 st.set_page_config(page_title="云彩收集者手册 (CN)", page_icon="☁️", layout="wide")
+# 按会话记住这次 rerun，被 st.rerun()/st.stop() 打断的会在同一会话的下次 rerun 补记
+get_metrics().begin("rerun", session=st.session_state.setdefault("metrics_session", os.urandom(8).hex()))
 
 def inject_custom_css():
     st.markdown("""
@@ -90,6 +43,8 @@ def inject_custom_css():
         .mini-dashboard { background: rgba(255, 255, 255, 0.95); border-radius: 12px; padding: 15px 25px; box-shadow: 0 2px 10px rgba(0,0,0,0.04); border: 1px solid rgba(0,0,0,0.05); height: 98px; display: flex; align-items: center; justify-content: space-between; }
         .preview-container { width: 100%; height: 350px; background-color: #fff; border: 1px solid #eee; padding: 10px; border-radius: 4px; display: flex; align-items: center; justify-content: center; overflow: hidden; margin-bottom: 20px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
         .preview-container img { width: 100%; height: 100%; object-fit: contain; }
+        .st-key-upload_preview { background: rgba(255, 255, 255, 0.9); border-radius: 16px; padding: 24px; box-shadow: 0 4px 20px rgba(0,0,0,0.06); border: 1px solid rgba(0,0,0,0.05); margin-bottom: 20px; min-height: 520px; }
+        .st-key-upload_preview [data-testid="stImage"] img { height: 350px; object-fit: contain; background-color: #fff; border: 1px solid #eee; padding: 10px; border-radius: 4px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
         .stButton>button { border-radius: 8px; height: 3.5em; font-family: "KaiTi", "STKaiti", serif; font-weight: 600; border: none; background: #2c3e50; color: #fff; transition: all 0.3s ease; width: 100%; }
         .stButton>button:hover { background: #34495e; transform: translateY(-2px); box-shadow: 0 4px 12px rgba(44, 62, 80, 0.3); }
         [data-testid="stSidebar"] [data-testid="stHorizontalBlock"] button { background-color: #f0f2f5 !important; color: #7f8c8d !important; border: 1px solid #dcdde1 !important; height: 2.8em !important; font-size: 0.85em !important; box-shadow: none !important; border-radius: 6px !important; }
@@ -106,217 +61,105 @@ def inject_custom_css():
 
 inject_custom_css()
 
-# ==========================================
-# 🔧 3. 后端逻辑
-# ==========================================
+# 第一次运行时建库、跑迁移，之后每次 rerun 都直接拿到缓存的连接池
+get_db_pool()
 
-# 🔴 改动2：国内无需代理，注释掉
-# os.environ["HTTP_PROXY"] = "http://127.0.0.1:10809"
-# os.environ["HTTPS_PROXY"] = "http://127.0.0.1:10809"
-
-def init_db():
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cloud_name TEXT,
-            tier TEXT,
-            score INTEGER,
-            science_fact TEXT,
-            weather_tip TEXT,
-            image_data BLOB,
-            image_hash TEXT UNIQUE, 
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def delete_record(record_id):
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM history WHERE id = ?', (record_id,))
-    conn.commit()
-    conn.close()
-
-def fix_legacy_scores_forced():
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('SELECT id, cloud_name, score, tier FROM history')
-    rows = c.fetchall()
-    updated_count = 0
-    for row in rows:
-        r_id, r_name, r_score, r_tier = row
-        if r_score == 0: continue
-        correct_score = get_official_score(r_name, r_score)
-        correct_tier = calculate_tier_from_score(correct_score)
-        if r_score != correct_score or r_tier != correct_tier:
-            c.execute('UPDATE history SET score = ?, tier = ? WHERE id = ?', (correct_score, correct_tier, r_id))
-            updated_count += 1
-    if updated_count > 0: conn.commit()
-    conn.close()
-    return updated_count
-
-init_db()
-
-def get_record_by_hash(img_hash):
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('SELECT cloud_name, tier, score, science_fact, weather_tip, timestamp FROM history WHERE image_hash = ?', (img_hash,))
-    result = c.fetchone()
-    conn.close()
-    return result
-
-def check_cloud_discovered(cloud_name):
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('SELECT count(*) FROM history WHERE cloud_name = ?', (cloud_name,))
-    count = c.fetchone()[0]
-    conn.close()
-    return count > 0
-
-def normalize_tier(raw_tier):
-    if not raw_tier: return "N"
-    t = str(raw_tier).upper().strip()
-    clean = t.split()[0]
-    if clean in ["UR", "SSR", "SR", "R", "N"]: return clean
-    return "N"
-
-def save_to_db(cloud_name, tier, score, science_fact, weather_tip, image_bytes, image_hash):
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    try:
-        clean_tier = normalize_tier(tier)
-        c.execute('INSERT INTO history (cloud_name, tier, score, science_fact, weather_tip, image_data, image_hash) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                  (cloud_name, clean_tier, score, science_fact, weather_tip, image_bytes, image_hash))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+# 配置了登录 (secrets.toml 里有 [auth]) 时身份只认 st.user，未登录先去登录；
+# 完全没配置登录的部署才允许用地址栏 ?user=xxx，都没有时就是单人模式
+def auth_configured():
+    try: return "auth" in st.secrets
+    except Exception: return False
 
-def get_history():
-    conn = sqlite3.connect('clouds.db')
-    c = conn.cursor()
-    c.execute('SELECT id, cloud_name, tier, score, science_fact, weather_tip, image_data, image_hash, timestamp FROM history ORDER BY id DESC')
-    data = c.fetchall()
-    conn.close()
-    return data
+def get_current_user():
+    if auth_configured():
+        if st.user.get("is_logged_in"): return st.user.get("email") or DEFAULT_USER
+        st.title("☁️ 云彩收集者手册")
+        st.button("🔑 登录", on_click=st.login)
+        st.stop()
+    return (st.query_params.get("user") or "").strip()[:64] or DEFAULT_USER
 
-def image_to_base64(image_bytes):
-    encoded = base64.b64encode(image_bytes).decode()
-    return f"data:image/jpeg;base64,{encoded}"
+CURRENT_USER = get_current_user()
 
-def make_square_thumbnail(image_bytes, size=(300, 300)):
+# 下载按钮拿到的是内容本身，交出去之后服务器上的压缩包就没用了，读完即删，不再每人多存几份
+def read_backup_once(incremental):
+    archive_path = export_backup(CURRENT_USER, incremental)
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
-        return img
-    except:
-        return None
+        with open(archive_path, "rb") as fp: return fp.read()
+    finally:
+        os.remove(archive_path)
+
+UPLOAD_PREVIEW_EDGE = 1024
+UPLOAD_PREVIEW_CACHE_ENTRIES = 32
+
+# 观测台的上传预览：每张图 (按 md5) 只缩一次，交给 st.image 走媒体文件 URL，rerun 时不再把原图塞进页面
+@st.cache_data(max_entries=UPLOAD_PREVIEW_CACHE_ENTRIES, show_spinner=False)
+def get_upload_preview(image_hash, _image_bytes):
+    img = make_preview(_image_bytes, (UPLOAD_PREVIEW_EDGE, UPLOAD_PREVIEW_EDGE))
+    return encode_thumbnail(img) if img else None
 
 # ==========================================
 # 🎨 4. 视觉工具
 # ==========================================
 
-TIER_COLORS = {"UR": "#c0392b", "SSR": "#f1c40f", "SR": "#8e44ad", "R": "#2980b9", "N": "#7f8c8d"}
-
-def get_tier_color(tier):
-    clean = normalize_tier(tier)
-    return TIER_COLORS.get(clean, "#7f8c8d")
-
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-
-def load_chinese_font(size):
-    system = platform.system()
-    font_paths = []
-    if system == "Windows":
-        font_paths = ["C:\\Windows\\Fonts\\simkai.ttf", "C:\\Windows\\Fonts\\simsun.ttc"]
-    elif system == "Darwin":
-        font_paths = ["/System/Library/Fonts/STKaiti.ttf", "/Library/Fonts/Songti.ttc"]
-    font = None
-    for path in font_paths:
-        if os.path.exists(path):
-            try: font = ImageFont.truetype(path, size); break
-            except Exception: continue
-    if font is None: font = ImageFont.load_default()
-    return font
-
-def create_share_card(image_bytes, cloud_name, tier, score):
-    base_img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-    target_width = 1000
-    ratio = target_width / base_img.width
-    image_height = int(base_img.height * ratio)
-    base_img = base_img.resize((target_width, image_height), Image.Resampling.LANCZOS)
-
-    footer_height = 350 
-    total_height = image_height + footer_height
-    canvas = Image.new("RGBA", (target_width, total_height), (250, 249, 246, 255))
-    canvas.paste(base_img, (0, 0))
-    draw = ImageDraw.Draw(canvas)
-    
-    clean_tier = normalize_tier(tier)
-    theme_color_hex = get_tier_color(clean_tier)
-    theme_color_rgb = hex_to_rgb(theme_color_hex)
-    text_color_main = (44, 62, 80)
-    text_color_sub = (127, 140, 141)
-    
-    font_badge_abbr = load_chinese_font(100) 
-    font_score_num = load_chinese_font(100) 
-    font_score_label = load_chinese_font(30) 
-    font_name = load_chinese_font(80)  
-    font_date = load_chinese_font(30)  
-    font_en = load_chinese_font(40)
-
-    footer_start_y = image_height
-    padding = 50
-
-    draw.line([(padding, footer_start_y), (target_width - padding, footer_start_y)], fill=theme_color_rgb, width=3)
-    badge_x = padding
-    badge_y = footer_start_y + 55
-    draw.text((badge_x, badge_y), clean_tier, fill=theme_color_rgb, font=font_badge_abbr)
-
-    score_num_str = str(score)
-    score_label_str = "分"
-    score_num_width = draw.textlength(score_num_str, font=font_score_num)
-    score_label_width = draw.textlength(score_label_str, font=font_score_label)
-    score_x_end = target_width - padding
-    draw.text((score_x_end - score_label_width, badge_y + 55), score_label_str, fill=theme_color_rgb, font=font_score_label)
-    draw.text((score_x_end - score_label_width - score_num_width - 10, badge_y), score_num_str, fill=theme_color_rgb, font=font_score_num)
-
-    name_y = footer_start_y + 180
-    draw.text((padding, name_y), cloud_name, fill=text_color_main, font=font_name)
-    
-    en_name = CLOUD_TRANSLATIONS.get(cloud_name, "")
-    if en_name:
-        draw.text((padding, name_y + 100), en_name, fill=text_color_sub, font=font_en)
-        footer_offset = 180
-    else:
-        footer_offset = 100
-
-    date_str = datetime.datetime.now().strftime("%Y.%m.%d")
-    footer_text = f"观测于 {date_str}  |  云彩收集者手册"
-    draw.text((padding, name_y + footer_offset), footer_text, fill=text_color_sub, font=font_date)
-
-    output_buffer = io.BytesIO()
-    canvas.save(output_buffer, format="PNG")
-    return output_buffer.getvalue()
+# 卡片只在点击下载时生成，同一张图/等级/积分/日期只渲染一次
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_share_card(image_hash, cloud_name, tier, score, date_str):
+    return create_share_card(get_image_by_hash(image_hash), cloud_name, tier, score, date_str)
 
-# 🔴 改动3：初始化智谱客户端 (从 secrets 获取 Key)
+# 只检查 Key 是否配置；客户端 (连同 zhipuai SDK) 等第一次鉴定时才创建
 try:
-    client = ZhipuAI(api_key=st.secrets["ZHIPU_API_KEY"])
+    get_api_key()
 except:
     st.error("请配置 ZHIPU_API_KEY")
     st.stop()
 
+def uploaded_file_hash(uploaded_file):
+    # 多图上传时每次 rerun 都要对所有文件查重，md5 按 file_id 缓存在会话里
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    if uploaded_file.file_id not in hashes:
+        with span("hash"): hashes[uploaded_file.file_id] = hashlib.md5(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
+
+def uploaded_file_sky_score(uploaded_file):
+    scores = st.session_state.setdefault("upload_sky_scores", {})
+    if uploaded_file.file_id not in scores:
+        with span("sky_filter"): scores[uploaded_file.file_id] = sky_score(uploaded_file.getvalue())
+    return scores[uploaded_file.file_id]
+
+def not_sky(score):
+    return score is not None and score < SKY_FILTER_THRESHOLD
+
+def uploaded_file_phash(uploaded_file):
+    phashes = st.session_state.setdefault("upload_phashes", {})
+    if uploaded_file.file_id not in phashes:
+        try: phashes[uploaded_file.file_id] = compute_phash(uploaded_file.getvalue())
+        except Exception: phashes[uploaded_file.file_id] = None
+    return phashes[uploaded_file.file_id]
+
+
+get_job_runner()
+
+@st.fragment(run_every=1.0)
+def render_job_progress(job_ids):
+    jobs = get_jobs(job_ids)
+    active = [j for j in jobs if j[3] in JOB_ACTIVE]
+    if not active:
+        # 整批结束后整页重跑一次，刷新侧边栏积分和藏品馆
+        st.rerun()
+    finished = len(jobs) - len(active)
+    running = sum(1 for j in jobs if j[3] == "running")
+    st.progress(finished / len(jobs), text=f"⏳ 卫星正在解析云层结构 (GLM-4V)... {finished}/{len(jobs)}，{running} 张解析中")
+    previews = get_job_previews()
+    for j_id, _, j_name, _, _ in active:
+        preview = previews.get(j_id)
+        if preview and preview.get("cloud_name"):
+            st.caption(f"☁️ {j_name}：初步判定为「{preview['cloud_name']}」，正在补全科普...")
+
 # ==========================================
 # 🔄 5. 侧边栏
 # ==========================================
 st.sidebar.markdown("## ☁️ 档案中心")
+if CURRENT_USER != DEFAULT_USER: st.sidebar.caption(f"👤 {CURRENT_USER}")
 sidebar_placeholder = st.sidebar.empty()
 
 st.sidebar.markdown("---")
@@ -324,86 +167,147 @@ st.sidebar.caption("🔧 数据管理")
 col_tool1, col_tool2 = st.sidebar.columns(2)
 
 with col_tool1:
-    with open("clouds.db", "rb") as fp:
+    with st.popover("💾 备份", help="打包数据库和原图下载到本地", use_container_width=True):
+        last_backup = get_last_backup(CURRENT_USER)
+        backup_mode = st.radio("备份范围", ["完整", "增量"], horizontal=True, disabled=last_backup is None,
+                               help="增量只包含上次备份之后新增的档案")
+        st.caption(f"上次备份 {last_backup['time']}，之后新增 {last_backup['new_records']} 条" if last_backup else "还没有备份过")
+        backup_incremental = backup_mode == "增量" and last_backup is not None
+        # 点击时才生成快照并打包
         st.download_button(
-            label="💾 备份",
-            data=fp,
-            file_name=f"clouds_backup.db",
-            mime="application/octet-stream",
-            help="下载数据库到本地"
+            label="⬇️ 生成并下载",
+            data=lambda: read_backup_once(backup_incremental),
+            file_name=f"clouds_backup_{datetime.date.today():%Y%m%d}{'_inc' if backup_incremental else ''}.tar.gz",
+            mime="application/gzip",
         )
+        st.divider()
+        import_file = st.file_uploader("📥 导入/合并备份", type=["gz", "db"], help="同一张照片只保留一份，首发积分按合并后的时间重新判定")
+        if import_file and st.button("合并到档案", key="import_backup"):
+            try:
+                with st.spinner("正在合并..."):
+                    import_report = import_backup(CURRENT_USER, import_file, import_file.name)
+                st.session_state["import_report"] = import_report
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+        if "import_report" in st.session_state:
+            r = st.session_state.pop("import_report")
+            st.toast(f"新增 {r['inserted']} 条 · 重复跳过 {r['duplicates']} 条 · 首发积分调整 {r['rescored']} 条 · 原图 {r['images']} 张", icon="📥")
 
 with col_tool2:
-    if st.button("🛠️ 修复", help="修复显示问题"):
-        count = fix_legacy_scores_forced()
-        if count > 0:
-            st.toast(f"已修复 {count} 条数据", icon="✅")
-            time.sleep(1)
-            st.rerun()
-        else:
+    if st.button("🛠️ 修复", help="修复显示问题并补全缩略图"):
+        thumb_count = backfill_thumbnails()
+        if thumb_count > 0:
+            st.toast(f"已补全 {thumb_count} 张缩略图", icon="🖼️")
+        # 先预览要改的分数，确认后再一次性写入
+        rescore_diff = preview_legacy_scores(CURRENT_USER)
+        if rescore_diff:
+            st.session_state["rescore_preview"] = rescore_diff
+        elif thumb_count == 0:
             st.toast("数据正常", icon="👌")
 
-def process_history_data(raw_data):
-    if not raw_data: return 0, 0, 0, {"UR":0,"SSR":0,"SR":0,"R":0,"N":0}, {}, set()
-    cloud_map = {}
-    total_score = 0
-    collected_names = set()
-    for row in raw_data:
-        c_name = row[1]
-        c_score = row[3]
-        collected_names.add(c_name)
-        if c_name not in cloud_map: cloud_map[c_name] = []
-        cloud_map[c_name].append(row)
-        total_score += c_score
-    tiers_data = {"UR": {}, "SSR": {}, "SR": {}, "R": {}, "N": {}}
-    tier_counts = {"UR": 0, "SSR": 0, "SR": 0, "R": 0, "N": 0}
-    for c_name, records in cloud_map.items():
-        best_record = max(records, key=lambda x: x[3]) 
-        best_score = best_record[3]
-        real_tier = calculate_tier_from_score(best_score)
-        if real_tier in tiers_data:
-            tiers_data[real_tier][c_name] = records
-            tier_counts[real_tier] += 1
-    unique_count = len(cloud_map)
-    total_obs = len(raw_data)
-    return total_score, total_obs, unique_count, tier_counts, tiers_data, collected_names
-
-history_data_raw = get_history()
-g_score, g_obs, g_unique, g_tier_counts, g_pokedex, g_collected_names = process_history_data(history_data_raw)
-
-RANK_SYSTEM = [
-    (0.00, "I", "抬头族", "#95a5a6"),       
-    (0.05, "II", "见习观测员", "#27ae60"),  
-    (0.15, "III", "天空记录者", "#2980b9"), 
-    (0.30, "IV", "追风者", "#2980b9"),      
-    (0.50, "V", "云图绘制师", "#8e44ad"),   
-    (0.65, "VI", "苍穹之眼", "#8e44ad"),    
-    (0.80, "VII", "云端领主", "#f1c40f"),   
-    (0.95, "VIII", "天空守护神", "#c0392b"),
-    (1.00, "IX", "气象之神", "#e74c3c")     
-]
-
-def get_user_rank_info(current_score):
-    max_score = MAX_POSSIBLE_SCORE
-    current_pct = current_score / max_score if max_score > 0 else 0
-    
-    prev_pct = 0
-    for pct, roman, title, color in RANK_SYSTEM:
-        target_score = int(max_score * pct)
-        if current_score < target_score:
-            gap = target_score - current_score
-            section_progress = (current_score - (max_score * prev_pct)) / (target_score - (max_score * prev_pct))
-            idx = RANK_SYSTEM.index((pct, roman, title, color))
-            if idx > 0:
-                curr_roman, curr_title, curr_color = RANK_SYSTEM[idx-1][1], RANK_SYSTEM[idx-1][2], RANK_SYSTEM[idx-1][3]
+if st.session_state.get("rescore_preview"):
+    rescore_diff = st.session_state["rescore_preview"]
+    with st.sidebar.container(border=True):
+        st.caption(f"将修正 {len(rescore_diff)} 条记录的积分/等级：")
+        diff_summary = {}
+        for _, r_name, old_score, old_tier, new_score, new_tier in rescore_diff:
+            diff_summary.setdefault((r_name, old_score, old_tier, new_score, new_tier), 0)
+            diff_summary[(r_name, old_score, old_tier, new_score, new_tier)] += 1
+        for (r_name, old_score, old_tier, new_score, new_tier), n in list(diff_summary.items())[:8]:
+            st.caption(f"{r_name} ×{n}：{old_score}分/{old_tier} → {new_score}分/{new_tier}")
+        if len(diff_summary) > 8: st.caption("...")
+        col_yes, col_no = st.columns(2)
+        with col_yes:
+            if st.button("✔️ 确认", key="rescore_yes"):
+                count = fix_legacy_scores_forced(CURRENT_USER)
+                del st.session_state["rescore_preview"]
+                st.toast(f"已修复 {count} 条数据", icon="✅")
+                time.sleep(1)
+                st.rerun()
+        with col_no:
+            if st.button("❌ 取消", key="rescore_no"):
+                del st.session_state["rescore_preview"]
+                st.rerun()
+
+# 调试工具只对运维开放：部署时设环境变量 CLOUD_HUNTER_DEBUG=1 或在 secrets 里写 debug = true，再在地址栏带 ?debug=1
+def debug_enabled():
+    if os.environ.get("CLOUD_HUNTER_DEBUG") == "1": return True
+    try: return bool(st.secrets.get("debug", False))
+    except Exception: return False
+
+if debug_enabled() and st.query_params.get("debug") == "1":
+    with st.sidebar.expander("📦 模型回复缓存"):
+        cache_stats = get_response_cache().stats()
+        st.caption(f"命中 {cache_stats['hits']} · 未命中 {cache_stats['misses']} · 合并请求 {cache_stats['coalesced']} · 条目 {cache_stats['entries']}/{RESPONSE_CACHE_MAX_ENTRIES}")
+    with st.sidebar.expander("🌩️ 模型调用"):
+        client_stats = get_model_client().stats()
+        st.caption(f"调用 {client_stats['calls']} · 重试 {client_stats['retries']} · 失败 {client_stats['failures']} · 熔断拒绝 {client_stats['rejected']}")
+        st.caption(f"对冲 {client_stats['hedged']} (补发胜出 {client_stats['hedge_wins']}) · 熔断器 {client_stats['breaker']}，累计熔断 {client_stats['trips']} 次")
+    with st.sidebar.expander("⏱️ 阶段耗时"):
+        metrics = get_metrics()
+        st.caption(f"最近 {len(metrics.recent)} 次运行（rerun = 页面刷新，job = 后台鉴定）")
+        st.dataframe([{"时间": datetime.datetime.fromtimestamp(r["ts"]).strftime("%H:%M:%S"), "类型": r["kind"], "状态": r["status"], "总耗时ms": r["total_ms"],
+                       "各阶段": " · ".join(f"{stage} {ms}" for stage, ms in r["spans"])} for r in reversed(metrics.recent)], hide_index=True)
+        st.dataframe([{"阶段": stage, **row} for stage, row in metrics.summary().items()], hide_index=True)
+    with st.sidebar.expander("🔬 缩图鉴定评估"):
+        st.caption(f"送模型前缩到长边 {MODEL_MAX_EDGE}px、JPEG 质量 {MODEL_JPEG_QUALITY}，抽样用原图和缩图各鉴定一次 (不走缓存)，统计结论一致的比例")
+        if st.button("抽样评估最近 10 张", key="eval_preprocess"):
+            st.json(evaluate_preprocessing(CURRENT_USER, 10))
+    with st.sidebar.expander("🌤️ 天空预筛评估"):
+        st.caption(f"当前阈值 {SKY_FILTER_THRESHOLD}；以模型缓存/档案里的 is_cloud 结论为准，统计各阈值下拦截非云的准确率和召回率")
+        if st.button("评估最近 200 张", key="eval_sky_filter"):
+            st.json(evaluate_sky_filter(CURRENT_USER, 200))
+
+GALLERY_PAGE_SIZE = 4
+
+def set_gallery_page(c_name, page):
+    st.session_state[f"page_{c_name}"] = page
+
+# 弹窗里的内容无论开没开都会执行，所以历史记录要手动展开才查库出图，且按页只取当前几条；
+# 翻页/删除确认只重跑这个片段，不会把整个页面重新渲染一遍
+@st.fragment
+def render_species_records(c_name, obs_count):
+    if not st.toggle(f"📸 历史记录 ({obs_count})", key=f"show_{c_name}"): return
+    pages = max(1, -(-obs_count // GALLERY_PAGE_SIZE))
+    page = min(st.session_state.get(f"page_{c_name}", 0), pages - 1)
+    for i_id, i_score, i_hash, i_time in get_species_records(CURRENT_USER, c_name, GALLERY_PAGE_SIZE, page * GALLERY_PAGE_SIZE):
+        preview = get_thumbnail(i_hash, "preview")
+        if preview: st.image(preview, use_container_width=True)
+
+        col_desc, col_del = st.columns([3, 1])
+        with col_desc:
+            st.caption(f"{i_time[:16]} | 积分 +{i_score}")
+        with col_del:
+            del_key = f"del_{i_id}"
+            if not st.session_state.get(del_key, False):
+                st.button("🗑️", key=f"btn_del_{i_id}", help="删除此记录", on_click=st.session_state.__setitem__, args=(del_key, True))
             else:
-                curr_roman, curr_title, curr_color = "I", "抬头族", "#95a5a6"
-            tooltip = f"下一级：Lv.{roman} {title} (还需 {gap} 分)"
-            return curr_roman, curr_title, curr_color, section_progress, tooltip
-        prev_pct = pct
-        
-    last = RANK_SYSTEM[-1]
-    return last[1], last[2], last[3], 1.0, "已达理论极限！"
+                st.markdown("Confirm?")
+                if st.button("✔️", key=f"btn_yes_{i_id}", type="primary"):
+                    delete_record(CURRENT_USER, i_id)
+                    del st.session_state[del_key]
+                    # 删除会改动统计和图鉴，整页刷新
+                    st.rerun()
+                st.button("❌", key=f"btn_no_{i_id}", on_click=st.session_state.pop, args=(del_key, None))
+        st.divider()
+    if pages > 1:
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        col_prev.button("◀", key=f"prev_{c_name}", disabled=page == 0, on_click=set_gallery_page, args=(c_name, page - 1))
+        col_page.caption(f"第 {page + 1} / {pages} 页")
+        col_next.button("▶", key=f"next_{c_name}", disabled=page >= pages - 1, on_click=set_gallery_page, args=(c_name, page + 1))
+
+g_score, g_obs, g_unique, g_tier_counts, g_species_best = get_collection_stats(CURRENT_USER)
+g_collected_mask = get_achievement_engine().mask_for(g_species_best)
+
+# 其他会话/后台任务入库时解锁的勋章，在本会话里弹一次提示
+new_unlocks = get_unlocks_since(CURRENT_USER, st.session_state.get("seen_unlock_id", 0))
+if new_unlocks:
+    if "seen_unlock_id" in st.session_state:
+        for _, ach_name in new_unlocks: st.toast(f"解锁勋章：{ach_name}", icon="🏅")
+    st.session_state["seen_unlock_id"] = new_unlocks[-1][0]
+else:
+    st.session_state.setdefault("seen_unlock_id", 0)
 
 rank_roman, rank_title, rank_color, progress_val, rank_tooltip = get_user_rank_info(g_score)
 
@@ -440,21 +344,15 @@ def render_sidebar():
         ach_cols = st.columns(4)
         col_idx = 0
         
-        for ach_name, ach_data in ACHIEVEMENTS.items():
-            required = set(ach_data["clouds"])
-            have_count = len(required.intersection(g_collected_names))
-            missing = required - g_collected_names
-            if not missing: tooltip_text = f"【已解锁】{ach_data['desc']}"
+        engine = get_achievement_engine()
+        for ach_name, have_count, is_unlocked, missing_mask in engine.progress(g_collected_mask):
+            ach_data = ACHIEVEMENTS[ach_name]
+            if is_unlocked: tooltip_text = f"【已解锁】{ach_data['desc']}"
             else:
-                missing_str = "、".join(list(missing)[:3])
+                missing = engine.names_in(missing_mask)
+                missing_str = "、".join(missing[:3])
                 if len(missing) > 3: missing_str += "..."
                 tooltip_text = f"【未解锁】还需收集：{missing_str}"
-
-            is_unlocked = False
-            if "2 种" in ach_data["desc"] and have_count >= 2: is_unlocked = True
-            elif "3 种" in ach_data["desc"] and have_count >= 3: is_unlocked = True
-            elif "1 种" in ach_data["desc"] and have_count >= 1: is_unlocked = True
-            elif "集齐" in ach_data["desc"] and have_count == len(required): is_unlocked = True
             
             with ach_cols[col_idx % 4]:
                 style = "opacity:1; cursor:help;" if is_unlocked else "opacity:0.2; filter:grayscale(100%); cursor:help;"
@@ -472,7 +370,7 @@ def render_sidebar():
             st.markdown(f"<span style='color:#2980b9'>🔵 R: {g_tier_counts['R']}</span>", unsafe_allow_html=True)
             st.markdown(f"<span style='color:#7f8c8d'>⚪ N: {g_tier_counts['N']}</span>", unsafe_allow_html=True)
 
-render_sidebar()
+with span("sidebar"): render_sidebar()
 
 # ==========================================
 # 🖥️ 6. 主界面
@@ -495,7 +393,7 @@ tab1, tab2 = st.tabs(["🔭 观测台", "🏆 藏品馆"])
 with tab1:
     top_left, top_right = st.columns([1, 1])
     with top_left:
-        uploaded_file = st.file_uploader(" ", type=["jpg", "jpeg", "png"], label_visibility="collapsed")
+        uploaded_files = st.file_uploader(" ", type=["jpg", "jpeg", "png"], accept_multiple_files=True, label_visibility="collapsed")
     with top_right:
         st.markdown(f"""
         <div class="mini-dashboard">
@@ -515,130 +413,89 @@ with tab1:
 
     main_left, main_right = st.columns([1, 1])
     
+    uploaded_file = None
     image_bytes = None
     existing_record = None
+    current_job = None
+    near_dup = None
+    sky_rejected = False
     
-    if uploaded_file:
+    if uploaded_files:
+        if len(uploaded_files) > 1:
+            with main_left:
+                file_idx = st.selectbox("查看", range(len(uploaded_files)), format_func=lambda i: uploaded_files[i].name, label_visibility="collapsed")
+            uploaded_file = uploaded_files[file_idx]
+        else:
+            uploaded_file = uploaded_files[0]
         image_bytes = uploaded_file.getvalue()
-        md5_hash = hashlib.md5(image_bytes).hexdigest()
-        existing_record = get_record_by_hash(md5_hash)
+        md5_hash = uploaded_file_hash(uploaded_file)
+        with span("db_lookup"):
+            existing_record = get_record_by_hash(CURRENT_USER, md5_hash)
+            if not existing_record: current_job = get_latest_job(CURRENT_USER, md5_hash)
+        if not existing_record:
+            current_phash = uploaded_file_phash(uploaded_file)
+            if current_phash is not None: near_dup = find_near_duplicate(CURRENT_USER, current_phash)
+            sky_rejected = not_sky(uploaded_file_sky_score(uploaded_file))
 
     with main_left:
         if uploaded_file:
-            b64_img = image_to_base64(image_bytes)
-            st.markdown(f"""
-            <div class="apple-card">
-                <div class="preview-container">
-                    <img src="{b64_img}">
-                </div>
-                <div style="text-align:center; color:#7f8c8d; font-size:12px; margin-top:10px; font-family:sans-serif;">
-                    {uploaded_file.name}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            with st.container(key="upload_preview"):
+                preview = get_upload_preview(md5_hash, image_bytes)
+                if preview: st.image(preview, use_container_width=True)
+                st.markdown(f'<div style="text-align:center; color:#7f8c8d; font-size:12px; margin-top:10px; font-family:sans-serif;">{uploaded_file.name}</div>', unsafe_allow_html=True)
             
-            action_placeholder = st.empty()
-            should_process = False
-            if not existing_record:
-                if action_placeholder.button("⚡ 鉴定这朵云", type="primary", use_container_width=True):
-                    should_process = True
+            pending_files = []
+            near_dup_count = 0
+            not_sky_count = 0
+            for f in uploaded_files:
+                f_hash = uploaded_file_hash(f)
+                if get_record_by_hash(CURRENT_USER, f_hash): continue
+                f_job = get_latest_job(CURRENT_USER, f_hash)
+                if f_job and f_job[3] in JOB_ACTIVE: continue
+                if len(uploaded_files) > 1 and not_sky(uploaded_file_sky_score(f)):
+                    not_sky_count += 1
+                    continue
+                f_phash = uploaded_file_phash(f)
+                if len(uploaded_files) > 1 and f_phash is not None and find_near_duplicate(CURRENT_USER, f_phash):
+                    near_dup_count += 1
+                    continue
+                pending_files.append((f, f_hash))
+
+            if len(uploaded_files) == 1:
+                button_label = "⚡ 仍然鉴定" if near_dup or sky_rejected else "⚡ 鉴定这朵云"
+            else:
+                button_label = f"⚡ 鉴定全部 ({len(pending_files)} 张)"
+                if near_dup_count: st.caption(f"🔁 {near_dup_count} 张与档案高度相似，已跳过（可单独上传后强制鉴定）")
+                if not_sky_count: st.caption(f"🌫️ {not_sky_count} 张看起来不像天空，已跳过（可单独上传后强制鉴定）")
+            if pending_files and st.button(button_label, type="primary", use_container_width=True):
+                new_job_ids = []
+                for f, f_hash in pending_files:
+                    try:
+                        validate_image(f.getvalue())
+                    except ValueError as e:
+                        st.error(f"{f.name}: {e}")
+                        continue
+                    new_job_ids.append(enqueue_job(CURRENT_USER, f.getvalue(), f_hash, f.name, force=len(uploaded_files) == 1 and (near_dup is not None or sky_rejected)))
+                st.session_state["job_ids"] = new_job_ids
+                if new_job_ids: st.rerun()
+
+            session_jobs = get_jobs(st.session_state.get("job_ids", []))
+            if any(j[3] in JOB_ACTIVE for j in session_jobs):
+                render_job_progress([j[0] for j in session_jobs])
+            elif len(session_jobs) > 1:
+                failed_jobs = [j for j in session_jobs if j[3] == "failed"]
+                st.caption(f"本批 {len(session_jobs)} 张：入档 {len(session_jobs) - len(failed_jobs)}，失败 {len(failed_jobs)}")
+                for j in failed_jobs:
+                    st.caption(f"⚠️ {j[2]}：{j[4]}")
         else:
             st.markdown("""
             <div class="apple-card" style="justify-content: center; align-items: center; text-align: center;">
                 <div style="font-size: 60px; margin-bottom: 20px; opacity: 0.3;">☁️</div>
                 <h3 style="color:#2c3e50; margin-bottom: 10px; font-family:'KaiTi',serif;">准备就绪</h3>
-                <p style="color:#95a5a6; font-family:'KaiTi',serif;">请上传一张天空的照片</p>
+                <p style="color:#95a5a6; font-family:'KaiTi',serif;">请上传一张或多张天空的照片</p>
             </div>
             """, unsafe_allow_html=True)
 
-    if 'should_process' in locals() and should_process and uploaded_file:
-        with main_right:
-             status_container = st.empty()
-             status_container.info("⏳ 卫星正在解析云层结构 (GLM-4V)...")
-        
-        try:
-            if len(image_bytes) < 100:
-                status_container.empty()
-                st.error("🚫 上传失败：图片数据为空 (0KB)。")
-                st.stop()
-
-            try:
-                image_obj = Image.open(io.BytesIO(image_bytes))
-                if image_obj.format not in ["JPEG", "PNG", "WEBP"]:
-                    image_obj = image_obj.convert("RGB")
-            except Exception:
-                status_container.empty()
-                st.error("🚫 无法读取此图片格式。请尝试截图后上传。")
-                st.stop()
-
-            # 🔴 改动4：构造智谱专用 Prompt
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            
-            response = client.chat.completions.create(
-                model=MODEL_NAME, 
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": base64_image
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": """
-                                任务：识别图片中的云彩。
-                                第一步：判断这张图片是否包含云彩或天空现象。
-                                - 如果是猫、狗、室内、黑屏、文字截图等非天空图片，返回 {"is_cloud": false}
-                                - 如果包含云，返回 {"is_cloud": true, ...}
-                                
-                                第二步：如果是云，请进行分类。
-                                请务必只返回纯净的 JSON 字符串，不要包含 ```json 或其他标记。
-                                格式如下：
-                                {
-                                    "is_cloud": true/false,
-                                    "cloud_name": "标准学术名称(中文，如：积云、高积云)", 
-                                    "score_suggestion": 估算分数(10-100),
-                                    "science_fact": "科普(30字内)",
-                                    "weather_tip": "预告(20字内)"
-                                }
-                                """
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            # 🔴 改动5：清洗和解析智谱的返回结果
-            raw_content = response.choices[0].message.content
-            # 去除可能存在的 markdown 代码块标记
-            clean_json = raw_content.replace("```json", "").replace("```", "").strip()
-            
-            result = json.loads(clean_json)
-            
-            if not result.get("is_cloud", False):
-                status_container.empty()
-                st.error("🚫 鉴定失败：画面中未发现明显云彩结构。")
-            else:
-                c_name = result.get("cloud_name", "未知")
-                ai_score = result.get("score_suggestion", 10)
-                c_sci = result.get("science_fact", "暂无")
-                c_wea = result.get("weather_tip", "暂无")
-                
-                official_score = get_official_score(c_name, ai_score)
-                calculated_tier = calculate_tier_from_score(official_score)
-                is_new = not check_cloud_discovered(c_name)
-                final_score = official_score if is_new else 0
-                
-                save_to_db(c_name, calculated_tier, final_score, c_sci, c_wea, image_bytes, md5_hash)
-                st.rerun()
-                
-        except Exception as e:
-            status_container.empty()
-            st.error(f"分析中断: {e}")
-
     with main_right:
         if existing_record:
             r_name, r_tier, r_score, r_sci, r_wea, r_time = existing_record
@@ -671,61 +528,45 @@ with tab1:
                 </div>
             </div>
             """, unsafe_allow_html=True)
-            card_bytes = create_share_card(image_bytes, r_name, display_tier, r_score if r_score > 0 else display_score)
-            st.download_button("✨ 获取收藏卡片", card_bytes, file_name=f"Card_{r_name}.png", mime="image/png", type="primary", use_container_width=True)
-
+            card_score = r_score if r_score > 0 else display_score
+            card_date = datetime.datetime.now().strftime("%Y.%m.%d")
+            st.download_button("✨ 获取收藏卡片", lambda: get_share_card(md5_hash, r_name, display_tier, card_score, card_date), file_name=f"Card_{r_name}.png", mime="image/png", type="primary", use_container_width=True)
+
+        elif current_job and current_job[3] in JOB_ACTIVE:
+            st.info("⏳ 卫星正在解析云层结构 (GLM-4V)..." if current_job[3] == "running" else "⏳ 已排队，等待卫星空闲...")
+        elif current_job and current_job[3] == "failed" and not near_dup and not sky_rejected:
+            st.error(current_job[4])
+        elif near_dup:
+            dup_hash, dup_record, dup_dist = near_dup
+            st.warning(f"🔁 这张照片与档案中的「{dup_record[0]}」({dup_record[5][:16]}) 高度相似（指纹差异 {dup_dist}/64），可能是同一张天空的裁剪或重新保存版本。确认不是重复可点击左侧「仍然鉴定」。")
+        elif sky_rejected:
+            st.warning("🌫️ 本地预筛认为这张照片不像天空（室内、宠物、截图等），为节省调用没有自动送去解析。确认拍的是云可点击左侧「仍然鉴定」。")
         elif not uploaded_file:
              st.markdown('<div class="apple-card" style="display: flex; align-items: center; justify-content: center; color: #ccc;"><h3>等待左侧影像...</h3></div>', unsafe_allow_html=True)
 
 # === Tab 2: 🏆 藏品馆 ===
 with tab2:
-    if not history_data_raw:
+    if g_obs == 0:
         st.markdown('<div class="apple-card" style="text-align:center; color:#95a5a6; padding:50px; font-family:KaiTi,serif;">📦<br>暂无藏品，去观测台开始探索吧</div>', unsafe_allow_html=True)
     else:
-        for tier in ["UR", "SSR", "SR", "R", "N"]:
-            clouds_in_tier = g_pokedex[tier]
-            if clouds_in_tier:
-                color = get_tier_color(tier)
-                st.markdown(f"<h3 style='color:{color}; border-bottom:1px dashed {color}; padding-bottom:5px; margin-top:30px; display:flex; align-items:center; font-family:KaiTi,serif;'><span style='font-size:24px; margin-right:10px; font-family:Lora,serif;'>{tier}</span> 级图鉴</h3>", unsafe_allow_html=True)
-                cols = st.columns(4)
-                for idx, (c_name, items) in enumerate(clouds_in_tier.items()):
-                    with cols[idx % 4]:
-                        latest_item = items[0]
-                        img_blob = latest_item[6]
-                        science_fact = latest_item[4]
-                        thumb = make_square_thumbnail(img_blob)
-                        st.image(thumb, use_container_width=True)
+        with span("history_query"): g_pokedex = process_history_data(get_species_gallery(CURRENT_USER), g_species_best)
+        with span("gallery"):
+            for tier in ["UR", "SSR", "SR", "R", "N"]:
+                clouds_in_tier = g_pokedex[tier]
+                if clouds_in_tier:
+                    color = get_tier_color(tier)
+                    st.markdown(f"<h3 style='color:{color}; border-bottom:1px dashed {color}; padding-bottom:5px; margin-top:30px; display:flex; align-items:center; font-family:KaiTi,serif;'><span style='font-size:24px; margin-right:10px; font-family:Lora,serif;'>{tier}</span> 级图鉴</h3>", unsafe_allow_html=True)
+                    cols = st.columns(4)
+                    for idx, (c_name, species) in enumerate(clouds_in_tier.items()):
+                        with cols[idx % 4]:
+                            _, obs_count, science_fact, latest_hash = species
+                            thumb = get_thumbnail(latest_hash)
+                            if thumb: st.image(thumb, use_container_width=True)
                         
-                        pop_title = f"{c_name} ({len(items)})"
-                        with st.popover(pop_title, use_container_width=True):
-                            st.markdown(f"### {get_bilingual_name(c_name)}", unsafe_allow_html=True)
-                            st.info(f"📜 {science_fact}")
-                            st.markdown("#### 📸 历史记录")
-                            
-                            for item in items:
-                                i_id = item[0]
-                                i_blob = item[6]
-                                i_score = item[3]
-                                i_time = item[8]
-                                i_img = Image.open(io.BytesIO(i_blob))
-                                st.image(i_img, use_container_width=True)
-                                
-                                col_desc, col_del = st.columns([3, 1])
-                                with col_desc:
-                                    st.caption(f"{i_time[:16]} | 积分 +{i_score}")
-                                with col_del:
-                                    del_key = f"del_{i_id}"
-                                    if not st.session_state.get(del_key, False):
-                                        if st.button("🗑️", key=f"btn_del_{i_id}", help="删除此记录"):
-                                            st.session_state[del_key] = True
-                                            st.rerun()
-                                    else:
-                                        st.markdown("Confirm?")
-                                        if st.button("✔️", key=f"btn_yes_{i_id}", type="primary"):
-                                            delete_record(i_id)
-                                            del st.session_state[del_key]
-                                            st.rerun()
-                                        if st.button("❌", key=f"btn_no_{i_id}"):
-                                            del st.session_state[del_key]
-                                            st.rerun()
-                                st.divider()
\ No newline at end of file
+                            pop_title = f"{c_name} ({obs_count})"
+                            with st.popover(pop_title, use_container_width=True):
+                                st.markdown(f"### {get_bilingual_name(c_name)}", unsafe_allow_html=True)
+                                st.info(f"📜 {science_fact}")
+                                render_species_records(c_name, obs_count)
+
+get_metrics().end()
@@ -0,0 +1,73 @@
+"""本地假的 zhipuai 模块：基准测试时替换真实客户端，不发任何网络请求。
+
+install() 会把自己注册成 sys.modules["zhipuai"]，之后 app.py 里的
+`from zhipuai import ZhipuAI` 拿到的就是这里的 ZhipuAI。
+"""
+import hashlib
+import json
+import sys
+import time
+import types
+
+CLOUD_NAMES = ["积云", "层积云", "高积云", "卷云", "积雨云", "彩虹", "荚状云", "乳状云", "雾", "飞机尾迹"]
+
+# 每次调用的模拟延迟（秒），基准脚本可以改
+LATENCY = 0.0
+calls = 0
+
+
+def fake_reply(image_url):
+    digest = hashlib.md5(image_url.encode("utf-8")).digest()
+    name = CLOUD_NAMES[digest[0] % len(CLOUD_NAMES)]
+    return json.dumps({
+        "is_cloud": digest[1] % 10 != 0,
+        "cloud_name": name,
+        "score_suggestion": 10 + digest[2] % 40,
+        "science_fact": f"{name}的科普（假数据）",
+        "weather_tip": "天气预告（假数据）",
+    }, ensure_ascii=False)
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class _Stream:
+    """stream=True 时的返回值：逐块吐出回复，close() 之后不再继续。"""
+
+    def __init__(self, content, chunk_size=8):
+        self._pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        self.chunks_sent = 0
+        self.response = types.SimpleNamespace(close=self.close)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        for piece in self._pieces:
+            if self.closed: return
+            self.chunks_sent += 1
+            delta = types.SimpleNamespace(content=piece)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+
+class _Completions:
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        global calls
+        calls += 1
+        if LATENCY: time.sleep(LATENCY)
+        image_url = messages[0]["content"][0]["image_url"]["url"]
+        if stream: return _Stream(fake_reply(image_url))
+        message = types.SimpleNamespace(content=fake_reply(image_url))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class ZhipuAI:
+    def __init__(self, api_key=None, **kwargs):
+        self.api_key = api_key
+        self.chat = types.SimpleNamespace(completions=_Completions())
+
+
+def install():
+    sys.modules["zhipuai"] = sys.modules[__name__]
@@ -0,0 +1,115 @@
+"""模型调用容错的对比测试：在注入故障的本地服务 (stub_server.py) 上跑同一批请求。
+
+分别用裸 ZhipuAI 客户端、带重试/熔断的 ResilientModelClient、再加对冲请求三种方式
+并发调用，统计成功率、延迟分位数和服务端实际收到的请求数：
+
+    python bench/resilience_bench.py --requests 200 --fail-rate 0.1 --slow-rate 0.05 --hedge-after 0.3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from stub_server import StubConfig, serve  # noqa: E402
+
+
+def resilience_script():
+    # 在 AppTest 里执行：用 cloud_hunter.model 里的 ResilientModelClient 包真实的 SDK
+    import json
+    import os
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import httpx
+    import streamlit as st
+    from cloud_hunter.model import CircuitBreaker, ResilientModelClient
+    from run_bench import summarize
+    from zhipuai import ZhipuAI
+
+    if "resilience_result" in st.session_state: return
+    params = json.loads(os.environ["RESILIENCE_PARAMS"])
+
+    def make_client(kind):
+        http_client = httpx.Client(timeout=httpx.Timeout(params["timeout"], connect=2.0),
+                                   limits=httpx.Limits(max_connections=32, max_keepalive_connections=32))
+        raw = ZhipuAI(api_key="stub", base_url=params["base_url"], http_client=http_client, max_retries=0)
+        if kind == "bare": return raw
+        breaker = CircuitBreaker(params["breaker_failures"], 1.0)
+        hedge_after = params["hedge_after"] if kind == "retry+hedge" else None
+        return ResilientModelClient(raw, max_retries=3, backoff_base=0.05, backoff_max=0.5, hedge_after=hedge_after, breaker=breaker)
+
+    def one_call(client, i):
+        messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"img-{i}"}}, {"type": "text", "text": "x"}]}]
+        t0 = time.perf_counter()
+        try:
+            client.chat.completions.create(model="stub", messages=messages)
+            return True, time.perf_counter() - t0
+        except Exception:
+            return False, time.perf_counter() - t0
+
+    result = {}
+    for kind in ("bare", "retry", "retry+hedge"):
+        client = make_client(kind)
+        before = httpx.get(params["base_url"] + "stats").json()
+        with ThreadPoolExecutor(max_workers=params["concurrency"]) as pool:
+            outcomes = list(pool.map(lambda i: one_call(client, i), range(params["requests"])))
+        after = httpx.get(params["base_url"] + "stats").json()
+        ok = [dt for success, dt in outcomes if success]
+        result[kind] = {
+            "success_rate": round(len(ok) / len(outcomes), 3),
+            "latency_ok": summarize(ok) if ok else None,
+            "upstream_requests": after["requests"] - before["requests"],
+            "client_stats": client.stats() if hasattr(client, "stats") else None,
+        }
+    st.session_state["resilience_result"] = result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型调用容错对比测试")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--fail-rate", type=float, default=0.1)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--drop-rate", type=float, default=0.02)
+    parser.add_argument("--hedge-after", type=float, default=0.3)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--breaker-failures", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, 0.02, args.slow_rate, args.slow_latency, args.fail_rate, args.throttle_rate,
+                        args.drop_rate, seed=args.seed)
+    server, _ = serve(config=config)
+    params = {
+        "base_url": f"http://127.0.0.1:{server.server_address[1]}/",
+        "requests": args.requests, "concurrency": args.concurrency, "hedge_after": args.hedge_after,
+        "timeout": args.timeout, "breaker_failures": args.breaker_failures,
+    }
+    os.environ["RESILIENCE_PARAMS"] = json.dumps(params)
+
+    from streamlit.testing.v1 import AppTest
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="cloud_resilience_"))
+    try:
+        at = AppTest.from_function(resilience_script, default_timeout=600)
+        at.secrets["ZHIPU_API_KEY"] = "stub"
+        at.run()
+        if at.exception: raise RuntimeError(at.exception[0].value)
+        print(json.dumps({"stub": config.counts, "params": params, "results": at.session_state["resilience_result"]},
+                         ensure_ascii=False, indent=2))
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""app.py 热点路径的基准测试。
+
+对 1k / 10k / 100k 条记录的合成档案（见 synth_archive.py），在 Streamlit
+AppTest 里用本地假 ZhipuAI 客户端跑 app.py，分别计时：
+
+- 单个函数：get_history、get_species_gallery、process_history_data、
+  get_user_rank_info、make_square_thumbnail、make_preview、create_share_card
+- 整个脚本：冷启动第一次运行、之后的 rerun（观测台 + 藏品馆两个 tab 都会渲染）
+
+结果以 JSON 输出，可以用 --compare 和另一个版本的结果对比：
+
+    python bench/run_bench.py --sizes 1000 10000 --output bench_new.json
+    python bench/run_bench.py --sizes 1000 10000 --compare bench_old.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(BENCH_DIR), "app.py")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(APP_PATH))
+
+import fake_zhipuai  # noqa: E402
+from synth_archive import build_archive  # noqa: E402
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "min_ms": round(samples[0] * 1000, 3),
+    }
+
+
+def function_bench_script():
+    # 在 AppTest 里执行：先完整跑一遍 app.py，和 cloud_hunter 各模块的名字合在一起，再逐个计时
+    import runpy
+    import time
+    import streamlit as st
+    from cloud_hunter import cards, db, images, scoring
+
+    if "bench_result" in st.session_state: return
+    ns = {**vars(scoring), **vars(images), **vars(db), **vars(cards), **runpy.run_path(st.session_state["bench_app_path"])}
+    repeat = st.session_state["bench_repeat"]
+
+    def timed(fn, *args):
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - t0)
+        return samples
+
+    user_id = ns["DEFAULT_USER"]
+    history = ns["get_history"](user_id)
+    stats = ns["get_collection_stats"](user_id)
+    sample_hash = history[0][6]
+    image_bytes = ns["get_image_by_hash"](sample_hash)
+    st.session_state["bench_result"] = {
+        "get_history": timed(ns["get_history"], user_id),
+        "get_species_gallery": timed(ns["get_species_gallery"], user_id),
+        "process_history_data": timed(ns["process_history_data"], ns["get_species_gallery"](user_id), stats[4]),
+        "get_user_rank_info": timed(ns["get_user_rank_info"], stats[0]),
+        "make_square_thumbnail": timed(ns["make_square_thumbnail"], image_bytes),
+        "make_preview": timed(ns["make_preview"], image_bytes),
+        "create_share_card": timed(ns["create_share_card"], image_bytes, history[0][1], "SR", 35),
+    }
+
+
+def new_app_test(from_function=None):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_function(from_function, default_timeout=600) if from_function else AppTest.from_file(APP_PATH, default_timeout=600)
+    at.secrets["ZHIPU_API_KEY"] = "bench"
+    return at
+
+
+def bench_archive(archive_dir, repeat, script_runs):
+    cwd = os.getcwd()
+    os.chdir(archive_dir)
+    try:
+        result = {}
+        # 整个脚本：同一个 AppTest 会话里连续运行，第一次包含建连接池/索引等一次性开销
+        at = new_app_test()
+        samples = []
+        for _ in range(script_runs):
+            t0 = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - t0)
+            if at.exception: raise RuntimeError(at.exception[0].value)
+        result["script_first_run"] = summarize(samples[:1])
+        if len(samples) > 1: result["script_rerun"] = summarize(samples[1:])
+
+        at = new_app_test(function_bench_script)
+        at.session_state["bench_app_path"] = APP_PATH
+        at.session_state["bench_repeat"] = repeat
+        at.run()
+        if at.exception: raise RuntimeError(at.exception[0].value)
+        for name, samples in at.session_state["bench_result"].items():
+            result[name] = summarize(samples)
+        return result
+    finally:
+        os.chdir(cwd)
+
+
+# 新进程里导入页面用到的核心模块，看冷启动的导入开销和哪些重量级依赖被提前拉了进来
+COLD_IMPORT_SCRIPT = """
+import sys, time, json
+t0 = time.perf_counter()
+import cloud_hunter.cards, cloud_hunter.db, cloud_hunter.images, cloud_hunter.jobs, cloud_hunter.model, cloud_hunter.scoring
+elapsed = time.perf_counter() - t0
+print(json.dumps([elapsed, [m for m in ("streamlit", "zhipuai", "httpx", "numpy", "PIL") if m in sys.modules]]))
+"""
+
+
+def cold_import_bench(runs):
+    samples, heavy = [], None
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", COLD_IMPORT_SCRIPT], cwd=os.path.dirname(APP_PATH), text=True)
+        elapsed, heavy = json.loads(out.strip().splitlines()[-1])
+        samples.append(elapsed)
+    return {**summarize(samples), "heavy_modules": heavy}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(APP_PATH), text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline):
+    print(f"{'档案':>8} {'指标':<24} {'基线 ms':>10} {'当前 ms':>10} {'比值':>7}")
+    for size, metrics in current["results"].items():
+        for name, summary in metrics.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if not base: continue
+            ratio = summary["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+            print(f"{size:>8} {name:<24} {base['median_ms']:>10.2f} {summary['median_ms']:>10.2f} {ratio:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="云彩收集者手册 基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="档案记录数，可加 100000")
+    parser.add_argument("--repeat", type=int, default=5, help="每个函数的计时次数")
+    parser.add_argument("--script-runs", type=int, default=4, help="整页脚本的运行次数 (第一次为冷启动)")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[4032, 3024], metavar=("W", "H"), help="样图尺寸，默认 1200 万像素手机照片")
+    parser.add_argument("--users", type=int, default=1, help="记录平均分给多少个用户，计时的是其中默认用户的页面")
+    parser.add_argument("--workdir", help="档案存放目录，默认临时目录；已存在的档案会直接复用")
+    parser.add_argument("--output", help="结果 JSON 写入的文件，默认打印到标准输出")
+    parser.add_argument("--compare", help="和之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    fake_zhipuai.install()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cloud_bench_")
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "users": args.users,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+        "cold_import": cold_import_bench(args.script_runs),
+    }
+    for size in args.sizes:
+        archive_dir = os.path.join(workdir, f"archive_{size}" + (f"_u{args.users}" if args.users > 1 else ""))
+        if not os.path.exists(os.path.join(archive_dir, "clouds.db")):
+            print(f"生成 {size} 条记录的档案...", file=sys.stderr)
+            build_archive(archive_dir, size, image_size=tuple(args.image_size), users=args.users)
+        print(f"计时 {size} 条记录...", file=sys.stderr)
+        report["results"][str(size)] = bench_archive(archive_dir, args.repeat, args.script_runs)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp: fp.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp: compare(report, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""本地假的智谱接口服务：按比例注入延迟、长尾、429/500 和断连，用来检验模型调用的容错。
+
+和 fake_zhipuai.py 不同，这里走真实的 zhipuai SDK 和 httpx 连接池，只把 base_url 指过来：
+
+    python bench/stub_server.py --port 8765 --fail-rate 0.2 --slow-rate 0.05
+    ZHIPUAI_BASE_URL=http://127.0.0.1:8765/ streamlit run app.py
+
+支持 /chat/completions 的普通和 stream=True (SSE) 两种回复，GET /stats 返回各类结果的计数。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_zhipuai import fake_reply
+
+
+class StubConfig:
+    def __init__(self, latency=0.05, jitter=0.02, slow_rate=0.0, slow_latency=3.0, fail_rate=0.0, throttle_rate=0.0,
+                 drop_rate=0.0, chunk_delay=0.01, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.drop_rate = drop_rate
+        self.chunk_delay = chunk_delay
+        self.rng = random.Random(seed)
+        self.counts = {"requests": 0, "ok": 0, "slow": 0, "500": 0, "429": 0, "dropped": 0}
+        self.lock = threading.Lock()
+
+    def pick(self):
+        with self.lock:
+            self.counts["requests"] += 1
+            r = self.rng.random()
+            for outcome, rate in (("500", self.fail_rate), ("429", self.throttle_rate), ("dropped", self.drop_rate), ("slow", self.slow_rate)):
+                if r < rate:
+                    self.counts[outcome] += 1
+                    return outcome
+                r -= rate
+            self.counts["ok"] += 1
+            return "ok"
+
+    def delay(self, outcome):
+        base = self.slow_latency if outcome == "slow" else self.latency
+        with self.lock: extra = self.rng.uniform(0, self.jitter)
+        time.sleep(base + extra)
+
+
+def completion_body(content):
+    return {"id": "stub", "created": int(time.time()), "model": "stub", "choices": [
+        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+
+def chunk_body(piece):
+    return {"id": "stub", "created": int(time.time()), "model": "stub", "choices": [
+        {"index": 0, "delta": {"role": "assistant", "content": piece}}]}
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            # 服务端计数，压测脚本用来算实际发出了多少请求
+            if self.path.rstrip("/").endswith("stats"):
+                with config.lock: return self.send_json(200, dict(config.counts))
+            self.send_json(404, {"error": {"code": "404", "message": "not found"}})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("chat/completions"):
+                return self.send_json(404, {"error": {"code": "404", "message": "not found"}})
+            outcome = config.pick()
+            config.delay(outcome)
+            if outcome == "dropped":
+                # 不回任何字节直接断开，客户端看到的是连接被重置
+                self.close_connection = True
+                return
+            if outcome in ("500", "429"):
+                return self.send_json(int(outcome), {"error": {"code": outcome, "message": f"stub {outcome}"}})
+            content = fake_reply(payload["messages"][0]["content"][0]["image_url"]["url"])
+            if not payload.get("stream"):
+                return self.send_json(200, completion_body(content))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i in range(0, len(content), 8):
+                    self.write_chunk(f"data: {json.dumps(chunk_body(content[i:i + 8]), ensure_ascii=False)}\n\n")
+                    time.sleep(config.chunk_delay)
+                self.write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端提前断开 (非云图片提前结束)
+                self.close_connection = True
+
+        def write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=0, config=None):
+    """在后台线程启动服务，返回 (server, config)；server.server_address 里是实际端口。"""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="注入延迟和故障的本地智谱接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="长尾请求比例")
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="直接断开连接的比例")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    config = StubConfig(args.latency, args.jitter, args.slow_rate, args.slow_latency, args.fail_rate, args.throttle_rate,
+                        args.drop_rate, seed=args.seed)
+    server, _ = serve(args.host, args.port, config)
+    print(f"stub listening on http://{args.host}:{server.server_address[1]}/")
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(config.counts))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
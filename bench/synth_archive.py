@@ -0,0 +1,134 @@
+"""生成合成的 clouds.db 档案，供基准测试使用。
+
+表结构由 app.py 自己建立（在 AppTest 里跑一次空库），这里只批量灌数据：
+history 行直接用 executemany 写入，统计表由触发器维护；原图按内容寻址
+写进 cloud_images/。为了不让 10 万张照片占满磁盘，每条记录的原图都是
+一小组真实尺寸样图之一的硬链接（不支持硬链接时退回复制），文件大小和
+解码开销与手机照片相当。users > 1 时记录轮流分给多个用户 (第一个是
+默认用户)，用来确认页面开销只和当前用户的档案量有关。
+
+    python bench/synth_archive.py --records 10000 --out /tmp/archive_10k
+    python bench/synth_archive.py --records 100000 --users 200 --out /tmp/archive_100k_u200
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import sys
+
+import numpy as np
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(BENCH_DIR), "app.py")
+sys.path.insert(0, BENCH_DIR)
+
+import fake_zhipuai  # noqa: E402
+
+CLOUD_NAMES = ["积云", "淡积云", "层云", "飞机尾迹", "层积云", "高积云", "高层云", "卷云", "卷层云", "雨层云",
+               "卷积云", "积雨云", "浓积云", "幡状云", "波状高积云", "日晕", "彩虹", "云隙光", "乳状云",
+               "双彩虹", "荚状云", "虹彩云", "糙面云", "滚轴云", "马蹄云", "海啸云", "火彩虹", "红色精灵"]
+
+
+def tier_for(score):
+    if score <= 10: return "N"
+    if score <= 29: return "R"
+    if score <= 39: return "SR"
+    if score <= 49: return "SSR"
+    return "UR"
+
+
+def make_sample_photo(seed, size=(4032, 3024), quality=92):
+    # 低频渐变 + 噪点，编码后体积接近手机拍的天空照片
+    rng = np.random.default_rng(seed)
+    base = rng.random((6, 8, 3)) * 120 + np.array([90, 130, 170])
+    img = Image.fromarray(base.clip(0, 255).astype("uint8")).resize(size, Image.Resampling.BICUBIC)
+    noise = rng.normal(0, 6, (size[1], size[0], 3))
+    img = Image.fromarray((np.asarray(img, dtype=np.float32) + noise).clip(0, 255).astype("uint8"))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def init_schema(out_dir):
+    # 让 app.py 在目标目录下自己建库、跑迁移
+    fake_zhipuai.install()
+    from streamlit.testing.v1 import AppTest
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=120)
+        at.secrets["ZHIPU_API_KEY"] = "bench"
+        at.run()
+        if at.exception: raise RuntimeError(at.exception[0].value)
+    finally:
+        os.chdir(cwd)
+
+
+def link_or_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try: os.link(src, dst)
+    except OSError: shutil.copyfile(src, dst)
+
+
+def user_for(i, users):
+    return "default" if i % users == 0 else f"bench-user-{i % users}"
+
+
+def build_archive(out_dir, records, samples=8, image_size=(4032, 3024), seed=0, users=1):
+    os.makedirs(out_dir, exist_ok=True)
+    init_schema(out_dir)
+    rng = random.Random(seed)
+    sample_dir = os.path.join(out_dir, "_samples")
+    os.makedirs(sample_dir, exist_ok=True)
+    sample_paths = []
+    for i in range(samples):
+        path = os.path.join(sample_dir, f"sample_{i}.jpg")
+        if not os.path.exists(path):
+            with open(path, "wb") as fp: fp.write(make_sample_photo(seed + i, image_size))
+        sample_paths.append(path)
+
+    conn = sqlite3.connect(os.path.join(out_dir, "clouds.db"))
+    start = datetime.datetime(2020, 1, 1)
+    seen_species = set()
+    rows = []
+    for i in range(records):
+        user_id = user_for(i, users)
+        name = rng.choice(CLOUD_NAMES)
+        score = 0 if (user_id, name) in seen_species else rng.choice([5, 10, 15, 25, 35, 45, 55, 80])
+        seen_species.add((user_id, name))
+        img_hash = hashlib.md5(f"bench-{seed}-{i}".encode()).hexdigest()
+        phash = rng.getrandbits(64)
+        if phash >= 1 << 63: phash -= 1 << 64
+        ts = (start + datetime.timedelta(minutes=37 * i)).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append((user_id, name, tier_for(score), score, "合成数据", "合成数据", img_hash, phash, ts))
+        link_or_copy(sample_paths[i % len(sample_paths)],
+                     os.path.join(out_dir, "cloud_images", img_hash[:2], img_hash[2:4], img_hash))
+        if len(rows) >= 5000:
+            conn.executemany('INSERT INTO history (user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    if rows:
+        conn.executemany('INSERT INTO history (user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成 clouds.db 档案")
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--samples", type=int, default=8, help="不同样图的数量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=1, help="记录分给多少个用户")
+    args = parser.parse_args()
+    build_archive(args.out, args.records, samples=args.samples, seed=args.seed, users=args.users)
+    print(f"已生成 {args.records} 条记录：{args.out}")
+
+
+if __name__ == "__main__":
+    main()
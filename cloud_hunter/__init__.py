@@ -0,0 +1,13 @@
+"""云彩收集者手册的核心库，页面 (app.py)、后台任务和命令行工具共用，本身不渲染任何页面元素。
+
+    scoring    计分表、等级/称号、勋章、云名标准化 (纯 Python)
+    metrics    分阶段计时
+    images     解码校验、缩图、感知哈希、天空预筛 (PIL/numpy 用到时才导入)
+    db         数据库、原图仓库、查询、备份导入导出
+    model      智谱客户端、回复缓存、鉴定 (zhipuai/httpx 用到时才导入)
+    jobs       后台鉴定任务队列
+    cards      收藏卡片渲染
+    ingest     命令行批量导入 (python -m cloud_hunter.ingest)
+
+进程内共享的资源由 resources.once 在第一次用到时初始化一次，不依赖 streamlit。
+"""
@@ -0,0 +1,96 @@
+"""收藏卡片：把照片和等级、积分、云名排成一张 PNG，页面下载和其他前端共用。PIL 在渲染时才导入。"""
+import datetime
+import io
+import os
+import platform
+
+from cloud_hunter.resources import once
+from cloud_hunter.scoring import CLOUD_TRANSLATIONS, get_tier_color, normalize_tier
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+# 字体注册表：平台探测和字体文件查找整个进程只做一次，每个字号只加载一次
+@once
+def find_chinese_font_path():
+    from PIL import ImageFont
+    system = platform.system()
+    font_paths = []
+    if system == "Windows":
+        font_paths = ["C:\\Windows\\Fonts\\simkai.ttf", "C:\\Windows\\Fonts\\simsun.ttc"]
+    elif system == "Darwin":
+        font_paths = ["/System/Library/Fonts/STKaiti.ttf", "/Library/Fonts/Songti.ttc"]
+    for path in font_paths:
+        if os.path.exists(path):
+            try: ImageFont.truetype(path, 10); return path
+            except Exception: continue
+    return None
+
+@once
+def load_chinese_font(size):
+    from PIL import ImageFont
+    path = find_chinese_font_path()
+    if path is None: return ImageFont.load_default()
+    return ImageFont.truetype(path, size)
+
+def create_share_card(image_bytes, cloud_name, tier, score, date_str=None):
+    from PIL import Image, ImageDraw
+    base_img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+    target_width = 1000
+    ratio = target_width / base_img.width
+    image_height = int(base_img.height * ratio)
+    base_img = base_img.resize((target_width, image_height), Image.Resampling.LANCZOS)
+
+    footer_height = 350 
+    total_height = image_height + footer_height
+    canvas = Image.new("RGBA", (target_width, total_height), (250, 249, 246, 255))
+    canvas.paste(base_img, (0, 0))
+    draw = ImageDraw.Draw(canvas)
+    
+    clean_tier = normalize_tier(tier)
+    theme_color_hex = get_tier_color(clean_tier)
+    theme_color_rgb = hex_to_rgb(theme_color_hex)
+    text_color_main = (44, 62, 80)
+    text_color_sub = (127, 140, 141)
+    
+    font_badge_abbr = load_chinese_font(100) 
+    font_score_num = load_chinese_font(100) 
+    font_score_label = load_chinese_font(30) 
+    font_name = load_chinese_font(80)  
+    font_date = load_chinese_font(30)  
+    font_en = load_chinese_font(40)
+
+    footer_start_y = image_height
+    padding = 50
+
+    draw.line([(padding, footer_start_y), (target_width - padding, footer_start_y)], fill=theme_color_rgb, width=3)
+    badge_x = padding
+    badge_y = footer_start_y + 55
+    draw.text((badge_x, badge_y), clean_tier, fill=theme_color_rgb, font=font_badge_abbr)
+
+    score_num_str = str(score)
+    score_label_str = "分"
+    score_num_width = draw.textlength(score_num_str, font=font_score_num)
+    score_label_width = draw.textlength(score_label_str, font=font_score_label)
+    score_x_end = target_width - padding
+    draw.text((score_x_end - score_label_width, badge_y + 55), score_label_str, fill=theme_color_rgb, font=font_score_label)
+    draw.text((score_x_end - score_label_width - score_num_width - 10, badge_y), score_num_str, fill=theme_color_rgb, font=font_score_num)
+
+    name_y = footer_start_y + 180
+    draw.text((padding, name_y), cloud_name, fill=text_color_main, font=font_name)
+    
+    en_name = CLOUD_TRANSLATIONS.get(cloud_name, "")
+    if en_name:
+        draw.text((padding, name_y + 100), en_name, fill=text_color_sub, font=font_en)
+        footer_offset = 180
+    else:
+        footer_offset = 100
+
+    if date_str is None: date_str = datetime.datetime.now().strftime("%Y.%m.%d")
+    footer_text = f"观测于 {date_str}  |  云彩收集者手册"
+    draw.text((padding, name_y + footer_offset), footer_text, fill=text_color_sub, font=font_date)
+
+    output_buffer = io.BytesIO()
+    canvas.save(output_buffer, format="PNG")
+    return output_buffer.getvalue()
@@ -0,0 +1,838 @@
+"""数据库和原图仓库：连接池、表结构迁移、档案/统计查询、缩略图、近似查重索引和备份导入导出。"""
+import datetime
+import hashlib
+import io
+import json
+import mmap
+import os
+import queue
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from cloud_hunter.images import THUMB_SIZES, compute_phash, encode_thumbnail, make_preview, make_square_thumbnail, phash_is_informative
+from cloud_hunter.resources import once
+from cloud_hunter.scoring import (
+    OFFICIAL_SCORES, SCORE_TABLE_VERSION, calculate_tier_from_score, get_achievement_engine, get_name_resolver,
+    normalize_tier, sql_tier_case,
+)
+
+# ==========================================
+# 🔧 数据库 & 原图仓库
+# ==========================================
+
+DB_PATH = "clouds.db"
+
+# 每个连接建立时执行一次；WAL 让多个会话读写互不阻塞，busy_timeout 代替 "database is locked"
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 30000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+]
+
+class SQLitePool:
+    """进程内共享的 SQLite 连接池，借出的连接在 with 块结束时提交并归还。"""
+
+    def __init__(self, path, max_idle=8):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS: conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try: conn = self._idle.get_nowait()
+        except queue.Empty: conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try: self._idle.put_nowait(conn)
+            except queue.Full: conn.close()
+
+IMAGE_STORE_DIR = "cloud_images"
+
+class FileImageStore:
+    """按 md5 内容寻址的原图目录：ab/cd/abcd...，写入一次后只读。
+
+    任何提供 put / get / delete 的对象都可以替换它，见 get_image_store()。
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, image_hash):
+        return os.path.join(self.root, image_hash[:2], image_hash[2:4], image_hash)
+
+    def put(self, image_hash, image_bytes):
+        path = self.path_for(image_hash)
+        if os.path.exists(path): return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(image_bytes)
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, image_hash):
+        path = self.path_for(image_hash)
+        try:
+            with open(path, "rb") as fp:
+                if os.fstat(fp.fileno()).st_size == 0: return b""
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+        except FileNotFoundError:
+            return None
+
+    def delete(self, image_hash):
+        try: os.remove(self.path_for(image_hash))
+        except FileNotFoundError: pass
+
+@once
+def get_image_store():
+    return FileImageStore(IMAGE_STORE_DIR)
+
+def move_blobs_to_image_store(conn, store=None):
+    store = store or get_image_store()
+    c = conn.cursor()
+    while True:
+        c.execute('SELECT id, image_hash, image_data FROM history WHERE image_data IS NOT NULL LIMIT 200')
+        rows = c.fetchall()
+        if not rows: break
+        for r_id, r_hash, r_blob in rows:
+            # 仓库按内容寻址：以原图实际的 md5 为准，导入的旧库里 hash 对不上的行一并改正
+            blob_hash = hashlib.md5(r_blob).hexdigest()
+            if r_hash != blob_hash:
+                r_hash = blob_hash
+                c.execute('UPDATE history SET image_hash = ? WHERE id = ?', (r_hash, r_id))
+            store.put(r_hash, r_blob)
+            c.execute('UPDATE history SET image_data = NULL WHERE id = ?', (r_id,))
+        conn.commit()
+    # 原图搬走后回收空间，VACUUM 不能在事务里执行
+    conn.commit()
+    conn.execute('VACUUM')
+
+
+# SQLite 的 INTEGER 是有符号 64 位，存取时做一次补码转换
+def phash_to_db(phash):
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+def phash_from_db(value):
+    return value & ((1 << 64) - 1)
+
+def add_phash_columns(conn):
+    c = conn.cursor()
+    c.execute('ALTER TABLE history ADD COLUMN phash INTEGER')
+    c.execute('ALTER TABLE jobs ADD COLUMN force INTEGER NOT NULL DEFAULT 0')
+    c.execute('SELECT id, image_hash FROM history')
+    store = get_image_store()
+    for r_id, r_hash in c.fetchall():
+        image_bytes = store.get(r_hash)
+        if not image_bytes: continue
+        try: phash = compute_phash(image_bytes)
+        except Exception: continue
+        c.execute('UPDATE history SET phash = ? WHERE id = ?', (phash_to_db(phash), r_id))
+
+DEFAULT_USER = "default"
+
+# v4 起的统计触发器：species_stats / collection_totals 按 user_id 分开维护
+USER_STATS_TRIGGERS = [
+    '''CREATE TRIGGER trg_history_insert AFTER INSERT ON history BEGIN
+        INSERT OR IGNORE INTO species_stats (user_id, cloud_name) VALUES (NEW.user_id, NEW.cloud_name);
+        UPDATE species_stats SET obs_count = obs_count + 1, total_score = total_score + NEW.score,
+            best_score = MAX(best_score, NEW.score) WHERE user_id = NEW.user_id AND cloud_name = NEW.cloud_name;
+        INSERT OR IGNORE INTO collection_totals (user_id) VALUES (NEW.user_id);
+        UPDATE collection_totals SET total_score = total_score + NEW.score, total_obs = total_obs + 1 WHERE user_id = NEW.user_id;
+    END''',
+    '''CREATE TRIGGER trg_history_delete AFTER DELETE ON history BEGIN
+        UPDATE species_stats SET obs_count = obs_count - 1, total_score = total_score - OLD.score,
+            best_score = (SELECT COALESCE(MAX(score), 0) FROM history WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name)
+            WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name;
+        DELETE FROM species_stats WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name AND obs_count <= 0;
+        UPDATE collection_totals SET total_score = total_score - OLD.score, total_obs = total_obs - 1 WHERE user_id = OLD.user_id;
+    END''',
+    '''CREATE TRIGGER trg_history_update AFTER UPDATE OF user_id, cloud_name, score ON history BEGIN
+        UPDATE species_stats SET obs_count = obs_count - 1, total_score = total_score - OLD.score,
+            best_score = (SELECT COALESCE(MAX(score), 0) FROM history WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name)
+            WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name;
+        DELETE FROM species_stats WHERE user_id = OLD.user_id AND cloud_name = OLD.cloud_name AND obs_count <= 0;
+        INSERT OR IGNORE INTO species_stats (user_id, cloud_name) VALUES (NEW.user_id, NEW.cloud_name);
+        UPDATE species_stats SET obs_count = obs_count + 1, total_score = total_score + NEW.score,
+            best_score = MAX(best_score, NEW.score) WHERE user_id = NEW.user_id AND cloud_name = NEW.cloud_name;
+        UPDATE collection_totals SET total_score = total_score - OLD.score, total_obs = total_obs - 1 WHERE user_id = OLD.user_id;
+        INSERT OR IGNORE INTO collection_totals (user_id) VALUES (NEW.user_id);
+        UPDATE collection_totals SET total_score = total_score + NEW.score, total_obs = total_obs + 1 WHERE user_id = NEW.user_id;
+    END''',
+]
+
+def add_user_partitioning(conn):
+    # image_hash 从全库唯一改成每个用户内唯一，SQLite 改不了列约束，只能重建 history
+    c = conn.cursor()
+    c.execute(f'''
+        CREATE TABLE history_v4 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL DEFAULT '{DEFAULT_USER}',
+            cloud_name TEXT,
+            tier TEXT,
+            score INTEGER,
+            science_fact TEXT,
+            weather_tip TEXT,
+            image_hash TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            phash INTEGER,
+            UNIQUE (user_id, image_hash)
+        )
+    ''')
+    c.execute('INSERT INTO history_v4 (id, cloud_name, tier, score, science_fact, weather_tip, image_hash, timestamp, phash) '
+              'SELECT id, cloud_name, tier, score, science_fact, weather_tip, image_hash, timestamp, phash FROM history')
+    c.execute('DROP TABLE history')
+    c.execute('ALTER TABLE history_v4 RENAME TO history')
+    # 页面上的查询都带 user_id：物种统计/首发判定/图鉴走 (user_id, cloud_name)，列表和增量备份走 (user_id, id)
+    c.execute('CREATE INDEX idx_history_user_name ON history (user_id, cloud_name)')
+    c.execute('CREATE INDEX idx_history_user_id ON history (user_id, id DESC)')
+    c.execute('CREATE INDEX idx_history_hash ON history (image_hash)')
+    c.execute('CREATE INDEX idx_history_timestamp ON history (timestamp)')
+    c.execute('DROP TABLE species_stats')
+    c.execute('''
+        CREATE TABLE species_stats (
+            user_id TEXT NOT NULL,
+            cloud_name TEXT NOT NULL,
+            obs_count INTEGER NOT NULL DEFAULT 0,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            best_score INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, cloud_name)
+        )
+    ''')
+    c.execute('DROP TABLE collection_totals')
+    c.execute('''
+        CREATE TABLE collection_totals (
+            user_id TEXT PRIMARY KEY,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            total_obs INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for sql in USER_STATS_TRIGGERS: c.execute(sql)
+    rebuild_collection_stats(c)
+    # 保留 rowid，已打开的会话不会把旧勋章再提示一遍
+    c.execute(f'''
+        CREATE TABLE achievement_unlocks_v4 (
+            user_id TEXT NOT NULL DEFAULT '{DEFAULT_USER}',
+            name TEXT NOT NULL,
+            unlocked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, name)
+        )
+    ''')
+    c.execute('INSERT INTO achievement_unlocks_v4 (rowid, name, unlocked_at) SELECT rowid, name, unlocked_at FROM achievement_unlocks')
+    c.execute('DROP TABLE achievement_unlocks')
+    c.execute('ALTER TABLE achievement_unlocks_v4 RENAME TO achievement_unlocks')
+    c.execute(f"ALTER TABLE jobs ADD COLUMN user_id TEXT NOT NULL DEFAULT '{DEFAULT_USER}'")
+
+# 只能往后追加；执行进度记在 PRAGMA user_version 里，每项只跑一次。
+# 每一项是 SQL 列表或者接收 conn 的函数
+SCHEMA_MIGRATIONS = [
+    # v1：删除触发器按物种查最高分，备份等按时间范围扫描
+    [
+        "CREATE INDEX IF NOT EXISTS idx_history_name_score ON history (cloud_name, score)",
+        "CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)",
+    ],
+    # v2：原图从 history.image_data 搬进 FileImageStore，history 只留元数据
+    move_blobs_to_image_store,
+    # v3：近似查重用的感知哈希，以及允许跳过查重的任务标记
+    add_phash_columns,
+    # v4：多用户，档案/统计/勋章/任务都带 user_id，已有数据归到 DEFAULT_USER
+    add_user_partitioning,
+]
+
+def migrate_db(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for new_version, step in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        if callable(step): step(conn)
+        else:
+            for sql in step: conn.execute(sql)
+        conn.execute(f'PRAGMA user_version = {new_version}')
+
+@once
+def get_db_pool():
+    pool = SQLitePool(DB_PATH)
+    with pool.connection() as conn:
+        init_db(conn)
+        migrate_db(conn)
+        sync_score_table_version(conn)
+    return pool
+
+def db_conn():
+    return get_db_pool().connection()
+
+def init_db(conn):
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cloud_name TEXT,
+            tier TEXT,
+            score INTEGER,
+            science_fact TEXT,
+            weather_tip TEXT,
+            image_data BLOB, -- 旧版原图列，v2 迁移后恒为 NULL
+            image_hash TEXT UNIQUE, 
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 缩略图表：按 image_hash 存一份预渲染好的 JPEG，藏品馆不再每次重跑 LANCZOS
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            image_hash TEXT,
+            size TEXT,
+            thumb_data BLOB,
+            PRIMARY KEY (image_hash, size)
+        )
+    ''')
+    # 物化统计：由触发器随 history 的增删改同步维护，侧边栏只读这两张小表
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS species_stats (
+            cloud_name TEXT PRIMARY KEY,
+            obs_count INTEGER NOT NULL DEFAULT 0,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            best_score INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS collection_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_score INTEGER NOT NULL DEFAULT 0,
+            total_obs INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.executescript('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_insert AFTER INSERT ON history BEGIN
+            INSERT OR IGNORE INTO species_stats (cloud_name) VALUES (NEW.cloud_name);
+            UPDATE species_stats SET obs_count = obs_count + 1, total_score = total_score + NEW.score,
+                best_score = MAX(best_score, NEW.score) WHERE cloud_name = NEW.cloud_name;
+            UPDATE collection_totals SET total_score = total_score + NEW.score, total_obs = total_obs + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_history_delete AFTER DELETE ON history BEGIN
+            UPDATE species_stats SET obs_count = obs_count - 1, total_score = total_score - OLD.score,
+                best_score = (SELECT COALESCE(MAX(score), 0) FROM history WHERE cloud_name = OLD.cloud_name) WHERE cloud_name = OLD.cloud_name;
+            DELETE FROM species_stats WHERE cloud_name = OLD.cloud_name AND obs_count <= 0;
+            UPDATE collection_totals SET total_score = total_score - OLD.score, total_obs = total_obs - 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_history_update AFTER UPDATE OF cloud_name, score ON history BEGIN
+            UPDATE species_stats SET obs_count = obs_count - 1, total_score = total_score - OLD.score,
+                best_score = (SELECT COALESCE(MAX(score), 0) FROM history WHERE cloud_name = OLD.cloud_name) WHERE cloud_name = OLD.cloud_name;
+            DELETE FROM species_stats WHERE cloud_name = OLD.cloud_name AND obs_count <= 0;
+            INSERT OR IGNORE INTO species_stats (cloud_name) VALUES (NEW.cloud_name);
+            UPDATE species_stats SET obs_count = obs_count + 1, total_score = total_score + NEW.score,
+                best_score = MAX(best_score, NEW.score) WHERE cloud_name = NEW.cloud_name;
+            UPDATE collection_totals SET total_score = total_score - OLD.score + NEW.score WHERE id = 1;
+        END;
+    ''')
+    c.execute('CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value TEXT)')
+    # 勋章解锁流水：入库时增量判定新解锁的勋章，页面按 rowid 推送提示
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS achievement_unlocks (
+            name TEXT PRIMARY KEY,
+            unlocked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 模型回复缓存：删掉档案或解析失败后再传同一张图不用重新调模型
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            image_hash TEXT,
+            model TEXT,
+            prompt_version TEXT,
+            response TEXT,
+            created_at REAL,
+            last_used REAL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (image_hash, model, prompt_version)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_lru ON response_cache (last_used)')
+    # 后台鉴定任务：状态持久化，进程重启后未完成的任务会重新排队
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_hash TEXT NOT NULL,
+            file_name TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_hash ON jobs (image_hash, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+# 统计表从 history 全量重新生成 (v4 迁移时执行一次)
+def rebuild_collection_stats(c):
+    c.execute('DELETE FROM species_stats')
+    c.execute('INSERT INTO species_stats (user_id, cloud_name, obs_count, total_score, best_score) '
+              'SELECT user_id, cloud_name, COUNT(*), SUM(score), MAX(score) FROM history GROUP BY user_id, cloud_name')
+    c.execute('DELETE FROM collection_totals')
+    c.execute('INSERT INTO collection_totals (user_id, total_score, total_obs) SELECT user_id, COALESCE(SUM(score), 0), COUNT(*) FROM history GROUP BY user_id')
+
+def delete_record(user_id, record_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT image_hash FROM history WHERE id = ? AND user_id = ?', (record_id, user_id))
+        row = c.fetchone()
+        if row is None: return
+        c.execute('DELETE FROM history WHERE id = ?', (record_id,))
+        # 原图和缩略图按内容共享，别的用户还收藏着同一张照片时保留
+        c.execute('SELECT 1 FROM history WHERE image_hash = ? LIMIT 1', (row[0],))
+        shared = c.fetchone() is not None
+        if not shared: c.execute('DELETE FROM thumbnails WHERE image_hash = ?', (row[0],))
+    if not shared: get_image_store().delete(row[0])
+
+
+# 需要改动的行：按当前计分表算出的新分数/新等级和库里不一致的 (保留 0 分的备份记录)
+# 页面上的修复只动当前用户的记录；不带用户过滤的全库版本只给启动时计分表升级用
+def rescore_diff_sql(user_scoped):
+    user_filter = " AND h.user_id = ?" if user_scoped else ""
+    return f'''
+    SELECT id, cloud_name, old_score, old_tier, new_score, {sql_tier_case("new_score")} AS new_tier FROM (
+        SELECT h.id, h.cloud_name, h.score AS old_score, h.tier AS old_tier, COALESCE(m.score, h.score) AS new_score
+        FROM history h LEFT JOIN temp.rescore_map m ON m.cloud_name = h.cloud_name
+        WHERE h.score != 0{user_filter}
+    ) WHERE old_score != new_score OR old_tier IS NOT {sql_tier_case("new_score")}
+'''
+
+def build_rescore_map(conn, user_id=None):
+    # 云名种类远少于记录数：只对去重后的名字在 Python 里解析一次，结果放进临时表
+    c = conn.cursor()
+    c.execute('CREATE TEMP TABLE IF NOT EXISTS rescore_map (cloud_name TEXT PRIMARY KEY, score INTEGER)')
+    c.execute('DELETE FROM temp.rescore_map')
+    if user_id is None: c.execute('SELECT DISTINCT cloud_name FROM history')
+    else: c.execute('SELECT DISTINCT cloud_name FROM history WHERE user_id = ?', (user_id,))
+    resolver = get_name_resolver()
+    mapping = []
+    for (name,) in c.fetchall():
+        resolved = resolver.resolve(name)
+        if resolved: mapping.append((name, OFFICIAL_SCORES[resolved]))
+    c.executemany('INSERT INTO temp.rescore_map (cloud_name, score) VALUES (?, ?)', mapping)
+
+def rescore_history(conn, user_id=None, dry_run=False):
+    """user_id 为 None 时重算全库 (计分表升级)，否则只重算这个用户的记录。"""
+    build_rescore_map(conn, user_id)
+    diff_sql = rescore_diff_sql(user_id is not None)
+    params = () if user_id is None else (user_id,)
+    c = conn.cursor()
+    c.execute(diff_sql, params)
+    diff = c.fetchall()
+    if dry_run or not diff: return diff
+    if sqlite3.sqlite_version_info >= (3, 33, 0):
+        c.execute(f'UPDATE history SET score = d.new_score, tier = d.new_tier FROM ({diff_sql}) AS d WHERE history.id = d.id', params)
+    else:
+        c.executemany('UPDATE history SET score = ?, tier = ? WHERE id = ?', [(row[4], row[5], row[0]) for row in diff])
+    return diff
+
+def preview_legacy_scores(user_id):
+    with db_conn() as conn:
+        return rescore_history(conn, user_id, dry_run=True)
+
+def fix_legacy_scores_forced(user_id):
+    with db_conn() as conn:
+        return len(rescore_history(conn, user_id))
+
+def sync_score_table_version(conn):
+    c = conn.cursor()
+    c.execute("SELECT value FROM app_meta WHERE key = 'score_table_version'")
+    row = c.fetchone()
+    # 第一次见到时只记下版本，不动已有数据；旧数据仍可以手动 🛠️ 修复
+    if row is not None and row[0] != SCORE_TABLE_VERSION: rescore_history(conn)
+    c.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('score_table_version', ?)", (SCORE_TABLE_VERSION,))
+
+def get_record_by_hash(user_id, img_hash):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT cloud_name, tier, score, science_fact, weather_tip, timestamp FROM history WHERE user_id = ? AND image_hash = ?', (user_id, img_hash))
+        return c.fetchone()
+
+def record_achievement_unlocks(conn, user_id, cloud_name):
+    # 只有新物种入库才可能解锁勋章；已有物种直接跳过，不用读整个收藏
+    engine = get_achievement_engine()
+    bit = engine.bits.get(cloud_name, 0)
+    if not bit: return []
+    c = conn.cursor()
+    c.execute('SELECT 1 FROM species_stats WHERE user_id = ? AND cloud_name = ?', (user_id, cloud_name))
+    if c.fetchone(): return []
+    c.execute('SELECT cloud_name FROM species_stats WHERE user_id = ?', (user_id,))
+    old_mask = engine.mask_for(row[0] for row in c.fetchall())
+    newly = engine.newly_unlocked(old_mask, old_mask | bit)
+    c.executemany('INSERT OR IGNORE INTO achievement_unlocks (user_id, name) VALUES (?, ?)', [(user_id, name) for name in newly])
+    return newly
+
+def get_unlocks_since(user_id, last_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT rowid, name FROM achievement_unlocks WHERE user_id = ? AND rowid > ? ORDER BY rowid', (user_id, last_id))
+        return c.fetchall()
+
+def insert_history_row(conn, user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash, first_discovery=False):
+    record_achievement_unlocks(conn, user_id, cloud_name)
+    if first_discovery:
+        # 首发判定和写入放在同一条语句里，多个后台任务并发入库时只有第一条拿分；首发按用户各自判定
+        conn.execute('INSERT INTO history (user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash) '
+                     'SELECT ?, ?, ?, CASE WHEN EXISTS (SELECT 1 FROM history WHERE user_id = ? AND cloud_name = ?) THEN 0 ELSE ? END, ?, ?, ?, ?',
+                     (user_id, cloud_name, tier, user_id, cloud_name, score, science_fact, weather_tip, image_hash, phash_to_db(phash)))
+    else:
+        conn.execute('INSERT INTO history (user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (user_id, cloud_name, tier, score, science_fact, weather_tip, image_hash, phash_to_db(phash)))
+
+def save_to_db(user_id, cloud_name, tier, score, science_fact, weather_tip, image_bytes, image_hash, first_discovery=False):
+    clean_tier = normalize_tier(tier)
+    # 先落盘再写行：行存在时原图一定已经在仓库里
+    get_image_store().put(image_hash, image_bytes)
+    phash = compute_phash(image_bytes)
+    # 索引要在写行之前拿到：还没建过时现建会读到新行，事后再 add 就重复了
+    phash_index = get_phash_index(user_id)
+    try:
+        with db_conn() as conn:
+            insert_history_row(conn, user_id, cloud_name, clean_tier, score, science_fact, weather_tip, image_hash, phash, first_discovery)
+    except sqlite3.IntegrityError:
+        return False
+    phash_index.add(phash, image_hash)
+    save_thumbnail(image_hash, image_bytes)
+    return True
+
+def save_batch(user_id, records):
+    """一个事务写入多条鉴定结果，都按首发规则计分；返回实际写入的 image_hash 集合。
+
+    records 里每项是 (cloud_name, tier, score, science_fact, weather_tip, image_hash, phash, square_thumb)，
+    原图需要事先放进仓库。已在档案里的照片跳过，不影响同批其他记录。
+    """
+    saved = []
+    phash_index = get_phash_index(user_id)
+    with db_conn() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        for cloud_name, tier, score, science_fact, weather_tip, image_hash, phash, thumb_bytes in records:
+            conn.execute('SAVEPOINT batch_row')
+            try:
+                insert_history_row(conn, user_id, cloud_name, normalize_tier(tier), score, science_fact, weather_tip, image_hash, phash, first_discovery=True)
+            except sqlite3.IntegrityError:
+                conn.execute('ROLLBACK TO batch_row')
+            else:
+                if thumb_bytes:
+                    conn.execute('INSERT OR REPLACE INTO thumbnails (image_hash, size, thumb_data) VALUES (?, ?, ?)', (image_hash, "square", thumb_bytes))
+                saved.append((image_hash, phash))
+            conn.execute('RELEASE batch_row')
+    for image_hash, phash in saved: phash_index.add(phash, image_hash)
+    return {image_hash for image_hash, _ in saved}
+
+# 列表只取元数据，原图按需单独读取，避免每次 rerun 把所有照片拉进内存
+def get_history(user_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, cloud_name, tier, score, science_fact, weather_tip, image_hash, timestamp FROM history WHERE user_id = ? ORDER BY id DESC', (user_id,))
+        return c.fetchall()
+
+# 图鉴网格每个物种只要一行：观测次数 + 最近一条的简介和缩略图
+def get_species_gallery(user_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT s.cloud_name, s.obs_count, h.science_fact, h.image_hash
+            FROM species_stats s
+            JOIN history h ON h.id = (SELECT MAX(id) FROM history WHERE user_id = s.user_id AND cloud_name = s.cloud_name)
+            WHERE s.user_id = ?
+            ORDER BY h.id DESC
+        ''', (user_id,))
+        return c.fetchall()
+
+def get_collection_stats(user_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT total_score, total_obs FROM collection_totals WHERE user_id = ?', (user_id,))
+        total_score, total_obs = c.fetchone() or (0, 0)
+        c.execute('SELECT cloud_name, best_score FROM species_stats WHERE user_id = ?', (user_id,))
+        species_best = dict(c.fetchall())
+    tier_counts = {"UR": 0, "SSR": 0, "SR": 0, "R": 0, "N": 0}
+    for best_score in species_best.values():
+        tier_counts[calculate_tier_from_score(best_score)] += 1
+    return total_score, total_obs, len(species_best), tier_counts, species_best
+
+def get_species_records(user_id, cloud_name, limit, offset=0):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, score, image_hash, timestamp FROM history WHERE user_id = ? AND cloud_name = ? ORDER BY id DESC LIMIT ? OFFSET ?',
+                  (user_id, cloud_name, limit, offset))
+        return c.fetchall()
+
+def get_image_by_hash(img_hash):
+    return get_image_store().get(img_hash)
+
+PHASH_THRESHOLD = 8
+
+class BKTree:
+    """按汉明距离组织的 BK 树，查询半径 r 内的指纹只需访问很少的节点。"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def add(self, phash, item):
+        with self._lock:
+            self.size += 1
+            if self.root is None:
+                self.root = (phash, item, {})
+                return
+            node = self.root
+            while True:
+                dist = (node[0] ^ phash).bit_count()
+                child = node[2].get(dist)
+                if child is None:
+                    node[2][dist] = (phash, item, {})
+                    return
+                node = child
+
+    def search(self, phash, radius):
+        found = []
+        with self._lock:
+            stack = [self.root] if self.root else []
+            while stack:
+                node = stack.pop()
+                dist = (node[0] ^ phash).bit_count()
+                if dist <= radius: found.append((dist, node[1]))
+                for child_dist, child in node[2].items():
+                    if dist - radius <= child_dist <= dist + radius: stack.append(child)
+        return sorted(found)
+
+# 每个用户一棵树，第一次查重时才从库里建；只常驻最近活跃的这么多个用户
+PHASH_INDEX_MAX_USERS = 64
+
+@once(max_entries=PHASH_INDEX_MAX_USERS)
+def get_phash_index(user_id):
+    index = BKTree()
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT phash, image_hash FROM history WHERE user_id = ? AND phash IS NOT NULL', (user_id,))
+        for phash, img_hash in c.fetchall(): index.add(phash_from_db(phash), img_hash)
+    return index
+
+def find_near_duplicate(user_id, phash, threshold=PHASH_THRESHOLD):
+    # 退化的指纹 (大片平滑天空) 说明不了两张图是同一张，直接当作不重复
+    if not phash_is_informative(phash): return None
+    # 删除记录不会从树里摘掉节点，命中后再回库确认一次
+    for dist, img_hash in get_phash_index(user_id).search(phash, threshold):
+        record = get_record_by_hash(user_id, img_hash)
+        if record: return img_hash, record, dist
+    return None
+
+
+def save_thumbnail(image_hash, image_bytes, size_key="square"):
+    make = make_square_thumbnail if size_key == "square" else make_preview
+    thumb = make(image_bytes, THUMB_SIZES[size_key])
+    if thumb is None: return None
+    thumb_bytes = encode_thumbnail(thumb)
+    with db_conn() as conn:
+        conn.execute('INSERT OR REPLACE INTO thumbnails (image_hash, size, thumb_data) VALUES (?, ?, ?)', (image_hash, size_key, thumb_bytes))
+    return thumb_bytes
+
+def get_thumbnail(image_hash, size_key="square"):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT thumb_data FROM thumbnails WHERE image_hash = ? AND size = ?', (image_hash, size_key))
+        row = c.fetchone()
+    if row: return row[0]
+    # 旧数据第一次被看到时才去读原图补生成
+    image_bytes = get_image_by_hash(image_hash)
+    if image_bytes is None: return None
+    return save_thumbnail(image_hash, image_bytes, size_key)
+
+def backfill_thumbnails(size_key="square"):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT image_hash FROM history WHERE image_hash NOT IN (SELECT image_hash FROM thumbnails WHERE size = ?)', (size_key,))
+        missing = [row[0] for row in c.fetchall()]
+    created = 0
+    for img_hash in missing:
+        image_bytes = get_image_by_hash(img_hash)
+        if image_bytes and save_thumbnail(img_hash, image_bytes, size_key): created += 1
+    return created
+
+# 备份：按需生成 tar.gz (数据库快照 + 对应原图)，不在每次渲染时读整个库
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 3
+# 原图本身是 JPEG，再压也省不了多少，低压缩级别主要给数据库文件省空间
+BACKUP_COMPRESSLEVEL = 3
+
+def get_last_backup(user_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT value FROM app_meta WHERE key = ?", (f"last_backup:{user_id}",))
+        row = c.fetchone()
+        if row is None: return None
+        last_backup = json.loads(row[0])
+        c.execute('SELECT COUNT(*) FROM history WHERE user_id = ? AND id > ?', (user_id, last_backup["id"]))
+        last_backup["new_records"] = c.fetchone()[0]
+    return last_backup
+
+def snapshot_db(dest_path, user_id, since_id=0):
+    """生成该用户档案的一致快照文件；since_id > 0 时只包含 id 更大的档案 (增量)。"""
+    # 用同样的表结构建空库，再从主库挑出这个用户的档案；整个拷贝在一个事务里，读到的是同一时刻的数据
+    dest = sqlite3.connect(dest_path)
+    try:
+        init_db(dest)
+        migrate_db(dest)
+        cols = ", ".join(row[1] for row in dest.execute('PRAGMA table_info(history)'))
+        dest.execute('ATTACH DATABASE ? AS src', (os.path.abspath(DB_PATH),))
+        with dest:
+            dest.execute(f'INSERT INTO history ({cols}) SELECT {cols} FROM src.history WHERE user_id = ? AND id > ?', (user_id, since_id))
+            dest.execute('INSERT INTO thumbnails SELECT * FROM src.thumbnails WHERE image_hash IN (SELECT image_hash FROM main.history)')
+        dest.execute('DETACH DATABASE src')
+    finally: dest.close()
+
+def export_backup(user_id, incremental=False):
+    last_backup = get_last_backup(user_id)
+    since_id = last_backup["id"] if incremental and last_backup else 0
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    # 文件名带用户 id 的摘要，清理旧备份时只动自己的
+    prefix = f"clouds_backup_{hashlib.md5(user_id.encode('utf-8')).hexdigest()[:10]}_"
+    name = f"{prefix}{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'_inc' if since_id else ''}"
+    db_path = os.path.join(BACKUP_DIR, f"{name}.db")
+    archive_path = os.path.join(BACKUP_DIR, f"{name}.tar.gz")
+    snapshot_db(db_path, user_id, since_id)
+    try:
+        snap = sqlite3.connect(db_path)
+        try:
+            max_id = snap.execute('SELECT MAX(id) FROM history').fetchone()[0] or since_id
+            hashes = [row[0] for row in snap.execute('SELECT DISTINCT image_hash FROM history')]
+        finally: snap.close()
+        # 边读边写进压缩流，内存里同时只有一张照片
+        store = get_image_store()
+        with tarfile.open(f"{archive_path}.tmp", "w:gz", compresslevel=BACKUP_COMPRESSLEVEL) as tar:
+            tar.add(db_path, arcname=os.path.basename(DB_PATH))
+            for img_hash in hashes:
+                image_bytes = store.get(img_hash)
+                if image_bytes is None: continue
+                info = tarfile.TarInfo(f"{IMAGE_STORE_DIR}/{img_hash}")
+                info.size, info.mtime = len(image_bytes), time.time()
+                tar.addfile(info, io.BytesIO(image_bytes))
+        os.replace(f"{archive_path}.tmp", archive_path)
+    finally:
+        os.remove(db_path)
+    with db_conn() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)",
+                     (f"last_backup:{user_id}", json.dumps({"id": max_id, "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M")})))
+    # 页面下载完就删掉压缩包；这里兜底清理中途失败留下的，每个用户最多留几份
+    archives = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith(prefix) and f.endswith(".tar.gz"))
+    for old in archives[:-BACKUP_KEEP]: os.remove(os.path.join(BACKUP_DIR, old))
+    return archive_path
+
+# 合并后每个物种只有最早的一条拿首发分，其余记 0 分；首发那条取该物种合并后的最高分
+RECONCILE_FIRST_SQL = '''
+    SELECT id, new_score FROM (
+        SELECT id, score,
+               CASE WHEN ROW_NUMBER() OVER (PARTITION BY cloud_name ORDER BY timestamp, id) = 1
+                    THEN MAX(score) OVER (PARTITION BY cloud_name) ELSE 0 END AS new_score
+        FROM history WHERE user_id = :user_id AND cloud_name IN (SELECT DISTINCT cloud_name FROM src.history)
+    ) WHERE score != new_score
+'''
+
+def merge_attached_db(conn, user_id):
+    """把 ATTACH 为 src 的库合并进该用户的档案，全部在 SQL 里完成，行数据不经过 Python。"""
+    c = conn.cursor()
+    engine = get_achievement_engine()
+    c.execute('SELECT cloud_name FROM species_stats WHERE user_id = ?', (user_id,))
+    old_mask = engine.mask_for(row[0] for row in c.fetchall())
+    c.execute('SELECT COALESCE(MAX(id), 0) FROM history')
+    max_id_before = c.fetchone()[0]
+    src_cols = {row[1] for row in c.execute('PRAGMA src.table_info(history)')}
+    cols = ", ".join(row[1] for row in c.execute('PRAGMA main.table_info(history)').fetchall()
+                     if row[1] in src_cols and row[1] not in ("id", "image_data", "user_id"))
+    c.execute('SELECT COUNT(*) FROM src.history')
+    report = {"source": c.fetchone()[0]}
+    # 备份里的档案都归到当前用户；同一用户内 image_hash 唯一，已有的照片直接忽略；按原始时间顺序插入
+    c.execute(f'INSERT OR IGNORE INTO history (user_id, {cols}) SELECT ?, {cols} FROM src.history ORDER BY timestamp, id', (user_id,))
+    report["inserted"] = c.rowcount
+    report["duplicates"] = report["source"] - report["inserted"]
+    c.execute('INSERT OR IGNORE INTO thumbnails SELECT * FROM src.thumbnails WHERE image_hash IN (SELECT image_hash FROM src.history)')
+    c.execute(RECONCILE_FIRST_SQL, {"user_id": user_id})
+    diff = c.fetchall()
+    if diff and sqlite3.sqlite_version_info >= (3, 33, 0):
+        c.execute(f'UPDATE history SET score = d.new_score FROM ({RECONCILE_FIRST_SQL}) AS d WHERE history.id = d.id', {"user_id": user_id})
+    elif diff:
+        c.executemany('UPDATE history SET score = ? WHERE id = ?', [(new_score, r_id) for r_id, new_score in diff])
+    report["rescored"] = len(diff)
+    c.execute('SELECT cloud_name FROM species_stats WHERE user_id = ?', (user_id,))
+    newly = engine.newly_unlocked(old_mask, engine.mask_for(row[0] for row in c.fetchall()))
+    c.executemany('INSERT OR IGNORE INTO achievement_unlocks (user_id, name) VALUES (?, ?)', [(user_id, name) for name in newly])
+    c.execute('SELECT phash, image_hash FROM history WHERE user_id = ? AND id > ? AND phash IS NOT NULL', (user_id, max_id_before))
+    report["new_phashes"] = c.fetchall()
+    return report
+
+def import_backup(user_id, fileobj, file_name):
+    """导入 export_backup 生成的 tar.gz 或单独的 .db，按 image_hash 去重合并进该用户的档案。"""
+    work_dir = tempfile.mkdtemp(prefix="import_", dir=os.path.dirname(os.path.abspath(DB_PATH)))
+    src_path = os.path.join(work_dir, "source.db")
+    # 原图先放进临时目录，校验、合并都通过后才写进仓库；导入失败时整个临时目录一起删掉，仓库里不留孤儿文件
+    staging = FileImageStore(os.path.join(work_dir, "images"))
+    phash_index = get_phash_index(user_id)
+    try:
+        if file_name.endswith(".db"):
+            with open(src_path, "wb") as fp: shutil.copyfileobj(fileobj, fp)
+        else:
+            # 流式读取：数据库落到临时文件，原图边读边落到临时目录
+            with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+                for member in tar:
+                    if not member.isfile(): continue
+                    if member.name == os.path.basename(DB_PATH):
+                        with open(src_path, "wb") as fp: shutil.copyfileobj(tar.extractfile(member), fp)
+                    elif member.name.startswith(f"{IMAGE_STORE_DIR}/"):
+                        # 文件名就是内容的 md5，对不上的不收，免得占住别人同名图片的位置
+                        data = tar.extractfile(member).read()
+                        image_hash = os.path.basename(member.name)
+                        if hashlib.md5(data).hexdigest() != image_hash: continue
+                        staging.put(image_hash, data)
+        if not os.path.exists(src_path): raise ValueError("🚫 备份里没有找到数据库文件。")
+        # 老版本的备份先升级到当前结构
+        src = sqlite3.connect(src_path)
+        try:
+            init_db(src)
+            # v2 之前的备份原图还在库里，先搬进临时目录，迁移到 v2 时就没有可搬的了
+            if src.execute('PRAGMA user_version').fetchone()[0] < 2: move_blobs_to_image_store(src, staging)
+            migrate_db(src)
+            src.commit()
+        except sqlite3.DatabaseError:
+            raise ValueError("🚫 无法读取此备份文件。")
+        finally: src.close()
+        with db_conn() as conn:
+            conn.execute('ATTACH DATABASE ? AS src', (src_path,))
+            try:
+                # 库里已有的 hash 原图一定在仓库里，剩下的必须由备份带过来，缺图的记录会让图鉴和分享卡片打不开
+                c = conn.execute('SELECT DISTINCT image_hash FROM src.history')
+                src_hashes = [row[0] for row in c.fetchall()]
+                staged = [h for h in src_hashes if os.path.exists(staging.path_for(h))]
+                c = conn.execute('SELECT DISTINCT image_hash FROM src.history WHERE image_hash NOT IN (SELECT image_hash FROM main.history)')
+                missing = [row[0] for row in c.fetchall() if not os.path.exists(staging.path_for(row[0]))]
+                if missing: raise ValueError(f"🚫 备份里缺少 {len(missing)} 张原图，没有导入。请使用包含照片的 .tar.gz 备份。")
+                report = merge_attached_db(conn, user_id)
+                # 先落盘再提交：提交后的每一行原图都已经在仓库里
+                store = get_image_store()
+                for image_hash in staged: store.put(image_hash, staging.get(image_hash))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute('DETACH DATABASE src')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for phash, img_hash in report.pop("new_phashes"): phash_index.add(phash_from_db(phash), img_hash)
+    report["images"] = len(staged)
+    return report
@@ -0,0 +1,125 @@
+"""图片处理：解码校验、送模型前的缩图、感知哈希、缩略图和本地天空预筛。
+
+PIL 和 numpy 在第一次真正处理图片时才导入，只查库、不看图的页面和命令不用付这份启动开销。
+"""
+import io
+
+from cloud_hunter.metrics import span
+
+# 送给模型前先缩图：长边上限和重新编码的 JPEG 质量
+MODEL_MAX_EDGE = 1536
+MODEL_JPEG_QUALITY = 85
+
+# 感知哈希 (dHash)：9x8 灰度图相邻像素比较得到 64 位指纹，重新压缩/轻微裁剪后汉明距离依然很小
+def compute_phash(image_bytes):
+    import numpy as np
+    from PIL import Image, ImageOps
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("L", (64, 64))
+    img = ImageOps.exif_transpose(img).convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    px = np.asarray(img, dtype=np.int16)
+    bits = np.packbits(px[:, 1:] > px[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+# 平滑的天空相邻像素几乎一样亮，指纹退化成全 0/全 1 附近，两片不同的晴空也会"高度相似"；少数位不到这么多就不拿来查重
+PHASH_MIN_BITS = 12
+
+def phash_is_informative(phash):
+    return PHASH_MIN_BITS <= phash.bit_count() <= 64 - PHASH_MIN_BITS
+
+# square 裁成正方形给图鉴网格；preview 只等比缩小，给藏品详情里的历史记录
+THUMB_SIZES = {"square": (300, 300), "preview": (960, 960)}
+
+def make_square_thumbnail(image_bytes, size=(300, 300)):
+    from PIL import Image, ImageOps
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+        return img
+    except:
+        return None
+
+def make_preview(image_bytes, size=(960, 960)):
+    from PIL import Image, ImageOps
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.format == "JPEG": img.draft("RGB", size)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        return img
+    except Exception:
+        return None
+
+def encode_thumbnail(img):
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=85, optimize=True)
+    return buf.getvalue()
+
+def validate_image(image_bytes):
+    if len(image_bytes) < 100:
+        raise ValueError("🚫 上传失败：图片数据为空 (0KB)。")
+    from PIL import Image
+    try:
+        with span("decode"): Image.open(io.BytesIO(image_bytes))
+    except Exception:
+        raise ValueError("🚫 无法读取此图片格式。请尝试截图后上传。")
+
+def preprocess_for_model(image_bytes, max_edge=MODEL_MAX_EDGE, quality=MODEL_JPEG_QUALITY):
+    from PIL import Image, ImageOps
+    img = Image.open(io.BytesIO(image_bytes))
+    src_format, src_size = img.format, img.size
+    orientation = img.getexif().get(0x0112, 1)
+    # 本身就是尺寸合规、方向正常的 JPEG 时原样发送，避免二次压缩
+    if src_format == "JPEG" and max(src_size) <= max_edge and orientation == 1: return image_bytes
+    # JPEG 在解码阶段直接按 1/2、1/4、1/8 缩小，省掉整张大图的解码
+    if src_format == "JPEG": img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+# 本地天空预筛：送模型之前用一张 64x64 的小图花几毫秒打个分，猫、室内、截图这类明显不是天空的直接拦下
+SKY_FILTER_THRESHOLD = 0.35  # 得分低于它的不送模型；调成 0 关闭预筛
+SKY_FILTER_SIZE = 64
+
+def sky_features(image_bytes, size=SKY_FILTER_SIZE):
+    import numpy as np
+    from PIL import Image, ImageOps
+    img = Image.open(io.BytesIO(image_bytes))
+    img_format, exif = img.format, img.getexif()
+    if img_format == "JPEG": img.draft("RGB", (size * 4, size * 4))
+    img = ImageOps.exif_transpose(img).convert("RGB").resize((size, size), Image.Resampling.BILINEAR)
+    rgb = np.asarray(img)
+    px = rgb.astype(np.float32) / 255.0
+    r, g, b = px[..., 0], px[..., 1], px[..., 2]
+    v = px.max(axis=2)
+    s = (v - px.min(axis=2)) / np.maximum(v, 1e-6)
+    lum = 0.299 * r + 0.587 * g + 0.114 * b
+    band = size * 2 // 5
+    # 边缘密度：相邻像素亮度差超过阈值的比例；天空大片平滑，室内和截图边缘多
+    edges = np.zeros(lum.shape, dtype=bool)
+    edges[:-1, :-1] = (np.abs(np.diff(lum, axis=1))[:-1] > 0.08) | (np.abs(np.diff(lum, axis=0))[:, :-1] > 0.08)
+    # 上部 40% 里平滑的天空色：偏蓝、灰白，或者朝霞晚霞那种明亮的暖色
+    sky = ((b > r) & (b >= g * 0.9) & (v > 0.3)) | ((s < 0.18) & (v > 0.35)) | ((r > b) & (v > 0.6) & (s < 0.6))
+    sky &= ~edges
+    # 颜色直方图：截图/纯色背景有大片完全相同的颜色，照片即使缩小了也是渐变
+    packed = (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2]
+    flat = np.unique(packed, return_counts=True)[1].max() / packed.size
+    # 亮度直方图：大半画面过暗 (夜景/室内弱光) 时颜色特征不可靠
+    dark = np.histogram(lum, bins=4, range=(0, 1))[0][0] / lum.size
+    return {"sky_top": float(sky[:band].mean()), "edges": float(edges.mean()), "flat": float(flat),
+            "top_brighter": float(lum[:band].mean() - lum[-band:].mean()), "dark": float(dark),
+            "screenshot_format": img_format == "PNG" and not exif}
+
+def sky_score(image_bytes):
+    """0~1，越高越像天空照片；解不开的图返回 None，交给后面的校验和模型处理。"""
+    try: f = sky_features(image_bytes)
+    except Exception: return None
+    smooth = max(0.0, 1 - f["edges"] / 0.2)
+    # 暗图不看颜色，只看平滑程度，夜空和红色精灵不会被误拦
+    color = smooth if f["dark"] > 0.6 else f["sky_top"]
+    score = 0.45 * color + 0.3 * smooth + 0.15 * min(1.0, max(0.0, 0.5 + f["top_brighter"] * 2.5)) + 0.1 * (1 - f["flat"])
+    # 大片完全相同的颜色再加上文字边缘或无 EXIF 的 PNG，多半是截图；阴天的灰幕只有前者
+    if f["flat"] > 0.3 and (f["edges"] > 0.01 or f["screenshot_format"]): score *= 0.4
+    return round(score, 3)
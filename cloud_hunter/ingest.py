@@ -0,0 +1,350 @@
+"""命令行批量导入：把一个照片目录或压缩包 (zip / tar / tar.gz) 鉴定后收进档案，不用打开浏览器。
+
+    python -m cloud_hunter.ingest ~/Pictures/sky --user me@example.com --rate 2 --workers 4
+
+在 app.py 所在目录 (clouds.db 和 cloud_images/ 所在处) 运行，或者用 --data-dir 指过去；
+API Key 取环境变量 ZHIPU_API_KEY，没有时读 .streamlit/secrets.toml。
+
+各阶段之间用有界队列连接，内存里同时只有几十张照片：
+读取 → 解码校验 + md5 查重 + 天空预筛 → 缩图 → 并发限速调用模型 + 计分 → 批量写库。
+处理完的文件记在检查点文件里 (写库提交之后才记)，中断后用同样的命令重跑会跳过它们；
+调用失败的不记，下次重跑时重试。
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+import traceback
+import zipfile
+
+from cloud_hunter.db import DEFAULT_USER, get_db_pool, get_image_store, get_record_by_hash, save_batch
+from cloud_hunter.images import (
+    SKY_FILTER_THRESHOLD, THUMB_SIZES, compute_phash, encode_thumbnail, make_square_thumbnail, preprocess_for_model,
+    sky_score, validate_image,
+)
+from cloud_hunter.metrics import get_metrics
+from cloud_hunter.model import (
+    MODEL_BREAKER_COOLDOWN, ModelUnavailableError, classify_image, get_model_client, get_response_cache,
+    score_classification,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".gif"}
+# 写进检查点的结果；error (调用失败等) 不记，重跑时重试
+FINAL_STATUSES = ("saved", "duplicate", "not_cloud", "not_sky", "invalid")
+_DONE = object()
+# 模型熔断持续超过这么多秒就不再等：剩下的照片直接记失败 (不进检查点，下次重跑时重试)
+INGEST_MAX_OUTAGE = 15 * 60
+
+
+def iter_photos(source):
+    """按稳定的顺序逐个产出 (相对路径, 文件内容)；压缩包边解边读，不落盘。"""
+    def wanted(name): return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if not wanted(name): continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as fp: yield os.path.relpath(path, source), fp.read()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                if not info.is_dir() and wanted(info.filename): yield info.filename, zf.read(info)
+    else:
+        with tarfile.open(source, mode="r|*") as tar:
+            for member in tar:
+                if member.isfile() and wanted(member.name): yield member.name, tar.extractfile(member).read()
+
+
+class Checkpoint:
+    """追加写的检查点文件，每行 "状态<TAB>相对路径"；打开时读出已完成的集合。"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fp:
+                for line in fp:
+                    _, _, key = line.rstrip("\n").partition("\t")
+                    if key: self.done.add(key)
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def mark(self, items):
+        for key, status in items: self._fp.write(f"{status}\t{key}\n")
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def close(self):
+        self._fp.close()
+
+
+class RateLimiter:
+    """令牌桶：平均每秒最多 rate 次，最多攒 burst 次突发；rate <= 0 时不限速。"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class Photo:
+    __slots__ = ("key", "data", "md5", "phash", "model_bytes", "record", "status", "detail")
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.md5 = self.phash = self.model_bytes = self.record = self.status = self.detail = None
+
+    def finish(self, status, detail=None):
+        # 不再往下传的照片尽早放掉原图
+        self.status, self.detail = status, detail
+        self.data = self.model_bytes = None
+        return self
+
+
+class IngestPipeline:
+    """读取线程 → 若干阶段线程池 → 写库线程；阶段之间是有界队列，下游慢时上游自然阻塞。"""
+
+    def __init__(self, user_id, checkpoint, cpu_workers=2, model_workers=4, rate=2.0, batch_size=50,
+                 queue_size=16, sky_threshold=SKY_FILTER_THRESHOLD, progress_every=10.0, max_outage=INGEST_MAX_OUTAGE,
+                 log=sys.stderr):
+        self.user_id = user_id
+        self.checkpoint = checkpoint
+        self.cpu_workers = cpu_workers
+        self.model_workers = model_workers
+        self.limiter = RateLimiter(rate, burst=model_workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.sky_threshold = sky_threshold
+        self.progress_every = progress_every
+        self.max_outage = max_outage
+        self._outage_since = None  # 熔断从什么时候开始一直没恢复
+        self.log = log
+        self.results = queue.Queue(maxsize=queue_size * 4)
+        self.counts = {"read": 0, "skipped": 0, **{status: 0 for status in FINAL_STATUSES}, "error": 0}
+        self.errors = []
+        self.fatal = []  # 读取/写库线程本身崩掉时的异常，这种情况整次导入算失败
+        self._queues = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    # ---------- 各阶段：返回同一个 Photo，status 为空表示继续往下传 ----------
+    def decode(self, photo):
+        photo.md5 = hashlib.md5(photo.data).hexdigest()
+        with self._lock:
+            # 同一次导入里重复的文件只处理第一份
+            if photo.md5 in self._in_flight: return photo.finish("duplicate")
+            self._in_flight.add(photo.md5)
+        if get_record_by_hash(self.user_id, photo.md5): return photo.finish("duplicate")
+        try: validate_image(photo.data)
+        except ValueError as e: return photo.finish("invalid", str(e))
+        if self.sky_threshold:
+            score = sky_score(photo.data)
+            if score is not None and score < self.sky_threshold: return photo.finish("not_sky", f"sky_score={score}")
+        return photo
+
+    def preprocess(self, photo):
+        photo.model_bytes = preprocess_for_model(photo.data)
+        photo.phash = compute_phash(photo.data)
+        return photo
+
+    def classify(self, photo):
+        while True:
+            self.limiter.acquire()
+            try:
+                # 上一阶段已经缩过图，直接发送；缓存键用原图的 md5，和页面上传的同一张图共用模型回复缓存
+                result = classify_image(photo.model_bytes, photo.md5, preprocess=False)
+                break
+            except ModelUnavailableError:
+                # 熔断中：短时故障等服务恢复，而不是把剩下的照片全记成失败；一直不恢复就放弃
+                with self._lock:
+                    if self._outage_since is None: self._outage_since = time.monotonic()
+                    waited = time.monotonic() - self._outage_since
+                if waited >= self.max_outage: raise
+                time.sleep(min(MODEL_BREAKER_COOLDOWN, self.max_outage - waited))
+        with self._lock: self._outage_since = None
+        if not result.get("is_cloud", False): return photo.finish("not_cloud")
+        c_name, tier, score, c_sci, c_wea = score_classification(result)
+        # 先落盘再写行：行存在时原图一定已经在仓库里
+        get_image_store().put(photo.md5, photo.data)
+        thumb = make_square_thumbnail(photo.data, THUMB_SIZES["square"])
+        photo.record = (c_name, tier, score, c_sci, c_wea, photo.md5, photo.phash, encode_thumbnail(thumb) if thumb else None)
+        photo.data = photo.model_bytes = None
+        return photo
+
+    # ---------- 线程编排 ----------
+    def _stage(self, name, fn, inbox, outbox, workers):
+        remaining = [workers]
+        metrics = get_metrics()
+
+        def work():
+            while True:
+                photo = inbox.get()
+                if photo is _DONE:
+                    # 放回去让同阶段的其他线程也能退出，最后一个线程再通知下游
+                    inbox.put(_DONE)
+                    with self._lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last: outbox.put(_DONE)
+                    return
+                try:
+                    with metrics.span(f"ingest_{name}"): photo = fn(photo)
+                except Exception as e:
+                    photo.finish("error", f"{name}: {type(e).__name__}: {e}")
+                (self.results if photo.status else outbox).put(photo)
+
+        return [threading.Thread(target=work, name=f"ingest-{name}-{i}", daemon=True) for i in range(workers)]
+
+    def _fail(self, name, e):
+        print(f"{name} 线程异常退出：\n{traceback.format_exc()}", file=self.log, flush=True)
+        with self._lock: self.fatal.append(f"{name}: {type(e).__name__}: {e}")
+
+    def _read(self, source, outbox):
+        try:
+            for key, data in iter_photos(source):
+                if key in self.checkpoint.done:
+                    with self._lock: self.counts["skipped"] += 1
+                    continue
+                with self._lock: self.counts["read"] += 1
+                outbox.put(Photo(key, data))
+        except Exception as e:
+            # 压缩包损坏、目录读不了之类：已经读出来的照片照常处理完，最后整次导入报失败
+            self._fail("read", e)
+        finally:
+            outbox.put(_DONE)
+
+    def _flush(self, batch, finished):
+        if batch:
+            with get_metrics().span("ingest_save_batch"):
+                saved = save_batch(self.user_id, [photo.record for photo in batch])
+            for photo in batch: photo.finish("saved" if photo.md5 in saved else "duplicate")
+            finished.extend(batch)
+        marks = [(photo.key, photo.status) for photo in finished if photo.status in FINAL_STATUSES]
+        if marks: self.checkpoint.mark(marks)
+        with self._lock:
+            for photo in finished:
+                self.counts[photo.status] += 1
+                if photo.status == "error" and len(self.errors) < 20: self.errors.append((photo.key, photo.detail))
+                self._in_flight.discard(photo.md5)
+
+    def _write(self):
+        try: self._write_loop()
+        except Exception as e:
+            # 写库失败时没提交的照片不记检查点，下次重跑会重新处理
+            self._fail("write", e)
+
+    def _write_loop(self):
+        # 唯一的写库线程：攒满一批或者隔一会儿就提交一次，提交后才记检查点
+        batch, finished, last_flush = [], [], time.monotonic()
+        while True:
+            try: photo = self.results.get(timeout=1.0)
+            except queue.Empty: photo = None
+            if photo is _DONE: break
+            if photo is not None:
+                if photo.status is None: batch.append(photo)
+                else: finished.append(photo)
+            if len(batch) >= self.batch_size or (time.monotonic() - last_flush > 5 and (batch or finished)):
+                self._flush(batch, finished)
+                batch, finished, last_flush = [], [], time.monotonic()
+        self._flush(batch, finished)
+
+    def progress_line(self, elapsed):
+        with self._lock: counts = dict(self.counts)
+        done = sum(counts[s] for s in FINAL_STATUSES) + counts["error"]
+        depth = " ".join(f"{name}={q.qsize()}" for name, q in self._queues.items())
+        return (f"[{elapsed:7.1f}s] 读取 {counts['read']} · 完成 {done} ({done / max(elapsed, 1e-9):.2f} 张/秒) · "
+                f"入档 {counts['saved']} · 重复 {counts['duplicate']} · 非云 {counts['not_cloud']} · "
+                f"预筛 {counts['not_sky']} · 无效 {counts['invalid']} · 失败 {counts['error']} · 队列 {depth}")
+
+    def run(self, source):
+        t0 = time.perf_counter()
+        q_decode, q_preprocess, q_model = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+        self._queues = {"decode": q_decode, "preprocess": q_preprocess, "model": q_model, "write": self.results}
+        threads = [threading.Thread(target=self._read, args=(source, q_decode), name="ingest-read", daemon=True)]
+        threads += self._stage("decode", self.decode, q_decode, q_preprocess, self.cpu_workers)
+        threads += self._stage("preprocess", self.preprocess, q_preprocess, q_model, self.cpu_workers)
+        threads += self._stage("classify", self.classify, q_model, self.results, self.model_workers)
+        writer = threading.Thread(target=self._write, name="ingest-write", daemon=True)
+        for t in threads + [writer]: t.start()
+        while writer.is_alive():
+            writer.join(self.progress_every)
+            if writer.is_alive(): print(self.progress_line(time.perf_counter() - t0), file=self.log, flush=True)
+        elapsed = time.perf_counter() - t0
+        print(self.progress_line(elapsed), file=self.log, flush=True)
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        done = sum(self.counts[s] for s in FINAL_STATUSES) + self.counts["error"]
+        stages = {stage: row for stage, row in get_metrics().summary().items()
+                  if stage.startswith("ingest_") or stage in ("model_call", "sky_filter", "decode")}
+        return {
+            "user": self.user_id,
+            "elapsed_s": round(elapsed, 1),
+            "photos_per_s": round(done / elapsed, 2) if elapsed else None,
+            "counts": self.counts,
+            "stages": stages,
+            "model_client": get_model_client().stats(),
+            "response_cache": get_response_cache().stats(),
+            "errors": self.errors,
+            "fatal": self.fatal,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量鉴定照片目录或压缩包并收进档案")
+    parser.add_argument("source", help="照片目录，或 .zip / .tar / .tar.gz 压缩包")
+    parser.add_argument("--user", default=DEFAULT_USER, help="导入到哪个用户的档案")
+    parser.add_argument("--data-dir", default=".", help="clouds.db 和 cloud_images/ 所在目录 (即 app.py 的运行目录)")
+    parser.add_argument("--checkpoint", help="检查点文件，默认按来源路径放在数据目录下")
+    parser.add_argument("--workers", type=int, default=4, help="同时调用模型的线程数")
+    parser.add_argument("--cpu-workers", type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)), help="解码/缩图各用几个线程")
+    parser.add_argument("--rate", type=float, default=2.0, help="每秒最多调用模型几次，0 为不限")
+    parser.add_argument("--batch-size", type=int, default=50, help="每个写库事务的记录数")
+    parser.add_argument("--queue-size", type=int, default=16, help="阶段之间每个队列的容量")
+    parser.add_argument("--sky-threshold", type=float, default=SKY_FILTER_THRESHOLD, help="本地天空预筛阈值，0 为关闭")
+    parser.add_argument("--progress", type=float, default=10.0, help="每隔几秒打印一次进度")
+    parser.add_argument("--max-outage", type=float, default=INGEST_MAX_OUTAGE, help="模型熔断持续多少秒后放弃，剩下的照片记失败")
+    args = parser.parse_args(argv)
+
+    # 相对路径按启动时的目录解析，再切到数据目录
+    source = os.path.abspath(args.source)
+    checkpoint_path = args.checkpoint and os.path.abspath(args.checkpoint)
+    os.chdir(args.data_dir)
+    checkpoint_path = checkpoint_path or f"ingest_{hashlib.md5(f'{args.user}:{source}'.encode('utf-8')).hexdigest()[:10]}.checkpoint"
+    get_db_pool()
+    checkpoint = Checkpoint(checkpoint_path)
+    print(f"导入 {source} → 用户 {args.user}；检查点 {checkpoint_path} (已完成 {len(checkpoint.done)} 个)", file=sys.stderr)
+    pipeline = IngestPipeline(args.user, checkpoint, cpu_workers=args.cpu_workers, model_workers=args.workers, rate=args.rate,
+                              batch_size=args.batch_size, queue_size=args.queue_size, sky_threshold=args.sky_threshold,
+                              progress_every=args.progress, max_outage=args.max_outage)
+    try:
+        report = pipeline.run(source)
+    finally:
+        checkpoint.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["counts"]["error"] == 0 and not report["fatal"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""后台鉴定任务：持久化在 jobs 表里的队列和执行它的线程池，页面只负责提交和轮询。"""
+from concurrent.futures import ThreadPoolExecutor
+
+from cloud_hunter.db import db_conn, find_near_duplicate, get_image_by_hash, get_image_store, get_record_by_hash, save_to_db
+from cloud_hunter.images import SKY_FILTER_THRESHOLD, compute_phash, sky_score, validate_image
+from cloud_hunter.metrics import get_metrics, span
+from cloud_hunter.model import classify_image, score_classification
+from cloud_hunter.resources import once
+
+# ==========================================
+# 🧵 后台任务队列
+# ==========================================
+
+def record_classification(user_id, result, image_bytes, md5_hash):
+    c_name, calculated_tier, official_score, c_sci, c_wea = score_classification(result)
+    with span("save_to_db"):
+        return save_to_db(user_id, c_name, calculated_tier, official_score, c_sci, c_wea, image_bytes, md5_hash, first_discovery=True)
+
+JOB_CONCURRENCY = 4
+JOB_ACTIVE = ("queued", "running")
+
+def enqueue_job(user_id, image_bytes, md5_hash, file_name, force=False):
+    # 任务里只记 hash，原图进仓库；同一用户的同一张图已在排队/解析时直接复用
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM jobs WHERE image_hash = ? AND user_id = ? AND status IN ('queued', 'running') ORDER BY id DESC LIMIT 1", (md5_hash, user_id))
+        row = c.fetchone()
+        if row: return row[0]
+        c.execute('INSERT INTO jobs (user_id, image_hash, file_name, force) VALUES (?, ?, ?, ?)', (user_id, md5_hash, file_name, int(force)))
+        job_id = c.lastrowid
+        # 插入任务后还持有写锁时再存原图，和 finish_job 清理失败任务的原图互斥
+        get_image_store().put(md5_hash, image_bytes)
+    get_job_runner().submit(job_id)
+    return job_id
+
+def get_jobs(job_ids):
+    if not job_ids: return []
+    placeholders = ",".join("?" * len(job_ids))
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute(f'SELECT id, image_hash, file_name, status, error FROM jobs WHERE id IN ({placeholders}) ORDER BY id', list(job_ids))
+        return c.fetchall()
+
+def get_latest_job(user_id, md5_hash):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, image_hash, file_name, status, error FROM jobs WHERE image_hash = ? AND user_id = ? ORDER BY id DESC LIMIT 1', (md5_hash, user_id))
+        return c.fetchone()
+
+def finish_job(job_id, status, error=None):
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('UPDATE jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (status, error, job_id))
+        if status == "failed":
+            # 失败的任务不会入库：没有记录收藏、也没有别的任务在等这张图时删掉原图，不在仓库里留孤儿文件
+            c.execute('SELECT image_hash FROM jobs WHERE id = ?', (job_id,))
+            md5_hash = c.fetchone()[0]
+            c.execute("SELECT 1 FROM history WHERE image_hash = ? UNION ALL "
+                      "SELECT 1 FROM jobs WHERE image_hash = ? AND status IN ('queued', 'running') LIMIT 1", (md5_hash, md5_hash))
+            if c.fetchone() is None: get_image_store().delete(md5_hash)
+    get_job_previews().pop(job_id, None)
+
+@once
+def get_job_previews():
+    # 流式解析出的早期字段，按任务 id 暂存，进度片段每秒读一次
+    return {}
+
+def run_job(job_id):
+    with db_conn() as conn:
+        c = conn.cursor()
+        # 抢占式领取：只有 queued 的任务能被置为 running，重复提交的同一任务只会执行一次
+        c.execute("UPDATE jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'queued'", (job_id,))
+        if c.rowcount == 0: return
+        c.execute('SELECT user_id, image_hash, force FROM jobs WHERE id = ?', (job_id,))
+        user_id, md5_hash, force = c.fetchone()
+    metrics = get_metrics()
+    metrics.begin("job")
+    try:
+        with span("db_lookup"): existing = get_record_by_hash(user_id, md5_hash)
+        if existing is None:
+            image_bytes = get_image_by_hash(md5_hash)
+            if image_bytes is None: raise ValueError("🚫 原图已丢失，请重新上传。")
+            validate_image(image_bytes)
+            if not force:
+                with span("sky_filter"): sky = sky_score(image_bytes)
+                if sky is not None and sky < SKY_FILTER_THRESHOLD:
+                    raise ValueError(f"🌫️ 画面看起来不像天空（预筛得分 {sky:.2f}），未送卫星解析。")
+                # 调模型之前先查近似重复，裁剪/重新压缩过的同一张天空不再花一次调用
+                near_dup = find_near_duplicate(user_id, compute_phash(image_bytes))
+                if near_dup: raise ValueError(f"🔁 与档案中的「{near_dup[1][0]}」高度相似，已跳过。")
+            result = classify_image(image_bytes, md5_hash, on_fields=lambda fields: get_job_previews().__setitem__(job_id, fields))
+            if not result.get("is_cloud", False):
+                raise ValueError("🚫 鉴定失败：画面中未发现明显云彩结构。")
+            record_classification(user_id, result, image_bytes, md5_hash)
+        finish_job(job_id, "done")
+        metrics.end("done")
+    except ValueError as e:
+        finish_job(job_id, "failed", str(e))
+        metrics.end("failed")
+    except Exception as e:
+        finish_job(job_id, "failed", f"分析中断: {e}")
+        metrics.end("error")
+
+class JobRunner:
+    """后台鉴定线程池，并发数受 max_workers 限制；页面只负责提交和轮询 jobs 表。"""
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cloud-job")
+
+    def submit(self, job_id):
+        self._executor.submit(run_job, job_id)
+
+@once
+def get_job_runner():
+    runner = JobRunner(JOB_CONCURRENCY)
+    # 上次进程退出时没跑完的任务重新排队
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        c.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")
+        pending = [row[0] for row in c.fetchall()]
+    for job_id in pending: runner.submit(job_id)
+    return runner
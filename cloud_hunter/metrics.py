@@ -0,0 +1,117 @@
+"""分阶段计时：各处理阶段的耗时直方图，以及每次运行 (页面 rerun / 后台任务 / 批量导入) 的分段记录。"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from cloud_hunter.resources import once
+
+# ==========================================
+# ⏱️ 分阶段计时
+# ==========================================
+# 分阶段计时：调试面板保留最近多少次运行；导出路径留空则不导出
+METRICS_RECENT_RUNS = 50
+METRICS_JSONL_PATH = os.environ.get("CLOUD_HUNTER_METRICS_JSONL")  # 每次运行追加一行 JSON
+METRICS_PROM_PATH = os.environ.get("CLOUD_HUNTER_METRICS_PROM")  # Prometheus 文本格式，可交给 node_exporter 的 textfile collector
+METRICS_PENDING_SESSIONS = 256  # 最多记住多少个会话的进行中运行
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class StageMetrics:
+    """按阶段累计耗时直方图，并把每次运行(一次页面 rerun 或一个后台任务)的各段耗时串成一条记录。"""
+
+    def __init__(self, recent=METRICS_RECENT_RUNS, jsonl_path=None, prom_path=None):
+        self.recent = deque(maxlen=recent)
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self._hist = {}  # stage -> [各桶计数..., 总耗时, 次数]
+        self._local = threading.local()
+        self._pending = {}  # 会话 -> 还没 end() 的运行
+        self._lock = threading.Lock()
+
+    def begin(self, kind, session=None):
+        # Streamlit 每次 rerun 都换一个线程跑，被 st.rerun()/st.stop() 打断的那次走不到 end()；
+        # 传了 session 时按会话记住进行中的运行，同一会话下次 begin 时补记为 interrupted
+        if getattr(self._local, "run", None): self.end("interrupted")
+        if session is not None:
+            with self._lock: pending = self._pending.pop(session, None)
+            if pending: self._finish(pending, "interrupted")
+        run = {"kind": kind, "ts": time.time(), "t0": time.perf_counter(), "spans": []}
+        self._local.run, self._local.session = run, session
+        if session is not None:
+            with self._lock:
+                self._pending[session] = run
+                # 关掉页面的会话不会再 begin，只留最近这么多个
+                while len(self._pending) > METRICS_PENDING_SESSIONS: self._pending.pop(next(iter(self._pending)))
+
+    def end(self, status="ok"):
+        run = getattr(self._local, "run", None)
+        if run is None: return
+        self._local.run = None
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            with self._lock:
+                if self._pending.get(session) is run: del self._pending[session]
+        self._finish(run, status)
+
+    def _finish(self, run, status):
+        # 已经被同一会话的下一次 begin 补记过的不再重复记录
+        t0 = run.pop("t0", None)
+        if t0 is None: return
+        total = time.perf_counter() - t0
+        self.observe(f"{run['kind']}_total", total)
+        run.update(status=status, total_ms=round(total * 1000, 1))
+        with self._lock:
+            self.recent.append(run)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(run, ensure_ascii=False) + "\n")
+        if self.prom_path: self.write_prometheus(self.prom_path)
+
+    @contextmanager
+    def span(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.observe(stage, elapsed)
+            run = getattr(self._local, "run", None)
+            if run is not None: run["spans"].append([stage, round(elapsed * 1000, 1)])
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            h = self._hist.setdefault(stage, [0] * (len(METRIC_BUCKETS) + 2))
+            for i, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound: h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def summary(self):
+        with self._lock:
+            return {stage: {"count": h[-1], "avg_ms": round(h[-2] / h[-1] * 1000, 1)} for stage, h in sorted(self._hist.items())}
+
+    def prometheus_text(self):
+        lines = ["# HELP cloud_hunter_stage_seconds 各处理阶段耗时", "# TYPE cloud_hunter_stage_seconds histogram"]
+        with self._lock:
+            for stage, h in sorted(self._hist.items()):
+                for bound, n in zip(METRIC_BUCKETS, h):
+                    lines.append(f'cloud_hunter_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {n}')
+                lines.append(f'cloud_hunter_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h[-1]}')
+                lines.append(f'cloud_hunter_stage_seconds_sum{{stage="{stage}"}} {h[-2]:.6f}')
+                lines.append(f'cloud_hunter_stage_seconds_count{{stage="{stage}"}} {h[-1]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # 先写临时文件再替换，采集端不会读到写了一半的文件
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+@once
+def get_metrics():
+    return StageMetrics(METRICS_RECENT_RUNS, METRICS_JSONL_PATH, METRICS_PROM_PATH)
+
+def span(stage):
+    return get_metrics().span(stage)
@@ -0,0 +1,455 @@
+"""模型调用：带重试/对冲/熔断的智谱客户端、回复缓存、流式解析和鉴定结果计分。
+
+zhipuai 和 httpx 在第一次真正调用模型时才导入。
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from cloud_hunter.db import db_conn, get_image_by_hash
+from cloud_hunter.images import preprocess_for_model, sky_score
+from cloud_hunter.metrics import get_metrics, span
+from cloud_hunter.resources import once
+from cloud_hunter.scoring import calculate_tier_from_score, get_official_score
+
+# ==========================================
+# 🤖 核心配置：使用智谱视觉模型
+# ==========================================
+# 智谱目前性价比最高且免费额度可用的是 glm-4v-flash
+MODEL_NAME = "glm-4v-flash"
+# 流式接收模型输出：先拿到 is_cloud / cloud_name，非云图片提前断开
+MODEL_STREAM = True
+# 模型调用的容错：单次超时、可重试错误 (超时/断连/429/5xx) 的指数退避重试、熔断
+MODEL_TIMEOUT = 60.0
+MODEL_CONNECT_TIMEOUT = 5.0
+MODEL_MAX_RETRIES = 3
+MODEL_BACKOFF_BASE = 0.5  # 第 n 次重试前随机等待 0 ~ min(MAX, BASE * 2^n) 秒
+MODEL_BACKOFF_MAX = 8.0
+MODEL_HEDGE_AFTER = None  # 超过这么多秒还没回就再并发发一份，取先回来的；None 为关闭
+MODEL_BREAKER_FAILURES = 5  # 连续失败这么多次后熔断，冷却期内直接拒绝
+MODEL_BREAKER_COOLDOWN = 30.0
+MODEL_POOL_SIZE = 16  # 进程内共享的 keep-alive 连接数
+
+class ModelUnavailableError(ValueError):
+    """熔断期间被直接拒绝的调用；是 ValueError，任务里按用户可读的提示记录。"""
+
+class CircuitBreaker:
+    """连续失败 threshold 次后断开 cooldown 秒；冷却结束只放行一个试探请求，成功才恢复。"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None: return "closed"
+        return "half_open" if self._probing or time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None: return True
+            if self._probing or time.monotonic() - self.opened_at < self.cooldown: return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures, self.opened_at, self._probing = 0, None, False
+
+    def release(self):
+        # 试探请求碰到与服务健康无关的错误 (400 之类)：让出试探名额，不算成功也不算失败
+        with self._lock: self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                if not self._probing: self.trips += 1
+                self.opened_at, self._probing = time.monotonic(), False
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+def is_retryable_error(e):
+    # SDK 会把 httpx 的超时/断连包装成 APIConnectionError，HTTP 错误带 status_code
+    import httpx
+    from zhipuai import APIConnectionError
+    if isinstance(e, (httpx.TransportError, APIConnectionError)): return True
+    return getattr(e, "status_code", None) in RETRYABLE_STATUS
+
+def close_stream(result):
+    response = getattr(result, "response", None)
+    if response is not None: response.close()
+
+class ResilientModelClient:
+    """包在 ZhipuAI 客户端外层，调用方式不变 (chat.completions.create)。
+
+    可重试的错误按带抖动的指数退避重试；配置 hedge_after 后，慢请求会并发补发一份取先回来的；
+    连续失败触发熔断，冷却期内直接抛 ModelUnavailableError，不再排队等超时。
+    """
+
+    def __init__(self, client, max_retries=MODEL_MAX_RETRIES, backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX,
+                 hedge_after=MODEL_HEDGE_AFTER, breaker=None):
+        self.client = client
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker(MODEL_BREAKER_FAILURES, MODEL_BREAKER_COOLDOWN)
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "hedged": 0, "hedge_wins": 0}
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+        self._hedge_pool = ThreadPoolExecutor(max_workers=MODEL_POOL_SIZE, thread_name_prefix="model-hedge") if hedge_after else None
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock: self.counters[key] += 1
+
+    def stats(self):
+        with self._lock: return dict(self.counters, breaker=self.breaker.state, trips=self.breaker.trips)
+
+    def create(self, **kwargs):
+        return self._call(kwargs)
+
+    def consume_stream(self, consume, **kwargs):
+        """流式调用：consume(stream) 把流读完才算这次调用结束，读到一半断开同样按规则重试、计入熔断。"""
+        return self._call(kwargs, consume)
+
+    def _call(self, kwargs, consume=None):
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise ModelUnavailableError("🌩️ 模型服务暂时不可用，请稍后再试。")
+            try:
+                result = self._call_hedged(kwargs) if self.hedge_after else self.client.chat.completions.create(**kwargs)
+                if consume is not None: result = consume(result)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # 400/401 之类说明服务本身是通的，不算熔断失败，也不重试
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                if attempt == self.max_retries: raise
+                self._count("retries")
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _call_hedged(self, kwargs):
+        first = self._hedge_pool.submit(self.client.chat.completions.create, **kwargs)
+        if wait([first], timeout=self.hedge_after).done: return first.result()
+        self._count("hedged")
+        second = self._hedge_pool.submit(self.client.chat.completions.create, **kwargs)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    error = f.exception()
+                    continue
+                if f is second: self._count("hedge_wins")
+                # 输掉的那份回来后直接丢弃；流式响应要关掉连接
+                for other in pending: other.add_done_callback(lambda g: g.exception() is None and close_stream(g.result()))
+                return f.result()
+        raise error
+
+def get_api_key():
+    # 命令行和后台 worker 用环境变量；页面从 secrets 读，streamlit 也只在这时才导入
+    api_key = os.environ.get("ZHIPU_API_KEY")
+    if api_key: return api_key
+    import streamlit as st
+    return st.secrets["ZHIPU_API_KEY"]
+
+# 🔴 改动2：国内无需代理，注释掉
+# os.environ["HTTP_PROXY"] = "http://127.0.0.1:10809"
+# os.environ["HTTPS_PROXY"] = "http://127.0.0.1:10809"
+
+# 🔴 改动3：初始化智谱客户端 (从 secrets 获取 Key，命令行下也可以用环境变量)，整个进程共用，后台任务线程也用它
+@once
+def get_model_client():
+    # SDK 连带 pydantic 导入要几百毫秒，第一次调用模型时才付
+    import httpx
+    from zhipuai import ZhipuAI
+    # 所有会话共用一个 keep-alive 连接池；SDK 自带的重试关掉，统一由 ResilientModelClient 处理
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(MODEL_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=MODEL_POOL_SIZE, max_keepalive_connections=MODEL_POOL_SIZE, keepalive_expiry=60),
+    )
+    return ResilientModelClient(ZhipuAI(api_key=get_api_key(), http_client=http_client, max_retries=0))
+
+# ==========================================
+# 🧠 鉴定流程
+# ==========================================
+
+# 🔴 改动4：构造智谱专用 Prompt
+CLASSIFY_PROMPT = """
+                                任务：识别图片中的云彩。
+                                第一步：判断这张图片是否包含云彩或天空现象。
+                                - 如果是猫、狗、室内、黑屏、文字截图等非天空图片，返回 {"is_cloud": false}
+                                - 如果包含云，返回 {"is_cloud": true, ...}
+                                
+                                第二步：如果是云，请进行分类。
+                                请务必只返回纯净的 JSON 字符串，不要包含 ```json 或其他标记。
+                                格式如下：
+                                {
+                                    "is_cloud": true/false,
+                                    "cloud_name": "标准学术名称(中文，如：积云、高积云)", 
+                                    "score_suggestion": 估算分数(10-100),
+                                    "science_fact": "科普(30字内)",
+                                    "weather_tip": "预告(20字内)"
+                                }
+                                """
+
+# prompt 一改缓存自动失效
+PROMPT_VERSION = hashlib.md5(CLASSIFY_PROMPT.encode("utf-8")).hexdigest()[:8]
+RESPONSE_CACHE_TTL = 30 * 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+
+class ResponseCache:
+    """模型原始回复的持久缓存，键为 (image_hash, 模型, prompt 版本)。
+
+    过期按 TTL，超量按 last_used 做 LRU 淘汰；同一个键的并发请求只放一个去调用模型，
+    其余等它的结果 (single-flight)。
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def get(self, key):
+        now = time.time()
+        with db_conn() as conn:
+            c = conn.cursor()
+            c.execute('SELECT response FROM response_cache WHERE image_hash = ? AND model = ? AND prompt_version = ? AND created_at > ?', (*key, now - self.ttl))
+            row = c.fetchone()
+            if row: c.execute('UPDATE response_cache SET last_used = ?, hits = hits + 1 WHERE image_hash = ? AND model = ? AND prompt_version = ?', (now, *key))
+        return row[0] if row else None
+
+    def put(self, key, response):
+        now = time.time()
+        with db_conn() as conn:
+            c = conn.cursor()
+            c.execute('INSERT OR REPLACE INTO response_cache (image_hash, model, prompt_version, response, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)', (*key, response, now, now))
+            c.execute('DELETE FROM response_cache WHERE created_at <= ?', (now - self.ttl,))
+            c.execute('DELETE FROM response_cache WHERE rowid IN (SELECT rowid FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def invalidate(self, key):
+        with db_conn() as conn:
+            conn.execute('DELETE FROM response_cache WHERE image_hash = ? AND model = ? AND prompt_version = ?', key)
+
+    def get_or_call(self, key, fn):
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock: self.hits += 1
+            return cached
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        if not is_leader: return future.result()
+        try:
+            # 上一个 leader 可能刚在第一次 get 和登记之间写好缓存并退场，登记后再查一次
+            response = self.get(key)
+            if response is not None:
+                with self._lock: self.hits += 1
+                future.set_result(response)
+                return response
+            with self._lock: self.misses += 1
+            response = fn()
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock: del self._inflight[key]
+
+    def stats(self):
+        with db_conn() as conn:
+            entries = conn.execute('SELECT count(*) FROM response_cache').fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "entries": entries}
+
+@once
+def get_response_cache():
+    return ResponseCache()
+
+def evaluate_sky_filter(user_id, sample_size=200, thresholds=(0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5)):
+    # 用模型自己的结论当标准答案：回复缓存里的 is_cloud，加上档案里的记录 (入档的都是云)；只看这个用户上传过的图
+    verdicts = {}
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT image_hash, response FROM response_cache WHERE model = ? AND image_hash IN '
+                  '(SELECT image_hash FROM jobs WHERE user_id = ? UNION SELECT image_hash FROM history WHERE user_id = ?) '
+                  'ORDER BY last_used DESC LIMIT ?', (MODEL_NAME, user_id, user_id, sample_size))
+        for r_hash, raw in c.fetchall():
+            try: verdicts[r_hash] = bool(_parse_model_json(raw).get("is_cloud", False))
+            except ValueError: continue
+        c.execute('SELECT image_hash FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?', (user_id, sample_size))
+        for (r_hash,) in c.fetchall(): verdicts.setdefault(r_hash, True)
+    scored = []
+    for r_hash, is_cloud in verdicts.items():
+        image_bytes = get_image_by_hash(r_hash)
+        score = sky_score(image_bytes) if image_bytes else None
+        if score is not None: scored.append((score, is_cloud))
+    report = {"sampled": len(scored), "model_not_cloud": sum(1 for _, is_cloud in scored if not is_cloud), "thresholds": []}
+    # 以“拦下非云”为正类：precision 是拦下的里面确实不是云的比例，recall 是非云里被拦下的比例
+    for threshold in thresholds:
+        rejected = [is_cloud for score, is_cloud in scored if score < threshold]
+        true_rejects = sum(1 for is_cloud in rejected if not is_cloud)
+        report["thresholds"].append({
+            "threshold": threshold,
+            "rejected": len(rejected),
+            "precision": round(true_rejects / len(rejected), 3) if rejected else None,
+            "recall": round(true_rejects / report["model_not_cloud"], 3) if report["model_not_cloud"] else None,
+            "clouds_rejected": len(rejected) - true_rejects,
+        })
+    return report
+
+class IncrementalJSONFields:
+    """逐段喂入模型输出，顶层的标量字段一写完整就能取到；前后的 ```json 标记和闲话不影响。"""
+
+    # 字符串/布尔/null 读到结尾就是完整的；数字要等到后面的逗号或右括号才能确定
+    FIELD_RE = re.compile(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|true|false|null|-?\d+(?:\.\d+)?(?=\s*[,}]))')
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self._pos = 0
+
+    def feed(self, delta):
+        self.text += delta
+        found = False
+        for m in self.FIELD_RE.finditer(self.text, self._pos):
+            self.fields[m.group(1)] = json.loads(m.group(2))
+            self._pos = m.end()
+            found = True
+        return found
+
+def request_classification(image_bytes, on_fields=None, preprocess=True):
+    # preprocess=False 原样发送：evaluate_preprocessing 拿原图做对照，批量导入传的是已经缩好的图
+    if preprocess:
+        with span("preprocess"): model_bytes = preprocess_for_model(image_bytes)
+    else: model_bytes = image_bytes
+    base64_image = base64.b64encode(model_bytes).decode('utf-8')
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": base64_image}},
+                {"type": "text", "text": CLASSIFY_PROMPT}
+            ]
+        }
+    ]
+    if MODEL_STREAM: return stream_classification(messages, on_fields)
+    with span("model_call"): response = get_model_client().chat.completions.create(model=MODEL_NAME, messages=messages)
+    return response.choices[0].message.content
+
+def stream_classification(messages, on_fields=None):
+    t0, first_field = time.perf_counter(), True
+
+    def read(stream):
+        # 每次 (重试) 都从头解析一遍；提前 return 或中途出错时关掉底层的 HTTP 响应，服务端随之停止生成
+        nonlocal first_field
+        parser = IncrementalJSONFields()
+        try:
+            for chunk in stream:
+                if not chunk.choices: continue
+                if not parser.feed(chunk.choices[0].delta.content or ""): continue
+                if first_field:
+                    get_metrics().observe("model_first_field", time.perf_counter() - t0)
+                    first_field = False
+                if on_fields: on_fields(dict(parser.fields))
+                # 已经判定不是云，后面的内容用不上，断开连接省下剩余的 token
+                if parser.fields.get("is_cloud") is False: return json.dumps({"is_cloud": False})
+        finally:
+            close_stream(stream)
+        return parser.text
+
+    with span("model_call"):
+        return get_model_client().consume_stream(read, model=MODEL_NAME, messages=messages, stream=True)
+
+# 🔴 改动5：清洗和解析智谱的返回结果
+def parse_model_json(raw_content):
+    with span("json_parse"): return _parse_model_json(raw_content)
+
+def _parse_model_json(raw_content):
+    # 去除可能存在的 markdown 代码块标记
+    clean_json = raw_content.replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(clean_json)
+    except json.JSONDecodeError:
+        # 模型偶尔会在 JSON 前后带几句话，退而截取最外层的大括号
+        start, end = clean_json.find("{"), clean_json.rfind("}")
+        if start == -1 or end <= start: raise
+        return json.loads(clean_json[start:end + 1])
+
+def classify_image(image_bytes, image_hash=None, use_cache=True, on_fields=None, preprocess=True):
+    # preprocess=False：调用方已经缩过图 (批量导入的缩图阶段)，image_hash 仍传原图的 md5
+    if not use_cache: return parse_model_json(request_classification(image_bytes, on_fields, preprocess))
+    key = (image_hash or hashlib.md5(image_bytes).hexdigest(), MODEL_NAME, PROMPT_VERSION)
+    cache = get_response_cache()
+    raw_content = cache.get_or_call(key, lambda: request_classification(image_bytes, on_fields, preprocess))
+    try:
+        return parse_model_json(raw_content)
+    except json.JSONDecodeError:
+        # 解析不了的回复不留在缓存里，下次重新请求
+        cache.invalidate(key)
+        raise
+
+def score_classification(result):
+    # 模型给的分只作参考，积分和等级以计分表为准
+    c_name = result.get("cloud_name", "未知")
+    ai_score = result.get("score_suggestion", 10)
+    c_sci = result.get("science_fact", "暂无")
+    c_wea = result.get("weather_tip", "暂无")
+
+    official_score = get_official_score(c_name, ai_score)
+    calculated_tier = calculate_tier_from_score(official_score)
+    return c_name, calculated_tier, official_score, c_sci, c_wea
+
+
+def evaluate_preprocessing(user_id, sample_size=10):
+    # 最近的档案各鉴定两次：原图一次、缩图后一次 (都不走缓存)，统计两次结论一致的比例，确认缩图没有拖累识别
+    with db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT image_hash FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?', (user_id, sample_size))
+        samples = c.fetchall()
+    report = {"sampled": 0, "same_name": 0, "same_tier": 0, "original_bytes": 0, "sent_bytes": 0, "mismatches": []}
+    for (r_hash,) in samples:
+        image_bytes = get_image_by_hash(r_hash)
+        if not image_bytes: continue
+        names = []
+        for preprocess in (False, True):
+            result = parse_model_json(request_classification(image_bytes, preprocess=preprocess))
+            names.append(result.get("cloud_name", "未知") if result.get("is_cloud", False) else "(非云)")
+        original_name, preprocessed_name = names
+        report["sampled"] += 1
+        report["original_bytes"] += len(image_bytes)
+        report["sent_bytes"] += len(preprocess_for_model(image_bytes))
+        if preprocessed_name == original_name: report["same_name"] += 1
+        else: report["mismatches"].append((original_name, preprocessed_name))
+        if calculate_tier_from_score(get_official_score(preprocessed_name, 10)) == calculate_tier_from_score(get_official_score(original_name, 10)): report["same_tier"] += 1
+    return report
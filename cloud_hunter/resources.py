@@ -0,0 +1,43 @@
+"""进程内共享资源 (连接池、模型客户端、索引…) 的一次性初始化。
+
+代替 st.cache_resource：核心库不依赖 streamlit，命令行和后台任务里导入也不用先拉起整个 streamlit。
+页面每次 rerun 重新执行 app.py，但包里的模块只导入一次，这里缓存的对象整个进程共用。
+"""
+import functools
+import threading
+from collections import OrderedDict
+
+
+def once(fn=None, *, max_entries=None):
+    """按位置参数缓存返回值，同样的参数整个进程只初始化一次；多个线程同时第一次调用时只有一个真正执行，其余等它。
+
+    max_entries 限制不同参数的个数，超出时丢掉最久没用过的；f.clear() 清空缓存。
+    """
+    if fn is None: return functools.partial(once, max_entries=max_entries)
+    cache = OrderedDict()
+    building = {}
+    lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        with lock:
+            if args in cache:
+                cache.move_to_end(args)
+                return cache[args]
+            key_lock = building.setdefault(args, threading.Lock())
+        # 不同参数各自初始化，互不阻塞 (比如不同用户的查重索引)
+        with key_lock:
+            with lock:
+                if args in cache: return cache[args]
+            value = fn(*args)
+            with lock:
+                cache[args] = value
+                if max_entries and len(cache) > max_entries: cache.popitem(last=False)
+                building.pop(args, None)
+        return value
+
+    def clear():
+        with lock: cache.clear()
+
+    wrapper.clear = clear
+    return wrapper
@@ -0,0 +1,262 @@
+"""计分规则：云名字典、官方计分表、等级/称号、勋章判定和模型云名的标准化。
+
+纯 Python，不依赖数据库、图片库和 streamlit，导入几乎没有开销。
+"""
+import functools
+import hashlib
+import json
+
+from cloud_hunter.resources import once
+
+# ==========================================
+# 📖 字典库 (保持不变)
+# ==========================================
+CLOUD_TRANSLATIONS = {
+    "积云": "Cumulus", "淡积云": "Cumulus humilis", "碎积云": "Cumulus fractus", "浓积云": "Cumulus congestus",
+    "层云": "Stratus", "雾": "Fog", "飞机尾迹": "Contrail",
+    "层积云": "Stratocumulus", "高积云": "Altocumulus", "高层云": "Altostratus",
+    "卷云": "Cirrus", "卷层云": "Cirrostratus", "卷积云": "Cirrocumulus", "密卷云": "Cirrus spissatus", "钩卷云": "Cirrus uncinus",
+    "雨层云": "Nimbostratus", "积雨云": "Cumulonimbus", "幡状云": "Virga",
+    "波状高积云": "Altocumulus undulatus", "透光高积云": "Altocumulus translucidus", "絮状高积云": "Altocumulus floccus", "堡状高积云": "Altocumulus castellanus",
+    "日晕": "Halo", "幻日": "Sun Dog", "彩虹": "Rainbow", "双彩虹": "Double Rainbow", "火彩虹": "Circumhorizontal Arc",
+    "云隙光": "Crepuscular Rays", "反云隙光": "Anticrepuscular Rays", "虹彩云": "Iridescence",
+    "乳状云": "Mammatus", "网状云": "Lacunosus", "糙面云": "Asperitas",
+    "荚状云": "Lenticularis", "夜光云": "Noctilucent", "滚轴云": "Roll Cloud", "管状云": "Tube Cloud",
+    "珠母云": "Nacreous", "马蹄云": "Horseshoe Vortex", "雨幡洞": "Fallstreak Hole",
+    "开尔文-赫姆霍兹波": "Kelvin-Helmholtz", "海啸云": "Shelf Cloud",
+    "红色精灵": "Red Sprite", "史蒂夫现象": "STEVE"
+}
+
+def get_bilingual_name(c_name):
+    en_name = CLOUD_TRANSLATIONS.get(c_name, "")
+    if en_name:
+        return f"{c_name} <span style='opacity:0.6; font-size:0.8em; font-family:serif;'>{en_name}</span>"
+    return c_name
+
+ACHIEVEMENTS = {
+    "👶 萌新入坑": {"clouds": ["积云", "层云", "飞机尾迹"], "min": 2, "icon": "🌱", "desc": "收集积云、层云或飞机尾迹中的任意 2 种"},
+    # 旧版按描述文字判定门槛，"(任意2种)" 少个空格匹配不上，这枚勋章从来解不开；现在按 min 判定，集齐任意 2 种即解锁
+    "☔ 暴雨将至": {"clouds": ["积雨云", "雨层云", "碎积云"], "min": 2, "icon": "🌧️", "desc": "收集积雨云、雨层云等预示降水的云 (任意2种)"},
+    "☁️ 云端漫步": {"clouds": ["卷云", "卷积云", "卷层云"], "min": 3, "icon": "🕊️", "desc": "集齐所有高云族 (卷云系列)"},
+    "🌈 光之美学": {"clouds": ["彩虹", "双彩虹", "日晕", "虹彩云", "云隙光"], "min": 3, "icon": "🌈", "desc": "收集 3 种以上的大气光学现象"},
+    "⛈️ 风暴领主": {"clouds": ["积雨云", "乳状云", "海啸云", "糙面云"], "min": 2, "icon": "⚡", "desc": "收集 2 种以上的风暴伴生云"},
+    "👽 异星来客": {"clouds": ["荚状云", "马蹄云", "开尔文-赫姆霍兹波", "滚轴云"], "min": 1, "icon": "🛸", "desc": "收集 1 种形状极其怪异的云"}
+}
+
+OFFICIAL_SCORES = {
+    "积云": 10, "淡积云": 10, "碎积云": 10, "层云": 10, "雾": 5, "飞机尾迹": 5,
+    "层积云": 15, "高积云": 15, "高层云": 15, "卷云": 15, "卷层云": 15, "雨层云": 20, "卷积云": 25, "积雨云": 25, "浓积云": 20, "幡状云": 25, "絮状高积云": 25,
+    "波状高积云": 30, "透光高积云": 30, "日晕": 30, "彩虹": 35, "云隙光": 30, "乳状云": 35, "网状云": 35, "堡状高积云": 35, "幻日": 35, "反云隙光": 35,
+    "双彩虹": 40, "荚状云": 40, "虹彩云": 40, "糙面云": 45, "夜光云": 45, "滚轴云": 45, "管状云": 45,
+    "珠母云": 50, "马蹄云": 50, "雨幡洞": 50, "开尔文-赫姆霍兹波": 55, "海啸云": 55, "火彩虹": 60, "红色精灵": 80, "史蒂夫现象": 80
+}
+
+MAX_POSSIBLE_SCORE = sum(OFFICIAL_SCORES.values())
+
+class AchievementEngine:
+    """成就规则编译成位掩码：每个物种占一位，已收集集合是一个整数，
+    解锁判定就是 popcount(已收集 & 规则) >= 门槛。"""
+
+    def __init__(self, achievements, species):
+        self.species = list(dict.fromkeys(species))
+        self.bits = {name: 1 << i for i, name in enumerate(self.species)}
+        self.rules = [(ach_name, self.mask_for(data["clouds"]), data["min"]) for ach_name, data in achievements.items()]
+
+    def mask_for(self, names):
+        mask = 0
+        for name in names: mask |= self.bits.get(name, 0)
+        return mask
+
+    def names_in(self, mask):
+        return [name for name in self.species if mask & self.bits[name]]
+
+    def progress(self, mask):
+        # [(成就名, 已收集数, 是否解锁, 缺少的物种位)]
+        result = []
+        for ach_name, rule_mask, threshold in self.rules:
+            have = (mask & rule_mask).bit_count()
+            result.append((ach_name, have, have >= threshold, rule_mask & ~mask))
+        return result
+
+    def newly_unlocked(self, old_mask, new_mask):
+        return [ach_name for ach_name, rule_mask, threshold in self.rules
+                if (old_mask & rule_mask).bit_count() < threshold <= (new_mask & rule_mask).bit_count()]
+
+@once
+def get_achievement_engine():
+    species = list(OFFICIAL_SCORES) + list(CLOUD_TRANSLATIONS)
+    for data in ACHIEVEMENTS.values(): species += data["clouds"]
+    return AchievementEngine(ACHIEVEMENTS, species)
+
+# 模型常给出的俗名/别称 -> 标准名；英文学名由 CLOUD_TRANSLATIONS 自动反查
+CLOUD_ALIASES = {
+    "鱼鳞云": "卷积云", "马尾云": "钩卷云", "毛卷云": "卷云",
+    "雷暴云": "积雨云", "雷雨云": "积雨云", "砧状云": "积雨云", "乌云": "雨层云", "馒头云": "积云",
+    "飞机云": "飞机尾迹", "航迹云": "飞机尾迹", "凝结尾迹": "飞机尾迹",
+    "悬球状云": "乳状云", "乳房云": "乳状云", "陆架云": "海啸云", "弧状云": "海啸云",
+    "贝母云": "珠母云", "极地平流层云": "珠母云", "雨幡": "幡状云", "穿洞云": "雨幡洞",
+    "耶稣光": "云隙光", "曙暮光条": "云隙光", "环地平弧": "火彩虹", "22度晕": "日晕", "月晕": "日晕",
+}
+
+def normalize_cloud_name(name):
+    return "".join(ch for ch in name.lower() if ch.isalnum())
+
+class AhoCorasick:
+    """多模式串匹配：一次扫描找出文本里出现的所有模式串。"""
+
+    def __init__(self, patterns):
+        self.goto, self.fail, self.out = [{}], [0], [[]]
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                if ch not in self.goto[node]:
+                    self.goto.append({}); self.fail.append(0); self.out.append([])
+                    self.goto[node][ch] = len(self.goto) - 1
+                node = self.goto[node][ch]
+            self.out[node].append((pattern, value))
+        level = list(self.goto[0].values())
+        while level:
+            next_level = []
+            for node in level:
+                for ch, child in self.goto[node].items():
+                    f = self.fail[node]
+                    while f and ch not in self.goto[f]: f = self.fail[f]
+                    self.fail[child] = self.goto[f].get(ch, 0) if self.goto[f].get(ch) != child else 0
+                    self.out[child] = self.out[child] + self.out[self.fail[child]]
+                    next_level.append(child)
+            level = next_level
+
+    def find_all(self, text):
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]: node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            yield from self.out[node]
+
+class CloudNameResolver:
+    """把模型给出的云名解析成 OFFICIAL_SCORES 里的标准名，构建一次、查询不随物种数量变慢。
+
+    顺序：精确匹配 -> 别名/英文名 -> 包含关系兜底 (标准名出现在输入里，或输入是某个标准名的一部分)，
+    兜底时和旧逻辑一样取最长的标准名，等长按字典顺序。
+    """
+
+    def __init__(self, official_scores, translations, aliases):
+        keys = list(official_scores)
+        # 与旧实现的 sorted(key=len, reverse=True) 一致的优先级
+        self.rank = {key: i for i, key in enumerate(sorted(keys, key=len, reverse=True))}
+        self.official = set(keys)
+        self.key_matcher = AhoCorasick({key: key for key in keys})
+        self.containing = {}
+        for key in keys:
+            for i in range(len(key)):
+                for j in range(i + 1, len(key) + 1):
+                    best = self.containing.get(key[i:j])
+                    if best is None or self.rank[key] < self.rank[best]: self.containing[key[i:j]] = key
+        self.aliases = {}
+        alias_sources = {en: zh for zh, en in translations.items()}
+        alias_sources.update(aliases)
+        alias_sources.update({key: key for key in keys})
+        for alias, target in alias_sources.items():
+            canonical = target if target in self.official else self._match_contained(target)
+            if canonical: self.aliases[normalize_cloud_name(alias)] = canonical
+        self.alias_matcher = AhoCorasick({alias: target for alias, target in self.aliases.items() if len(alias) > 1})
+        # 档案里的云名高度重复，批量重算分数时大部分查询直接命中这里
+        self.resolve = functools.lru_cache(maxsize=4096)(self._resolve)
+
+    def _match_contained(self, name):
+        candidates = [key for key, _ in self.key_matcher.find_all(name)]
+        if name in self.containing: candidates.append(self.containing[name])
+        return min(candidates, key=self.rank.__getitem__) if candidates else None
+
+    def _resolve(self, name):
+        if not isinstance(name, str) or not name: return None
+        if name in self.official: return name
+        norm = normalize_cloud_name(name)
+        if norm in self.aliases: return self.aliases[norm]
+        matched = self._match_contained(name)
+        if matched: return matched
+        # 最后在规范化文本里找最长的别名，兼容 "Altocumulus lenticularis" 这类写法
+        found = max(self.alias_matcher.find_all(norm), key=lambda item: len(item[0]), default=None)
+        return found[1] if found else None
+
+@once
+def get_name_resolver():
+    return CloudNameResolver(OFFICIAL_SCORES, CLOUD_TRANSLATIONS, CLOUD_ALIASES)
+
+def get_official_score(cloud_name, ai_suggested_score):
+    if cloud_name in OFFICIAL_SCORES: return OFFICIAL_SCORES[cloud_name]
+    resolved = get_name_resolver().resolve(cloud_name)
+    return OFFICIAL_SCORES[resolved] if resolved else ai_suggested_score
+
+def calculate_tier_from_score(score):
+    if score <= 10: return "N"
+    if score <= 29: return "R"
+    if score <= 39: return "SR"
+    if score <= 49: return "SSR"
+    return "UR"
+
+# 与 calculate_tier_from_score 保持同步的 SQL 版本
+def sql_tier_case(expr):
+    return f"CASE WHEN {expr} <= 10 THEN 'N' WHEN {expr} <= 29 THEN 'R' WHEN {expr} <= 39 THEN 'SR' WHEN {expr} <= 49 THEN 'SSR' ELSE 'UR' END"
+
+def normalize_tier(raw_tier):
+    if not raw_tier: return "N"
+    t = str(raw_tier).upper().strip()
+    clean = t.split()[0]
+    if clean in ["UR", "SSR", "SR", "R", "N"]: return clean
+    return "N"
+
+# 计分表 (含别名) 的指纹；和库里记录的不一致时，启动时整体重算一次
+SCORE_TABLE_VERSION = hashlib.md5(json.dumps([OFFICIAL_SCORES, CLOUD_ALIASES, CLOUD_TRANSLATIONS], ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+# ==========================================
+# 🎖️ 等级颜色 & 称号
+# ==========================================
+TIER_COLORS = {"UR": "#c0392b", "SSR": "#f1c40f", "SR": "#8e44ad", "R": "#2980b9", "N": "#7f8c8d"}
+
+def get_tier_color(tier):
+    clean = normalize_tier(tier)
+    return TIER_COLORS.get(clean, "#7f8c8d")
+
+RANK_SYSTEM = [
+    (0.00, "I", "抬头族", "#95a5a6"),       
+    (0.05, "II", "见习观测员", "#27ae60"),  
+    (0.15, "III", "天空记录者", "#2980b9"), 
+    (0.30, "IV", "追风者", "#2980b9"),      
+    (0.50, "V", "云图绘制师", "#8e44ad"),   
+    (0.65, "VI", "苍穹之眼", "#8e44ad"),    
+    (0.80, "VII", "云端领主", "#f1c40f"),   
+    (0.95, "VIII", "天空守护神", "#c0392b"),
+    (1.00, "IX", "气象之神", "#e74c3c")     
+]
+
+def get_user_rank_info(current_score):
+    max_score = MAX_POSSIBLE_SCORE
+    current_pct = current_score / max_score if max_score > 0 else 0
+    
+    prev_pct = 0
+    for pct, roman, title, color in RANK_SYSTEM:
+        target_score = int(max_score * pct)
+        if current_score < target_score:
+            gap = target_score - current_score
+            section_progress = (current_score - (max_score * prev_pct)) / (target_score - (max_score * prev_pct))
+            idx = RANK_SYSTEM.index((pct, roman, title, color))
+            if idx > 0:
+                curr_roman, curr_title, curr_color = RANK_SYSTEM[idx-1][1], RANK_SYSTEM[idx-1][2], RANK_SYSTEM[idx-1][3]
+            else:
+                curr_roman, curr_title, curr_color = "I", "抬头族", "#95a5a6"
+            tooltip = f"下一级：Lv.{roman} {title} (还需 {gap} 分)"
+            return curr_roman, curr_title, curr_color, section_progress, tooltip
+        prev_pct = pct
+        
+    last = RANK_SYSTEM[-1]
+    return last[1], last[2], last[3], 1.0, "已达理论极限！"
+
+# 藏品馆按物种分组 (每个物种一行，来自 get_species_gallery)；物种等级直接取 species_stats 里的最高分
+def process_history_data(raw_data, species_best):
+    tiers_data = {"UR": {}, "SSR": {}, "SR": {}, "R": {}, "N": {}}
+    for row in raw_data:
+        c_name = row[0]
+        real_tier = calculate_tier_from_score(species_best.get(c_name, 0))
+        tiers_data[real_tier][c_name] = row
+    return tiers_data
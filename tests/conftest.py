@@ -0,0 +1,102 @@
+"""测试共用的夹具：每个测试在独立的临时目录里建库，进程内缓存的连接池/仓库/索引先清空。
+
+    python -m pytest -q
+"""
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "bench"))
+
+import fake_zhipuai  # noqa: E402
+
+from cloud_hunter import db, model  # noqa: E402
+
+
+def clear_process_caches():
+    for cached in (db.get_db_pool, db.get_image_store, db.get_phash_index, model.get_model_client, model.get_response_cache):
+        cached.clear()
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # DB_PATH / IMAGE_STORE_DIR 都是相对路径，和 app.py 一样按当前目录解析
+    monkeypatch.chdir(tmp_path)
+    clear_process_caches()
+    yield tmp_path
+    clear_process_caches()
+
+
+@pytest.fixture
+def fake_model(data_dir, monkeypatch):
+    # 和基准测试一样用 bench/fake_zhipuai 顶替 SDK，回复由图片内容决定，不发网络请求
+    monkeypatch.setitem(sys.modules, "zhipuai", fake_zhipuai)
+    monkeypatch.setenv("ZHIPU_API_KEY", "test")
+    monkeypatch.setattr(fake_zhipuai, "calls", 0)
+    model.get_model_client.clear()
+    return fake_zhipuai
+
+
+def make_jpeg(seed, size=(96, 64)):
+    from PIL import Image
+    img = Image.new("RGB", size, (60 + seed * 37 % 150, 120, 200 - seed * 23 % 120))
+    for x in range(0, size[0], 8):
+        for y in range(0, size[1], 8):
+            img.putpixel((x, y), ((x * seed) % 256, (y * 7) % 256, (x + y) % 256))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def make_baseline_db(path, rows):
+    """最早版本 app.py 建的库：只有 history 一张表，原图以 BLOB 存在 image_data 里。rows 为 (cloud_name, score, image_bytes)。"""
+    import hashlib
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cloud_name TEXT,
+            tier TEXT,
+            score INTEGER,
+            science_fact TEXT,
+            weather_tip TEXT,
+            image_data BLOB,
+            image_hash TEXT UNIQUE,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for i, (cloud_name, score, image_bytes) in enumerate(rows):
+        conn.execute('INSERT INTO history (cloud_name, tier, score, science_fact, weather_tip, image_data, image_hash, timestamp) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (cloud_name, "N", score, "科普", "天气", image_bytes, hashlib.md5(image_bytes).hexdigest(), f"2024-01-0{i + 1} 12:00:00"))
+    conn.commit()
+    conn.close()
+
+
+def collection_snapshot(conn, user_id):
+    """触发器维护的统计表，和直接对 history 聚合的结果放在一起，方便比对。"""
+    stats = conn.execute('SELECT cloud_name, obs_count, total_score, best_score FROM species_stats WHERE user_id = ? ORDER BY cloud_name', (user_id,)).fetchall()
+    expected_stats = conn.execute('SELECT cloud_name, COUNT(*), SUM(score), MAX(score) FROM history WHERE user_id = ? '
+                                  'GROUP BY cloud_name ORDER BY cloud_name', (user_id,)).fetchall()
+    totals = conn.execute('SELECT total_score, total_obs FROM collection_totals WHERE user_id = ?', (user_id,)).fetchone()
+    expected_totals = conn.execute('SELECT COALESCE(SUM(score), 0), COUNT(*) FROM history WHERE user_id = ?', (user_id,)).fetchone()
+    return stats, expected_stats, totals or (0, 0), expected_totals
+
+
+def insert_rows(user_id, rows):
+    """rows 为 (cloud_name, score, image_hash)，不走首发判定，分数原样写入。"""
+    with db.db_conn() as conn:
+        for cloud_name, score, image_hash in rows:
+            db.insert_history_row(conn, user_id, cloud_name, "N", score, "科普", "天气", image_hash, 0)
+
+
+def assert_stats_consistent(user_id):
+    with db.db_conn() as conn:
+        stats, expected_stats, totals, expected_totals = collection_snapshot(conn, user_id)
+    assert stats == expected_stats
+    assert totals == expected_totals
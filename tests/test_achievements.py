@@ -0,0 +1,40 @@
+import pytest
+
+from cloud_hunter.scoring import ACHIEVEMENTS, get_achievement_engine
+
+
+@pytest.fixture
+def engine():
+    return get_achievement_engine()
+
+
+def unlocked(engine, names):
+    return {name for name, _, is_unlocked, _ in engine.progress(engine.mask_for(names)) if is_unlocked}
+
+
+def test_thresholds_follow_min(engine):
+    assert unlocked(engine, ["积云"]) == set()
+    assert unlocked(engine, ["积云", "层云"]) == {"👶 萌新入坑"}
+    assert "☁️ 云端漫步" not in unlocked(engine, ["卷云", "卷积云"])
+    assert "☁️ 云端漫步" in unlocked(engine, ["卷云", "卷积云", "卷层云"])
+    assert unlocked(engine, ["荚状云"]) == {"👽 异星来客"}
+
+
+def test_rain_badge_unlocks_with_any_two_species(engine):
+    # 行为变化：旧版从描述 "(任意2种)" 里找 "2 种" 找不到，永远不解锁；现在与描述一致
+    assert ACHIEVEMENTS["☔ 暴雨将至"]["min"] == 2
+    assert "☔ 暴雨将至" not in unlocked(engine, ["积雨云"])
+    assert "☔ 暴雨将至" in unlocked(engine, ["积雨云", "碎积云"])
+
+
+def test_newly_unlocked_reports_only_crossed_thresholds(engine):
+    old = engine.mask_for(["积云", "积雨云"])
+    new = old | engine.mask_for(["层云", "乳状云"])
+    assert set(engine.newly_unlocked(old, new)) == {"👶 萌新入坑", "⛈️ 风暴领主"}
+    assert engine.newly_unlocked(new, new) == []
+
+
+def test_progress_reports_missing_species(engine):
+    progress = {name: (have, missing) for name, have, _, missing in engine.progress(engine.mask_for(["卷云"]))}
+    have, missing = progress["☁️ 云端漫步"]
+    assert have == 1 and set(engine.names_in(missing)) == {"卷积云", "卷层云"}
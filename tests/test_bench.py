@@ -0,0 +1,106 @@
+"""bench/ 里的基准工具本身：假客户端、合成档案、故障注入服务和结果汇总。"""
+import io
+import json
+import os
+import sqlite3
+import sys
+
+import httpx
+import pytest
+from PIL import Image
+
+import fake_zhipuai
+import run_bench
+import stub_server
+import synth_archive
+from conftest import collection_snapshot
+
+
+def test_fake_reply_is_deterministic_per_image():
+    assert fake_zhipuai.fake_reply("data:a") == fake_zhipuai.fake_reply("data:a")
+    replies = [json.loads(fake_zhipuai.fake_reply(f"data:{i}")) for i in range(50)]
+    assert {r["cloud_name"] for r in replies} <= set(fake_zhipuai.CLOUD_NAMES)
+    assert any(r["is_cloud"] for r in replies) and not all(r["is_cloud"] for r in replies)
+
+
+def test_fake_stream_stops_after_close():
+    stream = fake_zhipuai._Stream("x" * 80, chunk_size=8)
+    pieces = []
+    for chunk in stream:
+        pieces.append(chunk.choices[0].delta.content)
+        if len(pieces) == 3: stream.response.close()
+    assert pieces == ["x" * 8] * 3 and stream.chunks_sent == 3
+
+
+def test_sample_photo_has_requested_size():
+    img_bytes = synth_archive.make_sample_photo(1, size=(320, 240))
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        assert img.size == (320, 240) and img.format == "JPEG"
+
+
+def test_build_archive_creates_a_consistent_multi_user_archive(data_dir, monkeypatch):
+    # init_schema 会在 AppTest 里跑一遍 app.py 建库；假客户端只在这个测试里生效
+    monkeypatch.setitem(sys.modules, "zhipuai", fake_zhipuai)
+    monkeypatch.setattr(fake_zhipuai, "install", lambda: None)
+    out_dir = data_dir / "archive"
+    synth_archive.build_archive(str(out_dir), records=40, samples=2, image_size=(64, 48), users=3)
+
+    conn = sqlite3.connect(out_dir / "clouds.db")
+    try:
+        users = dict(conn.execute('SELECT user_id, COUNT(*) FROM history GROUP BY user_id').fetchall())
+        hashes = [row[0] for row in conn.execute('SELECT image_hash FROM history')]
+        for user_id in users:
+            stats, expected_stats, totals, expected_totals = collection_snapshot(conn, user_id)
+            assert stats == expected_stats and totals == expected_totals
+    finally:
+        conn.close()
+    assert sum(users.values()) == 40 and len(users) == 3 and "default" in users
+    for image_hash in hashes:
+        assert os.path.exists(out_dir / "cloud_images" / image_hash[:2] / image_hash[2:4] / image_hash)
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, config = stub_server.serve(config=stub_server.StubConfig(latency=0, jitter=0, chunk_delay=0, seed=1, **kwargs))
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", config
+
+    yield start
+    for server in servers: server.shutdown()
+
+
+def completion_request(stream=False):
+    return {"model": "stub", "stream": stream, "messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:x"}}]}]}
+
+
+def test_stub_server_serves_plain_and_streamed_replies(stub):
+    base_url, config = stub()
+    expected = fake_zhipuai.fake_reply("data:x")
+    with httpx.Client(base_url=base_url) as client:
+        reply = client.post("/chat/completions", json=completion_request()).json()
+        assert reply["choices"][0]["message"]["content"] == expected
+        with client.stream("POST", "/chat/completions", json=completion_request(stream=True)) as resp:
+            events = [line[len("data: "):] for line in resp.iter_lines() if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        assert "".join(json.loads(e)["choices"][0]["delta"]["content"] for e in events[:-1]) == expected
+        assert client.get("/stats").json()["ok"] == 2
+
+
+def test_stub_server_injects_failures(stub):
+    base_url, config = stub(throttle_rate=1.0)
+    with httpx.Client(base_url=base_url) as client:
+        assert client.post("/chat/completions", json=completion_request()).status_code == 429
+    assert config.counts["429"] == 1 and config.counts["ok"] == 0
+
+
+def test_summarize_and_compare(capsys):
+    summary = run_bench.summarize([0.004, 0.001, 0.002, 0.003])
+    assert summary == {"runs": 4, "median_ms": 2.5, "p95_ms": 4.0, "min_ms": 1.0}
+    current = {"results": {"1000": {"rerun": {"median_ms": 5.0}, "only_current": {"median_ms": 1.0}}}}
+    baseline = {"results": {"1000": {"rerun": {"median_ms": 10.0}}}}
+    run_bench.compare(current, baseline)
+    out = capsys.readouterr().out
+    assert "0.50x" in out and "only_current" not in out
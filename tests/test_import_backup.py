@@ -0,0 +1,126 @@
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+from conftest import assert_stats_consistent, clear_process_caches, insert_rows, make_baseline_db, make_jpeg
+
+from cloud_hunter import db
+
+
+def test_import_reconciles_first_discoveries(data_dir):
+    insert_rows("alice", [("积云", 10, "kept")])
+    with db.db_conn() as conn:
+        conn.execute("UPDATE history SET timestamp = '2024-06-01 12:00:00'")
+    photos = [make_jpeg(i) for i in range(3)]
+    # 备份里的积云比现有那条更早，彩虹只出现在备份里
+    make_baseline_db("legacy.db", [("积云", 10, photos[0]), ("彩虹", 35, photos[1]), ("彩虹", 35, photos[2])])
+
+    with open("legacy.db", "rb") as fp:
+        report = db.import_backup("alice", fp, "legacy.db")
+
+    assert report["source"] == 3 and report["inserted"] == 3 and report["images"] == 3
+    with db.db_conn() as conn:
+        rows = conn.execute("SELECT cloud_name, score, timestamp FROM history WHERE user_id = 'alice' ORDER BY timestamp").fetchall()
+    # 每个物种只有最早的一条拿分
+    assert [(name, score) for name, score, _ in rows] == [("积云", 10), ("彩虹", 35), ("彩虹", 0), ("积云", 0)]
+    assert_stats_consistent("alice")
+    for photo in photos: assert db.get_image_by_hash(hashlib.md5(photo).hexdigest()) == photo
+
+
+def test_import_ignores_photos_already_in_the_collection(data_dir):
+    photo = make_jpeg(5)
+    make_baseline_db("legacy.db", [("积云", 10, photo)])
+    for _ in range(2):
+        with open("legacy.db", "rb") as fp:
+            report = db.import_backup("alice", fp, "legacy.db")
+    assert (report["inserted"], report["duplicates"]) == (0, 1)
+    assert db.get_collection_stats("alice")[:2] == (10, 1)
+
+
+def test_import_rejects_files_that_are_not_databases(data_dir):
+    with open("broken.db", "wb") as fp: fp.write(b"not a database" * 100)
+    with open("broken.db", "rb") as fp:
+        try:
+            db.import_backup("alice", fp, "broken.db")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("expected ValueError")
+    with db.db_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0
+
+
+def test_export_then_import_round_trips_into_another_user(data_dir):
+    photos = [make_jpeg(i) for i in range(2)]
+    for i, photo in enumerate(photos):
+        db.save_to_db("alice", ["积云", "彩虹"][i], "N", [10, 35][i], "科普", "天气", photo, hashlib.md5(photo).hexdigest(), first_discovery=True)
+    archive = db.export_backup("alice")
+    with open(archive, "rb") as fp:
+        report = db.import_backup("bob", fp, "backup.tar.gz")
+    assert (report["source"], report["inserted"], report["images"]) == (2, 2, 2)
+    assert db.get_collection_stats("bob")[:3] == (45, 2, 2)
+
+
+def test_tar_members_that_do_not_match_their_md5_are_skipped(data_dir):
+    photo = make_jpeg(1)
+    db.save_to_db("alice", "积云", "N", 10, "科普", "天气", photo, hashlib.md5(photo).hexdigest())
+    db.export_backup("alice")
+    buf = io.BytesIO()
+    forged = "0" * 32
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        tar.add(db.DB_PATH, arcname=os.path.basename(db.DB_PATH))
+        info = tarfile.TarInfo(f"{db.IMAGE_STORE_DIR}/{forged}")
+        info.size = 5
+        tar.addfile(info, io.BytesIO(b"evil!"))
+    buf.seek(0)
+    report = db.import_backup("bob", buf, "backup.tar.gz")
+    assert report["images"] == 0
+    assert db.get_image_by_hash(forged) is None
+
+
+def backup_on_another_device(data_dir, monkeypatch, photos, keep_images):
+    """在当前目录存档、导出，再换一个空目录当作新设备；返回只保留前 keep_images 张原图的备份。"""
+    for photo in photos:
+        db.save_to_db("alice", "积云", "N", 10, "科普", "天气", photo, hashlib.md5(photo).hexdigest())
+    with open(db.export_backup("alice"), "rb") as fp: archive = fp.read()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=io.BytesIO(archive), mode="r:gz") as src, tarfile.open(fileobj=buf, mode="w:gz") as dst:
+        members = [m for m in src.getmembers() if not m.name.startswith(f"{db.IMAGE_STORE_DIR}/")]
+        members += [m for m in src.getmembers() if m.name.startswith(f"{db.IMAGE_STORE_DIR}/")][:keep_images]
+        for member in members: dst.addfile(member, src.extractfile(member))
+    fresh = data_dir / "fresh"
+    fresh.mkdir()
+    monkeypatch.chdir(fresh)
+    clear_process_caches()
+    buf.seek(0)
+    return buf
+
+
+def test_import_missing_photos_is_rejected_without_leaving_blobs(data_dir, monkeypatch):
+    photos = [make_jpeg(i) for i in range(2)]
+    archive = backup_on_another_device(data_dir, monkeypatch, photos, keep_images=1)
+    with pytest.raises(ValueError):
+        db.import_backup("bob", archive, "backup.tar.gz")
+    with db.db_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0
+    # 随备份带来的那张原图也没有留在仓库里
+    for photo in photos: assert db.get_image_by_hash(hashlib.md5(photo).hexdigest()) is None
+
+
+def test_bare_db_without_photos_is_rejected(data_dir, monkeypatch):
+    archive = backup_on_another_device(data_dir, monkeypatch, [make_jpeg(1)], keep_images=0)
+    with tarfile.open(fileobj=archive, mode="r:gz") as tar:
+        with open("clouds_backup.db", "wb") as fp: fp.write(tar.extractfile(os.path.basename(db.DB_PATH)).read())
+    with open("clouds_backup.db", "rb") as fp, pytest.raises(ValueError):
+        db.import_backup("bob", fp, "clouds_backup.db")
+    assert db.get_collection_stats("bob")[:2] == (0, 0)
+
+
+def test_complete_backup_restores_on_another_device(data_dir, monkeypatch):
+    photos = [make_jpeg(i) for i in range(2)]
+    archive = backup_on_another_device(data_dir, monkeypatch, photos, keep_images=2)
+    report = db.import_backup("bob", archive, "backup.tar.gz")
+    assert (report["inserted"], report["images"]) == (2, 2)
+    for photo in photos: assert db.get_image_by_hash(hashlib.md5(photo).hexdigest()) == photo
@@ -0,0 +1,103 @@
+import io
+import json
+import zipfile
+
+from conftest import assert_stats_consistent, insert_rows, make_jpeg
+
+from cloud_hunter import db, ingest
+
+
+def test_save_batch_skips_duplicates_without_losing_the_batch(data_dir):
+    insert_rows("alice", [("积云", 10, "existing")])
+    records = [
+        ("卷云", "R", 15, "科普", "天气", "new1", 1, b"thumb1"),
+        ("积云", "N", 10, "科普", "天气", "existing", 2, b"thumb2"),
+        ("卷云", "R", 15, "科普", "天气", "new2", 3, None),
+    ]
+    saved = db.save_batch("alice", records)
+
+    assert saved == {"new1", "new2"}
+    with db.db_conn() as conn:
+        rows = conn.execute("SELECT image_hash, score FROM history WHERE user_id = 'alice' ORDER BY id").fetchall()
+        thumbs = conn.execute("SELECT image_hash FROM thumbnails").fetchall()
+    # 同批第二张卷云不是首发，按 0 分入库；重复的那条回滚到自己的保存点，不影响前后两条
+    assert rows == [("existing", 10), ("new1", 15), ("new2", 0)]
+    assert thumbs == [("new1",)]
+    assert_stats_consistent("alice")
+    # 写进去的指纹同步进查重索引
+    assert [item for _, item in db.get_phash_index("alice").search(1, 0)] == ["new1"]
+
+
+def write_photos(folder, count, start=0):
+    folder.mkdir(exist_ok=True)
+    for i in range(start, start + count): (folder / f"{i:03d}.jpg").write_bytes(make_jpeg(i))
+
+
+def run_pipeline(source, checkpoint_path, **kwargs):
+    checkpoint = ingest.Checkpoint(str(checkpoint_path))
+    pipeline = ingest.IngestPipeline("alice", checkpoint, rate=0, sky_threshold=0, progress_every=60, log=io.StringIO(), **kwargs)
+    try: return pipeline.run(str(source))
+    finally: checkpoint.close()
+
+
+def test_pipeline_classifies_and_saves_every_photo(fake_model, data_dir):
+    write_photos(data_dir / "photos", 6)
+    report = run_pipeline(data_dir / "photos", data_dir / "ck")
+    counts = report["counts"]
+    assert counts["read"] == 6 and counts["error"] == 0 and not report["fatal"]
+    assert counts["saved"] + counts["not_cloud"] + counts["duplicate"] == 6
+    assert len(db.get_history("alice")) == counts["saved"]
+    assert_stats_consistent("alice")
+
+
+def test_pipeline_resumes_from_checkpoint(fake_model, data_dir):
+    write_photos(data_dir / "photos", 3)
+    run_pipeline(data_dir / "photos", data_dir / "ck")
+    calls = fake_model.calls
+    write_photos(data_dir / "photos", 2, start=3)
+    report = run_pipeline(data_dir / "photos", data_dir / "ck")
+    # 已完成的文件直接跳过，只有新加的两张调用模型
+    assert (report["counts"]["skipped"], report["counts"]["read"]) == (3, 2)
+    assert fake_model.calls - calls == 2
+
+
+def test_pipeline_reads_zip_archives(fake_model, data_dir):
+    with zipfile.ZipFile(data_dir / "photos.zip", "w") as zf:
+        for i in range(3): zf.writestr(f"sky/{i}.jpg", make_jpeg(i))
+        zf.writestr("notes.txt", "ignored")
+    report = run_pipeline(data_dir / "photos.zip", data_dir / "ck")
+    assert report["counts"]["read"] == 3
+
+
+def test_cli_fails_on_unreadable_source(fake_model, data_dir, capsys):
+    (data_dir / "bad.zip").write_bytes(b"garbage")
+    (data_dir / "data").mkdir()
+    assert ingest.main([str(data_dir / "bad.zip"), "--data-dir", "data", "--checkpoint", "ck", "--progress", "60"]) == 1
+    assert json.loads(capsys.readouterr().out)["fatal"]
+    # 相对的 --checkpoint 按启动目录解析，不跟着切到数据目录
+    assert (data_dir / "ck").exists()
+
+
+def test_pipeline_sends_the_preprocessed_bytes_without_resizing_again(fake_model, data_dir, monkeypatch):
+    from cloud_hunter import model
+    calls = []
+    monkeypatch.setattr(model, "preprocess_for_model", lambda image_bytes, *a, **kw: calls.append(image_bytes) or image_bytes)
+    write_photos(data_dir / "photos", 3)
+    report = run_pipeline(data_dir / "photos", data_dir / "ck")
+    assert report["counts"]["error"] == 0
+    # 缩图只在 preprocess 阶段做一次，模型调用那边不再缩
+    assert calls == []
+
+
+def test_pipeline_gives_up_when_the_model_stays_unavailable(fake_model, data_dir, monkeypatch):
+    from cloud_hunter import model
+    def unavailable(*args, **kwargs): raise ingest.ModelUnavailableError("熔断中")
+    monkeypatch.setattr(ingest, "classify_image", unavailable)
+    write_photos(data_dir / "photos", 4)
+    report = run_pipeline(data_dir / "photos", data_dir / "ck", max_outage=0)
+    assert report["counts"]["error"] == 4 and not report["fatal"]
+    assert "ModelUnavailableError" in report["errors"][0][1]
+    # 失败的照片不进检查点，服务恢复后重跑会重新鉴定
+    monkeypatch.setattr(ingest, "classify_image", model.classify_image)
+    report = run_pipeline(data_dir / "photos", data_dir / "ck")
+    assert report["counts"]["skipped"] == 0 and report["counts"]["error"] == 0
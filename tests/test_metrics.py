@@ -0,0 +1,54 @@
+import threading
+
+from cloud_hunter.metrics import StageMetrics
+
+
+def run_in_thread(fn):
+    t = threading.Thread(target=fn)
+    t.start()
+    t.join()
+
+
+def test_abandoned_rerun_is_recorded_at_next_begin_of_same_session():
+    metrics = StageMetrics()
+
+    def interrupted_rerun():
+        metrics.begin("rerun", session="s1")
+        with metrics.span("decode"): pass
+
+    def next_rerun():
+        metrics.begin("rerun", session="s1")
+        metrics.end()
+
+    # 和 Streamlit 一样，每次 rerun 换一个线程；第一次没走到 end()
+    run_in_thread(interrupted_rerun)
+    run_in_thread(next_rerun)
+    assert [r["status"] for r in metrics.recent] == ["interrupted", "ok"]
+    assert metrics.recent[0]["spans"][0][0] == "decode"
+    assert metrics.summary()["rerun_total"]["count"] == 2
+
+
+def test_sessions_do_not_interrupt_each_other():
+    metrics = StageMetrics()
+    run_in_thread(lambda: metrics.begin("rerun", session="s1"))
+    run_in_thread(lambda: (metrics.begin("rerun", session="s2"), metrics.end()))
+    assert [r["status"] for r in metrics.recent] == ["ok"]
+
+
+def test_late_end_after_interruption_is_not_recorded_twice():
+    metrics = StageMetrics()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_rerun():
+        metrics.begin("rerun", session="s1")
+        started.set()
+        release.wait()
+        metrics.end()
+
+    t = threading.Thread(target=slow_rerun)
+    t.start()
+    started.wait()
+    run_in_thread(lambda: (metrics.begin("rerun", session="s1"), metrics.end()))
+    release.set()
+    t.join()
+    assert [r["status"] for r in metrics.recent] == ["interrupted", "ok"]
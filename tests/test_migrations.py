@@ -0,0 +1,83 @@
+import hashlib
+import sqlite3
+
+from conftest import make_baseline_db, make_jpeg
+
+from cloud_hunter import db
+
+
+def test_baseline_blob_db_migrates_to_current_schema(data_dir):
+    photos = [make_jpeg(i) for i in range(3)]
+    make_baseline_db(db.DB_PATH, [("积云", 10, photos[0]), ("卷云", 15, photos[1]), ("积云", 0, photos[2])])
+
+    with db.db_conn() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db.SCHEMA_MIGRATIONS)
+        rows = conn.execute('SELECT user_id, cloud_name, score, image_hash, phash FROM history ORDER BY id').fetchall()
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(history)')}
+        # v4 之后 image_hash 只在同一用户内唯一
+        unique_indexes = [row for row in conn.execute("PRAGMA index_list(history)") if row[2]]
+        unique_cols = [[col[2] for col in conn.execute(f"PRAGMA index_info({idx[1]})")] for idx in unique_indexes]
+
+    assert [(r[0], r[1], r[2]) for r in rows] == [(db.DEFAULT_USER, "积云", 10), (db.DEFAULT_USER, "卷云", 15), (db.DEFAULT_USER, "积云", 0)]
+    # v2：原图搬进仓库，库里只留 hash (v4 重建表时旧的 BLOB 列一起去掉)
+    assert "image_data" not in columns
+    for r, photo in zip(rows, photos):
+        assert r[3] == hashlib.md5(photo).hexdigest()
+        assert db.get_image_by_hash(r[3]) == photo
+    # v3：迁移时给已有照片补算感知哈希
+    assert all(r[4] is not None for r in rows)
+    assert ["user_id", "image_hash"] in unique_cols
+
+
+def test_migrated_stats_match_history(data_dir):
+    make_baseline_db(db.DB_PATH, [("积云", 10, make_jpeg(1)), ("积云", 0, make_jpeg(2)), ("彩虹", 35, make_jpeg(3))])
+
+    stats = db.get_collection_stats(db.DEFAULT_USER)
+    total_score, total_obs, species_count, tier_counts, species_best = stats
+    assert (total_score, total_obs, species_count) == (45, 3, 2)
+    assert species_best == {"积云": 10, "彩虹": 35}
+    assert tier_counts["SR"] == 1 and tier_counts["N"] == 1
+
+
+def test_migrations_are_idempotent(data_dir):
+    make_baseline_db(db.DB_PATH, [("积云", 10, make_jpeg(1))])
+    db.get_db_pool()
+    db.get_db_pool.clear()
+
+    # 第二次启动不会重跑已经执行过的迁移
+    with db.db_conn() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db.SCHEMA_MIGRATIONS)
+        assert conn.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 1
+
+
+def test_pool_commits_on_success_and_rolls_back_on_error(data_dir):
+    with db.db_conn() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == "wal"
+        conn.execute("INSERT INTO app_meta (key, value) VALUES ('kept', '1')")
+    try:
+        with db.db_conn() as conn:
+            conn.execute("INSERT INTO app_meta (key, value) VALUES ('dropped', '1')")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    with db.db_conn() as conn:
+        keys = {row[0] for row in conn.execute('SELECT key FROM app_meta')}
+    assert "kept" in keys and "dropped" not in keys
+
+
+def test_migrations_resume_from_recorded_version(data_dir):
+    make_baseline_db(db.DB_PATH, [("积云", 10, make_jpeg(1))])
+    conn = sqlite3.connect(db.DB_PATH)
+    db.init_db(conn)
+    for step in db.SCHEMA_MIGRATIONS[:2]:
+        if callable(step): step(conn)
+        else:
+            for sql in step: conn.execute(sql)
+    conn.execute('PRAGMA user_version = 2')
+    conn.commit()
+    conn.close()
+
+    # 只跑 v3 之后的迁移，已经搬走的原图不会再搬一次
+    with db.db_conn() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db.SCHEMA_MIGRATIONS)
+        assert conn.execute('SELECT user_id, phash IS NOT NULL FROM history').fetchall() == [(db.DEFAULT_USER, 1)]
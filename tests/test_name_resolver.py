@@ -0,0 +1,53 @@
+import pytest
+
+from cloud_hunter.scoring import (
+    CLOUD_ALIASES, CLOUD_TRANSLATIONS, OFFICIAL_SCORES, AhoCorasick, CloudNameResolver, get_name_resolver, get_official_score,
+)
+
+
+@pytest.fixture
+def resolver():
+    return get_name_resolver()
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    matcher = AhoCorasick({"he": 1, "she": 2, "his": 3, "hers": 4})
+    assert sorted(matcher.find_all("ushers")) == [("he", 1), ("hers", 4), ("she", 2)]
+    assert list(matcher.find_all("xyz")) == []
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("积云", "积云"),                      # 精确匹配
+    ("Cumulonimbus", "积雨云"),            # 英文学名
+    ("cumulonimbus", "积雨云"),            # 大小写不敏感
+    ("鱼鳞云", "卷积云"),                  # 俗名
+    ("马尾云", "卷云"),                    # 别名指向非标准名时再收敛到标准名
+    ("Double Rainbow", "双彩虹"),
+    ("一道双彩虹", "双彩虹"),              # 包含关系兜底取最长的标准名
+    ("波状高积云", "波状高积云"),
+    ("可能是波状高积云吧", "波状高积云"),
+    ("Altocumulus lenticularis", "荚状云"),  # 规范化文本里最长的别名
+    ("a cumulonimbus cloud", "积雨云"),
+    ("Cirrus uncinus", "卷云"),            # 英文名对应的中文名不在计分表里
+    ("尾迹", "飞机尾迹"),                  # 输入是某个标准名的一部分
+])
+def test_resolves_model_names(resolver, name, expected):
+    assert resolver.resolve(name) == expected
+    assert expected in OFFICIAL_SCORES
+
+
+@pytest.mark.parametrize("name", ["", None, "一只猫", "UFO"])
+def test_unknown_names_do_not_resolve(resolver, name):
+    assert resolver.resolve(name) is None
+
+
+def test_every_official_name_and_alias_resolves_to_an_official_name():
+    resolver = CloudNameResolver(OFFICIAL_SCORES, CLOUD_TRANSLATIONS, CLOUD_ALIASES)
+    for name in OFFICIAL_SCORES: assert resolver.resolve(name) == name
+    for alias in list(CLOUD_ALIASES) + list(CLOUD_TRANSLATIONS.values()):
+        assert resolver.resolve(alias) in OFFICIAL_SCORES
+
+
+def test_official_score_falls_back_to_model_suggestion():
+    assert get_official_score("Rainbow", 5) == OFFICIAL_SCORES["彩虹"]
+    assert get_official_score("一只猫", 17) == 17
@@ -0,0 +1,77 @@
+import hashlib
+import io
+import random
+
+import numpy as np
+from PIL import Image
+
+from cloud_hunter import db
+from cloud_hunter.images import compute_phash, phash_is_informative
+
+
+def encode(arr, quality=85):
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def smooth_sky(top, bottom, noise=3, seed=0, size=(480, 320)):
+    t = np.linspace(0, 1, size[1])[:, None, None]
+    arr = np.broadcast_to(np.array(top) * (1 - t) + np.array(bottom) * t, (size[1], size[0], 3))
+    return encode(arr + np.random.default_rng(seed).normal(0, noise, arr.shape))
+
+
+def textured_photo(seed, size=(480, 320)):
+    blocks = np.random.default_rng(seed).integers(0, 256, (8, 12, 3))
+    return encode(np.kron(blocks, np.ones((size[1] // 8, size[0] // 12, 1))))
+
+
+def test_bktree_matches_linear_scan():
+    rng = random.Random(7)
+    tree = db.BKTree()
+    items = [(rng.getrandbits(64), f"h{i}") for i in range(300)]
+    for phash, item in items: tree.add(phash, item)
+    assert tree.size == len(items)
+
+    for query in [items[0][0], items[42][0] ^ 0b1011, rng.getrandbits(64)]:
+        for radius in (0, 3, 10):
+            expected = sorted(((phash ^ query).bit_count(), item) for phash, item in items if (phash ^ query).bit_count() <= radius)
+            assert tree.search(query, radius) == expected
+
+
+def test_bktree_empty_and_equal_hashes():
+    tree = db.BKTree()
+    assert tree.search(0, 64) == []
+    tree.add(5, "a")
+    tree.add(5, "b")
+    assert tree.search(5, 0) == [(0, "a"), (0, "b")]
+
+
+
+def save(user_id, image_bytes):
+    image_hash = hashlib.md5(image_bytes).hexdigest()
+    assert db.save_to_db(user_id, "晴空", "N", 1, "科普", "天气", image_bytes, image_hash)
+    return image_hash
+
+
+def test_featureless_skies_are_not_near_duplicates(data_dir):
+    blue, dusk = smooth_sky((70, 130, 220), (180, 210, 245)), smooth_sky((230, 120, 60), (250, 200, 150), seed=1)
+    # 两片天的 dHash 只差几位，按汉明距离算本来会被当成同一张
+    assert (compute_phash(blue) ^ compute_phash(dusk)).bit_count() <= db.PHASH_THRESHOLD
+    assert not phash_is_informative(compute_phash(blue))
+    save("alice", blue)
+    assert db.find_near_duplicate("alice", compute_phash(dusk)) is None
+
+
+def test_textured_reencode_is_still_a_near_duplicate(data_dir):
+    original = textured_photo(3)
+    image_hash = save("alice", original)
+    reencoded = Image.open(io.BytesIO(original)).resize((400, 266))
+    buf = io.BytesIO()
+    reencoded.save(buf, format="JPEG", quality=60)
+
+    phash = compute_phash(buf.getvalue())
+    assert phash_is_informative(phash)
+    found = db.find_near_duplicate("alice", phash)
+    assert found is not None and found[0] == image_hash
+    assert db.find_near_duplicate("alice", compute_phash(textured_photo(4))) is None
@@ -0,0 +1,36 @@
+from conftest import assert_stats_consistent, insert_rows
+
+from cloud_hunter import db
+
+
+def test_preview_lists_changes_without_writing(data_dir):
+    # 旧计分表留下的分数/等级；0 分的非首发记录保持不动，计分表里没有的名字只按分数校正等级
+    insert_rows("alice", [("积云", 99, "a1"), ("Rainbow", 7, "a2"), ("积云", 0, "a3"), ("一只猫", 12, "a4")])
+    diff = db.preview_legacy_scores("alice")
+    assert sorted((row[1], row[2], row[4], row[5]) for row in diff) == [("Rainbow", 7, 35, "SR"), ("一只猫", 12, 12, "R"), ("积云", 99, 10, "N")]
+    assert db.get_collection_stats("alice")[4] == {"积云": 99, "Rainbow": 7, "一只猫": 12}
+
+
+def test_fix_rewrites_scores_tiers_and_stats(data_dir):
+    insert_rows("alice", [("积云", 99, "a1"), ("Rainbow", 7, "a2")])
+    assert db.fix_legacy_scores_forced("alice") == 2
+    with db.db_conn() as conn:
+        assert sorted(conn.execute('SELECT cloud_name, score, tier FROM history').fetchall()) == [("Rainbow", 35, "SR"), ("积云", 10, "N")]
+    assert_stats_consistent("alice")
+    assert db.preview_legacy_scores("alice") == []
+
+
+def test_tier_only_mismatch_is_fixed(data_dir):
+    insert_rows("alice", [("积云", 10, "a1")])
+    with db.db_conn() as conn:
+        conn.execute("UPDATE history SET tier = 'UR'")
+    assert [(row[3], row[5]) for row in db.preview_legacy_scores("alice")] == [("UR", "N")]
+
+
+def test_global_rescore_covers_all_users(data_dir):
+    insert_rows("alice", [("积云", 99, "a1")])
+    insert_rows("bob", [("积云", 99, "b1")])
+    with db.db_conn() as conn:
+        assert len(db.rescore_history(conn)) == 2
+    assert_stats_consistent("alice")
+    assert_stats_consistent("bob")
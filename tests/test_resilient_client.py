@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+from cloud_hunter.model import CircuitBreaker, ModelUnavailableError, ResilientModelClient
+
+
+def open_breaker(threshold=2, cooldown=0.05):
+    breaker = CircuitBreaker(threshold, cooldown)
+    for _ in range(threshold): breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(3, 60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_probe_reopens_without_counting_a_new_trip():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_released_probe_keeps_the_breaker_open():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    # 没算成功：仍然是断开的，只是下一个请求可以再试探一次
+    assert breaker.opened_at is not None
+    assert breaker.allow()
+
+
+class FlakyCompletions:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors: raise self.errors.pop(0)
+        return "ok"
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+def make_client(errors, **kwargs):
+    completions = FlakyCompletions(errors)
+    raw = type("Raw", (), {})()
+    raw.chat = type("Chat", (), {})()
+    raw.chat.completions = completions
+    return ResilientModelClient(raw, backoff_base=0.001, backoff_max=0.001, **kwargs), completions
+
+
+def test_client_retries_retryable_errors():
+    client, completions = make_client([StatusError(503), StatusError(429)])
+    assert client.chat.completions.create(model="m") == "ok"
+    assert completions.calls == 3
+    assert client.stats()["retries"] == 2 and client.stats()["breaker"] == "closed"
+
+
+def test_non_retryable_error_during_probe_does_not_close_the_breaker():
+    breaker = open_breaker()
+    client, completions = make_client([StatusError(400)], breaker=breaker)
+    time.sleep(0.06)
+    with pytest.raises(StatusError):
+        client.chat.completions.create(model="m")
+    assert completions.calls == 1
+    assert breaker.opened_at is not None
+
+
+def test_open_breaker_rejects_without_calling():
+    client, completions = make_client([], breaker=open_breaker(cooldown=60))
+    with pytest.raises(ModelUnavailableError):
+        client.chat.completions.create(model="m")
+    assert completions.calls == 0
+
+
+def test_errors_while_consuming_a_stream_are_retried():
+    client, completions = make_client([])
+    attempts = []
+
+    def consume(result):
+        attempts.append(result)
+        if len(attempts) == 1: raise StatusError(502)
+        return result.upper()
+
+    assert client.consume_stream(consume, model="m", stream=True) == "OK"
+    assert completions.calls == 2 and client.stats()["failures"] == 1
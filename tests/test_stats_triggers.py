@@ -0,0 +1,43 @@
+from conftest import assert_stats_consistent, insert_rows
+
+from cloud_hunter import db
+
+
+def test_triggers_follow_insert_and_delete(data_dir):
+    insert_rows("alice", [("积云", 10, "a1"), ("积云", 0, "a2"), ("彩虹", 35, "a3")])
+    assert_stats_consistent("alice")
+    assert db.get_collection_stats("alice")[:3] == (45, 3, 2)
+
+    with db.db_conn() as conn:
+        record_id = conn.execute("SELECT id FROM history WHERE image_hash = 'a3'").fetchone()[0]
+    db.delete_record("alice", record_id)
+    assert_stats_consistent("alice")
+    with db.db_conn() as conn:
+        # 最后一条删掉后物种行一起消失
+        assert conn.execute("SELECT 1 FROM species_stats WHERE cloud_name = '彩虹'").fetchone() is None
+
+
+def test_best_score_drops_back_when_the_best_record_is_deleted(data_dir):
+    insert_rows("alice", [("积云", 5, "a1"), ("积云", 10, "a2")])
+    with db.db_conn() as conn:
+        record_id = conn.execute("SELECT id FROM history WHERE image_hash = 'a2'").fetchone()[0]
+    db.delete_record("alice", record_id)
+    assert db.get_collection_stats("alice")[4] == {"积云": 5}
+    assert_stats_consistent("alice")
+
+
+def test_triggers_follow_score_updates(data_dir):
+    insert_rows("alice", [("积云", 10, "a1"), ("卷云", 15, "a2")])
+    with db.db_conn() as conn:
+        conn.execute("UPDATE history SET score = 0 WHERE image_hash = 'a1'")
+        conn.execute("UPDATE history SET cloud_name = '积云' WHERE image_hash = 'a2'")
+    assert db.get_collection_stats("alice")[4] == {"积云": 15}
+    assert_stats_consistent("alice")
+
+
+def test_rebuild_matches_trigger_maintained_stats(data_dir):
+    insert_rows("alice", [("积云", 10, "a1"), ("彩虹", 35, "a2"), ("积云", 0, "a3")])
+    before = db.get_collection_stats("alice")
+    with db.db_conn() as conn:
+        db.rebuild_collection_stats(conn.cursor())
+    assert db.get_collection_stats("alice") == before
@@ -0,0 +1,33 @@
+from cloud_hunter.model import IncrementalJSONFields
+
+
+def feed_all(parser, chunks):
+    seen = []
+    for chunk in chunks:
+        if parser.feed(chunk): seen.append(dict(parser.fields))
+    return seen
+
+
+def test_fields_become_available_as_soon_as_they_are_complete():
+    parser = IncrementalJSONFields()
+    seen = feed_all(parser, ['```json\n{"is_c', 'loud": true, "cloud_', 'name": "积', '云", "score_sugges', 'tion": 1', '5}\n```'])
+    assert seen[0] == {"is_cloud": True}
+    assert seen[1] == {"is_cloud": True, "cloud_name": "积云"}
+    # 数字要等到后面的逗号或右括号才算完整，"1" 不会被当成结果
+    assert seen[-1]["score_suggestion"] == 15
+    assert all(s.get("score_suggestion") in (None, 15) for s in seen)
+
+
+def test_escaped_strings_and_chatter_are_handled():
+    parser = IncrementalJSONFields()
+    feed_all(parser, ['好的，结果如下：{"science_fact": "含有 \\"引号\\" 的', '文字", "is_cloud": false}'])
+    assert parser.fields == {"science_fact": '含有 "引号" 的文字', "is_cloud": False}
+
+
+def test_feed_reports_nothing_new_for_partial_chunks():
+    parser = IncrementalJSONFields()
+    assert not parser.feed('{"cloud_name": "卷')
+    assert parser.feed('云"')
+    assert not parser.feed(', "score_suggestion": -3')
+    assert parser.feed('}')
+    assert parser.fields == {"cloud_name": "卷云", "score_suggestion": -3}
@@ -0,0 +1,47 @@
+from conftest import assert_stats_consistent, insert_rows
+
+from cloud_hunter import db
+
+
+def test_stats_are_kept_per_user(data_dir):
+    insert_rows("alice", [("积云", 10, "same"), ("彩虹", 35, "a2")])
+    insert_rows("bob", [("积云", 10, "same")])
+    assert_stats_consistent("alice")
+    assert_stats_consistent("bob")
+    assert db.get_collection_stats("bob")[:3] == (10, 1, 1)
+    assert [row[1] for row in db.get_history("bob")] == ["积云"]
+
+
+def test_delete_record_ignores_other_users(data_dir):
+    insert_rows("alice", [("积云", 10, "a1")])
+    with db.db_conn() as conn:
+        record_id = conn.execute("SELECT id FROM history").fetchone()[0]
+    db.delete_record("bob", record_id)
+    assert db.get_collection_stats("alice")[:2] == (10, 1)
+
+
+def test_shared_photo_survives_one_users_delete(data_dir):
+    image_hash = "ab" * 16
+    db.get_image_store().put(image_hash, b"photo")
+    insert_rows("alice", [("积云", 10, image_hash)])
+    insert_rows("bob", [("积云", 10, image_hash)])
+    with db.db_conn() as conn:
+        record_id = conn.execute("SELECT id FROM history WHERE user_id = 'alice'").fetchone()[0]
+    db.delete_record("alice", record_id)
+    assert db.get_image_by_hash(image_hash) == b"photo"
+
+
+def test_manual_rescore_only_touches_the_current_user(data_dir):
+    insert_rows("alice", [("积云", 99, "a1")])
+    insert_rows("bob", [("积云", 99, "b1")])
+    assert [row[1] for row in db.preview_legacy_scores("alice")] == ["积云"]
+    assert db.fix_legacy_scores_forced("alice") == 1
+    assert db.get_collection_stats("alice")[4] == {"积云": 10}
+    assert db.get_collection_stats("bob")[4] == {"积云": 99}
+
+
+def test_first_discovery_is_judged_per_user(data_dir):
+    insert_rows("alice", [("积云", 10, "same")])
+    assert db.save_batch("bob", [("积云", "N", 10, "科普", "天气", "same", 0, None)]) == {"same"}
+    # bob 的第一朵积云照样拿首发分
+    assert db.get_collection_stats("bob")[:2] == (10, 1)